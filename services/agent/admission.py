@@ -0,0 +1,349 @@
+"""
+Admission Control for LLM calls
+
+Begrenser hvor hardt agenten kan kjøre GitHub Models/OpenAI endepunktet:
+
+- TokenBucket for requests per minutt (RPM) og tokens per minutt (TPM)
+- Bøttene synkroniseres mot leverandørens rate-limit headere
+  (x-ratelimit-remaining-*, x-ratelimit-reset-*, retry-after) etter hvert kall
+- Begrenset antall samtidige LLM-kall
+- Prioritetsfiler: "interactive" slippes alltid inn før "batch"
+- Hver forespørsel i kø har en deadline
+- Full kø avvises med en gang (AdmissionRejected -> 503 + Retry-After)
+"""
+
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "batch")
+
+
+class AdmissionRejected(Exception):
+    """LLM-kallet ble ikke sluppet inn (full kø, deadline eller rate limit)."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After verdi i hele sekunder."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse varighet fra rate-limit headere.
+
+    Støtter sekunder ("12", "0.5") og OpenAI-format ("6m0s", "1s", "20ms").
+
+    Returns:
+        Sekunder, eller None hvis verdien mangler eller ikke kan tolkes
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    factors = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(number) * factors[unit] for number, unit in parts)
+
+
+def estimate_tokens(*payloads: Any, completion_tokens: int = 500) -> int:
+    """
+    Grovt estimat av tokens for et LLM-kall (ca. 4 tegn per token).
+
+    Args:
+        payloads: Meldinger, tools o.l. som sendes til modellen
+        completion_tokens: Antatt lengde på svaret
+
+    Returns:
+        Estimert antall tokens
+    """
+    characters = sum(len(json.dumps(p, ensure_ascii=False, default=str)) for p in payloads if p)
+    return characters // 4 + completion_tokens
+
+
+class TokenBucket:
+    """Token bucket som fylles kontinuerlig opp til kapasitet per minutt."""
+
+    def __init__(self, per_minute: float):
+        """
+        Initialiser bøtte.
+
+        Args:
+            per_minute: Kapasitet og påfyllingsrate per minutt
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Sekunder til amount tokens er tilgjengelig (0 hvis nå)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        # Forespørsler større enn hele bøtta slippes inn når den er full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Trekk amount tokens (kan gå negativt ved underestimat)."""
+        self._refill(time.monotonic())
+        self.tokens -= amount
+
+    def sync(self, limit: Optional[float], remaining: Optional[float], reset: Optional[float]):
+        """
+        Synkroniser med leverandørens syn på kvoten.
+
+        Args:
+            limit: Kapasitet per minutt fra x-ratelimit-limit-*
+            remaining: Gjenstående fra x-ratelimit-remaining-*
+            reset: Sekunder til kvoten er fylt opp igjen fra x-ratelimit-reset-*
+        """
+        self._refill(time.monotonic())
+        if limit:
+            self.capacity = float(limit)
+        self.rate = self.capacity / 60.0
+        if remaining is not None:
+            self.tokens = min(self.capacity, float(remaining))
+            if reset:
+                # Leverandøren fyller opp kvoten i løpet av reset sekunder
+                self.rate = max(self.rate, (self.capacity - self.tokens) / reset)
+
+    def block(self, seconds: float):
+        """Blokker bøtta i seconds sekunder (f.eks. etter 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """RPM og TPM bøtter styrt av leverandørens rate-limit headere."""
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 150000):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.rate_limited = 0
+
+    def wait_time(self, estimated_tokens: int) -> float:
+        """Sekunder til et kall med estimated_tokens kan slippes inn."""
+        return max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+
+    def consume(self, estimated_tokens: int):
+        self.requests.consume(1)
+        self.tokens.consume(estimated_tokens)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Oppdater bøttene fra x-ratelimit-* headere i en respons."""
+        def number(name: str) -> Optional[float]:
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        self.requests.sync(
+            number("x-ratelimit-limit-requests"),
+            number("x-ratelimit-remaining-requests"),
+            parse_duration(headers.get("x-ratelimit-reset-requests"))
+        )
+        self.tokens.sync(
+            number("x-ratelimit-limit-tokens"),
+            number("x-ratelimit-remaining-tokens"),
+            parse_duration(headers.get("x-ratelimit-reset-tokens"))
+        )
+
+    def on_rate_limited(self, headers: Mapping[str, str]) -> float:
+        """
+        Registrer en 429 respons og blokker til leverandøren tillater nye kall.
+
+        Returns:
+            Sekunder til neste forsøk er tillatt
+        """
+        self.rate_limited += 1
+        self.update_from_headers(headers)
+        retry_after = parse_duration(headers.get("retry-after-ms"))
+        if retry_after is not None:
+            retry_after /= 1000.0
+        else:
+            retry_after = parse_duration(headers.get("retry-after"))
+        if retry_after is None:
+            retry_after = 10.0
+        self.requests.block(retry_after)
+        return retry_after
+
+
+class AdmissionController:
+    """Prioritetskø med deadlines foran LLM-kall."""
+
+    def __init__(self, limiter: Optional[RateLimiter] = None,
+                 max_concurrency: int = 8,
+                 max_queue: int = 64,
+                 deadlines: Optional[Dict[str, float]] = None):
+        """
+        Initialiser admission controller.
+
+        Args:
+            limiter: RPM/TPM limiter
+            max_concurrency: Maksimalt antall samtidige LLM-kall
+            max_queue: Maksimalt antall ventende kall (alle prioriteter)
+            deadlines: Maksimal ventetid i kø per prioritet i sekunder
+        """
+        self.limiter = limiter or RateLimiter()
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.deadlines = deadlines or {"interactive": 15.0, "batch": 120.0}
+
+        self._queues: Dict[str, Deque[Dict[str, Any]]] = {p: deque() for p in PRIORITIES}
+        self._active = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self.admitted = {p: 0 for p in PRIORITIES}
+        self.rejected = {p: 0 for p in PRIORITIES}
+        self.expired = {p: 0 for p in PRIORITIES}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _estimate_retry_after(self) -> float:
+        return max(1.0, self.limiter.wait_time(0))
+
+    def check_capacity(self, priority: str = "interactive") -> str:
+        """
+        Avvis tidlig hvis køen er full.
+
+        Args:
+            priority: "interactive" eller "batch" (ukjente verdier regnes som "interactive")
+
+        Returns:
+            Prioriteten kallet får
+
+        Raises:
+            AdmissionRejected: Hvis køen er full
+        """
+        if priority not in self._queues:
+            priority = "interactive"
+        if self.queued >= self.max_queue:
+            self.rejected[priority] += 1
+            raise AdmissionRejected("LLM-køen er full", self._estimate_retry_after())
+        return priority
+
+    def _dispatch(self):
+        """Slipp inn ventende kall i prioritert rekkefølge så lenge kapasitet og kvote tillater."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._active < self.max_concurrency:
+            waiter = None
+            for priority in PRIORITIES:
+                queue = self._queues[priority]
+                while queue and queue[0]["future"].done():
+                    queue.popleft()
+                if queue:
+                    waiter = queue[0]
+                    break
+            if waiter is None:
+                return
+
+            wait = self.limiter.wait_time(waiter["tokens"])
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            self._queues[waiter["priority"]].popleft()
+            self.limiter.consume(waiter["tokens"])
+            self._active += 1
+            waiter["future"].set_result(True)
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _abandon(self, waiter: Dict[str, Any]):
+        """Fjern en waiter som ga opp; gi fra seg plassen hvis den allerede var sluppet inn."""
+        future = waiter["future"]
+        if future.done() and not future.cancelled():
+            self._release()
+            return
+        future.cancel()
+        try:
+            self._queues[waiter["priority"]].remove(waiter)
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive", estimated_tokens: int = 1000):
+        """
+        Vent på en plass for et LLM-kall.
+
+        Args:
+            priority: "interactive" eller "batch"
+            estimated_tokens: Estimert antall tokens (prompt + svar)
+
+        Raises:
+            AdmissionRejected: Full kø eller deadline passert
+        """
+        priority = self.check_capacity(priority)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = {"future": future, "priority": priority, "tokens": estimated_tokens}
+        self._queues[priority].append(waiter)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.deadlines.get(priority, 15.0))
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.expired[priority] += 1
+            raise AdmissionRejected("Deadline for LLM-kø passert", self._estimate_retry_after())
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+        self.admitted[priority] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for admission control.
+
+        Returns:
+            Dictionary med kø, aktive kall og tellere per prioritet
+        """
+        return {
+            "active": self._active,
+            "queued": {p: len(q) for p, q in self._queues.items()},
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "expired": dict(self.expired),
+            "rate_limited": self.limiter.rate_limited,
+            "requests_available": round(self.limiter.requests.tokens, 1),
+            "tokens_available": round(self.limiter.tokens.tokens)
+        }
@@ -17,15 +17,31 @@ For MCP spec, se: https://modelcontextprotocol.io/specification/2025-11-25
 """
 
 import asyncio
+import hashlib
 import json
 import logging
 import os
+import time
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Literal, Optional, Tuple
 
 import httpx
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
+from async_memory import AsyncConversationMemory
+from admission import AdmissionController, AdmissionRejected, RateLimiter, estimate_tokens
+from batch import current_deduplicator, run_batch
 from conversation_memory import ConversationMemory
+from fast_path import FastPath
+from response_cache import ResponseCache
+from speculation import Speculator
+from timings import LatencyStats, PromptCacheStats, TurnTimings, usage_to_dict
+from retention import RetentionTask
+from archive import ConversationArchive
+from stats_reconciler import StatsReconciler
+from tool_discovery import ToolDiscovery
+from tool_encoding import create_encoder
+from tracing import Tracer
+from write_behind import WriteBehindWriter
 
 # Konfigurer logging
 logging.basicConfig(level=logging.INFO)
@@ -34,6 +50,44 @@ logger = logging.getLogger(__name__)
 # Global agent instance for API server
 agent_instance = None
 
+# Distribuert sporing (styres av TRACE_* miljøvariabler)
+tracer = Tracer.from_env("travel-agent")
+
+
+# System prompt er en konstant slik at prefikset i hvert LLM-kall er byte-identisk
+# (forutsetning for leverandørens prompt caching). Ikke sett inn dato, sesjon o.l. her.
+SYSTEM_PROMPT = """Du er Ingrid, en vennlig og kompetent agent fra Ingrids Reisetjenester. 
+
+Du har kun lov å bruke ett verktøy, og det er det for å hente værinformasjon i hele verden. Hvis brukeren spør om noe annet enn vær, skal forespørselen avvises på en hyggelig måte.
+
+Du er fra Bergen og elsker regn, og dette passer du på å nevne i samtalen hvis det passer seg.
+Utover det, vær vennlig, personlig og hjelpsom - du representerer Ingrids Reisetjenester.
+Svar på norsk med mindre brukeren spør på et annet språk.
+
+MERK: Dette er LAB03 versjon med dynamisk tools discovery."""
+
+
+def canonical_tools(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sorter tools på navn og alle nøkler alfabetisk.
+
+    Samme manifest gir dermed alltid samme bytes i forespørselen, uavhengig av
+    rekkefølgen MCP serveren returnerer tools og schema-felt i.
+    """
+    return sorted(
+        (json.loads(json.dumps(tool, sort_keys=True)) for tool in tools),
+        key=lambda tool: tool["function"]["name"]
+    )
+
+
+def is_tool_error(tool_result: str) -> bool:
+    """Sjekk om et tool-resultat fra call_mcp_tool er en feilmelding."""
+    try:
+        data = json.loads(tool_result)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(data, dict) and "error" in data
+
 class MicroserviceAgent:
     """
     AI Agent som bruker MCP server via HTTP API.
@@ -48,7 +102,10 @@ class MicroserviceAgent:
         # Initialiser OpenAI klient
         # Støtter både GitHub Models (standard for workshop) og OpenAI API
         base_url = os.getenv("OPENAI_BASE_URL", "https://models.github.ai/inference")
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url)
+        # max_retries=0: SDK-ens egne retries (429/5xx med egen backoff) ville skjedd
+        # mens admission-plassen holdes, og forbi RateLimiter og deadline-budsjettet.
+        # 429 går i stedet til admission control (AdmissionRejected med Retry-After)
+        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url, max_retries=0)
         logger.info(f"OpenAI client configured with base_url: {base_url}")
         
         # MCP server URL - bruk environment variable hvis tilgjengelig
@@ -57,8 +114,57 @@ class MicroserviceAgent:
         self.mcp_server_url = mcp_server_url
         
         # Initialiser hukommelse
-        self.memory = ConversationMemory(memory_db_path)
+        self.memory = ConversationMemory(
+            memory_db_path,
+            compact=os.getenv("MEMORY_COMPACT_STORAGE", "false").lower() == "true",
+            hot_tier_bytes=int(os.getenv("MEMORY_HOT_TIER_MB", "32")) * 1024 * 1024,
+            hot_validate=os.getenv("MEMORY_HOT_TIER_VALIDATE", "true").lower() == "true",
+            # Retention krymper filen med incremental_vacuum (nye databaser; eksisterende: make db-enable-vacuum)
+            auto_vacuum=os.getenv("RETENTION_ENABLED", "false").lower() == "true",
+            readers=int(os.getenv("MEMORY_DB_READERS", "4")),
+            mmap_size=int(os.getenv("MEMORY_DB_MMAP_MB", "256")) * 1024 * 1024,
+            cache_size_kib=int(os.getenv("MEMORY_DB_CACHE_MB", "16")) * 1024
+        )
+        # Async API: SQLite-kall kjøres på egne tråder og blokkerer ikke event loop
+        self.db = AsyncConversationMemory(
+            self.memory,
+            max_workers=int(os.getenv("MEMORY_DB_READERS", "4")),
+            max_pending=int(os.getenv("MEMORY_DB_MAX_PENDING", "256"))
+        )
+        # Gjeldende sesjon for CLI-modus og process_query uten session_id (HTTP API-et oppgir alltid sesjon)
         self.current_session_id = None
+
+        # Write-behind: meldinger skrives i batcher i bakgrunnen
+        self.writer = None
+        if os.getenv("MEMORY_WRITE_BEHIND", "true").lower() == "true":
+            self.writer = WriteBehindWriter(
+                self.memory,
+                batch_size=int(os.getenv("MEMORY_FLUSH_BATCH_SIZE", "50")),
+                flush_interval=float(os.getenv("MEMORY_FLUSH_INTERVAL_MS", "200")) / 1000,
+                tracer=tracer,
+                run=self.db.run
+            )
+
+        # Sletting av gamle samtaler i batcher i bakgrunnen (startes i lifespan)
+        self.retention = None
+        if os.getenv("RETENTION_ENABLED", "false").lower() == "true":
+            self.retention = RetentionTask(
+                self.db,
+                days=float(os.getenv("RETENTION_DAYS", "30")),
+                interval=float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600")),
+                batch_size=int(os.getenv("RETENTION_BATCH_SIZE", "500")),
+                pause=float(os.getenv("RETENTION_PAUSE_MS", "50")) / 1000,
+                vacuum_pages=int(os.getenv("RETENTION_VACUUM_PAGES", "256")),
+                # Med ARCHIVE_DIR flyttes utløpte sesjoner til månedsfiler i stedet for å slettes
+                archive=ConversationArchive(os.environ["ARCHIVE_DIR"]) if os.getenv("ARCHIVE_DIR") else None
+            )
+        # Sjelden avstemming av statistikktellerne mot tabellene (0 slår av)
+        self.stats_reconciler = None
+        reconcile_interval = float(os.getenv("STATS_RECONCILE_INTERVAL_SECONDS", "3600"))
+        if reconcile_interval > 0:
+            self.stats_reconciler = StatsReconciler(self.db, interval=reconcile_interval)
+        # Indeksering av eksisterende meldinger når søkeindeksen er ny (start_search_backfill)
+        self._search_backfill: Optional[asyncio.Task] = None
         
         # HTTP klient for MCP kall
         self.http_client = httpx.AsyncClient()
@@ -67,6 +173,65 @@ class MicroserviceAgent:
         self.tools = []
         # Tool endpoint mapping lagres separat
         self.tool_endpoints = {}
+        # Hash av siste tools manifest (ETag for revalidering)
+        self.manifest_hash = None
+        # Hash av system prompt + tools, dvs. prefikset leverandøren kan cache
+        self.prompt_prefix_hash = None
+        self.prompt_cache = PromptCacheStats()
+
+        # Tools lastes og revalideres i bakgrunnen (start_discovery)
+        self.discovery = ToolDiscovery(
+            self.load_tools_from_mcp_server,
+            refresh_interval=float(os.getenv("TOOLS_REFRESH_SECONDS", "30")),
+            max_backoff=float(os.getenv("TOOLS_DISCOVERY_MAX_BACKOFF_SECONDS", "30"))
+        )
+        # Maksimal ventetid på tools for et spørsmål som kommer før de er lastet
+        self.tools_wait_seconds = float(os.getenv("TOOLS_WAIT_SECONDS", "2"))
+
+        # Response cache for gjentatte spørsmål (hopper over begge LLM-kall)
+        self.response_cache = None
+        if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true":
+            self.response_cache = ResponseCache(
+                ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600")),
+                max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+            )
+
+        # Admission control for LLM-kall (RPM/TPM, prioritetskø, deadlines)
+        self.admission = AdmissionController(
+            limiter=RateLimiter(
+                requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60")),
+                tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "150000"))
+            ),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "64")),
+            deadlines={
+                "interactive": float(os.getenv("LLM_QUEUE_DEADLINE_INTERACTIVE", "15")),
+                "batch": float(os.getenv("LLM_QUEUE_DEADLINE_BATCH", "120"))
+            }
+        )
+
+        # Koding av tool-resultater før de sendes til LLM (færre input tokens)
+        deny_list = os.getenv("TOOL_RESULT_DENY_LIST")
+        self.tool_encoder = create_encoder(
+            os.getenv("TOOL_RESULT_ENCODING", "compact"),
+            deny_list=json.loads(deny_list) if deny_list else None,
+            decimals=int(os.getenv("TOOL_RESULT_DECIMALS", "1"))
+        )
+
+        # Malbaserte svar for enkle værspørsmål (hopper over andre LLM-kall)
+        self.fast_path = None
+        if os.getenv("FAST_PATH_ENABLED", "false").lower() == "true":
+            self.fast_path = FastPath(tool_name=os.getenv("FAST_PATH_TOOL", "get_weather_forecast"))
+
+        # Fasetider per tur for GET /stats/latency
+        self.latency = LatencyStats(max_samples=int(os.getenv("LATENCY_STATS_MAX_SAMPLES", "5000")))
+
+        # Spekulativ tool prefetch parallelt med første LLM-kall (valgfritt)
+        self.speculator = None
+        if os.getenv("SPECULATIVE_TOOLS_ENABLED", "false").lower() == "true":
+            self.speculator = Speculator(
+                tool_name=os.getenv("SPECULATIVE_TOOL", "get_weather_forecast")
+            )
         
         logger.info("MicroserviceAgent initialisert")
     
@@ -87,11 +252,14 @@ class MicroserviceAgent:
 
         HVORDAN DET VIRKER:
         -------------------
-        1. Ved agent oppstart, hent tools manifest fra MCP server via GET /tools
-        2. MCP server returnerer JSON med tool definisjoner (navn, beskrivelse, schema)
-        3. Konverter hver MCP tool til OpenAI function calling format
-        4. Lagre endpoint mappings for senere HTTP kall under tool kjøring
-        5. Agenten er nå klar med alle tilgjengelige tools - INGEN KODEENDRINGER NØDVENDIG!
+        1. ToolDiscovery kaller denne metoden i bakgrunnen ved oppstart (med retry og
+           backoff) og deretter hvert TOOLS_REFRESH_SECONDS sekund
+        2. Vi sender forrige manifest-hash i params._meta.ifNoneMatch. Er manifestet
+           uendret svarer MCP server med _meta.notModified og ingen tools
+        3. Ellers returnerer MCP server JSON med tool definisjoner (navn, beskrivelse, schema)
+        4. Konverter hver MCP tool til OpenAI function calling format
+        5. Bytt ut tools og endpoint mappings i én operasjon (atomisk swap)
+        6. Agenten er nå klar med alle tilgjengelige tools - INGEN KODEENDRINGER NØDVENDIG!
 
         MCP TOOL FORMAT (fra server):
         {
@@ -135,8 +303,8 @@ class MicroserviceAgent:
         ----------
         1. Legg til et nytt tool endpoint i services/mcp-server/app.py
         2. Legg det til i tools manifest i /tools endpointet
-        3. Restart begge tjenestene: docker compose restart mcp-server travel-agent
-        4. Agenten vil automatisk laste og bruke ditt nye tool!
+        3. Restart MCP server: docker compose restart mcp-server
+        4. Innen TOOLS_REFRESH_SECONDS laster agenten ditt nye tool automatisk!
 
         RELATERT KODE:
         --------------
@@ -151,10 +319,15 @@ class MicroserviceAgent:
 
             # STEG 1: Hent tools manifest fra MCP server via JSON-RPC
             # Bygg JSON-RPC 2.0 request for tools/list metoden
+            params = self._jsonrpc_meta()
+            if self.manifest_hash:
+                # Som HTTP If-None-Match: uendret manifest gir svar uten tools
+                params.setdefault("_meta", {})["ifNoneMatch"] = self.manifest_hash
             jsonrpc_request = {
                 "jsonrpc": "2.0",
                 "id": 1,
-                "method": "tools/list"
+                "method": "tools/list",
+                "params": params
             }
 
             response = await self.http_client.post(
@@ -177,8 +350,20 @@ class MicroserviceAgent:
                 logger.error("JSON-RPC response mangler 'result' felt")
                 return False
 
+            meta = mcp_tools.get("_meta") or {}
+            if meta.get("notModified") and self.manifest_hash:
+                logger.debug("Tools manifest uendret")
+                return True
+
             tools_list = mcp_tools.get("tools", [])
 
+            # Eldre MCP servere sender ikke hash - beregn den selv
+            manifest_hash = meta.get("manifestHash") or hashlib.sha256(
+                json.dumps(tools_list, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+            if manifest_hash == self.manifest_hash:
+                return True
+
             # STEG 2: Konverter MCP format til OpenAI function calling format
             # Vi trenger to datastrukturer:
             # - converted_tools: Liste av OpenAI function definisjoner (for chat completions)
@@ -207,11 +392,16 @@ class MicroserviceAgent:
                         "method": tool.get("method", "POST")
                     }
 
-            # STEG 4: Lagre til instansvariabler
-            # Disse vil bli brukt i process_query() og call_mcp_tool()
-            self.tools = converted_tools
-            self.tool_endpoints = tool_endpoints
-            logger.info(f"Lastet {len(self.tools)} tools fra MCP server med {len(self.tool_endpoints)} endpoint mappings")
+            # STEG 4: Lagre til instansvariabler i én tilordning
+            # Pågående turer beholder listen de startet med (se _run_turn)
+            # Kanonisk rekkefølge gir stabilt prefiks for prompt caching
+            converted_tools = canonical_tools(converted_tools)
+            self.tools, self.tool_endpoints, self.manifest_hash = converted_tools, tool_endpoints, manifest_hash
+            self.prompt_prefix_hash = hashlib.sha256(
+                json.dumps([SYSTEM_PROMPT, converted_tools], ensure_ascii=False).encode("utf-8")
+            ).hexdigest()
+            logger.info(f"Lastet {len(self.tools)} tools fra MCP server med {len(self.tool_endpoints)} endpoint mappings "
+                        f"(manifest {manifest_hash[:12]})")
             return True
 
         except Exception as e:
@@ -344,6 +534,20 @@ class MicroserviceAgent:
 
         ============================================================================
         """
+        with tracer.span("mcp.tools/call", kind="CLIENT", tool=tool_name):
+            # I en batch deles like tool-kall mellom elementene
+            deduplicator = current_deduplicator()
+            if deduplicator is not None:
+                return await deduplicator.call(tool_name, arguments, self._call_mcp_tool)
+            return await self._call_mcp_tool(tool_name, arguments)
+
+    def _jsonrpc_meta(self) -> Dict[str, Any]:
+        """JSON-RPC params._meta med traceparent for sporing i MCP server."""
+        traceparent = tracer.traceparent()
+        return {"_meta": {"traceparent": traceparent}} if traceparent else {}
+
+    async def _call_mcp_tool(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """Utfør tools/call mot MCP server (se call_mcp_tool)."""
         try:
             logger.info(f"Kaller MCP server: {tool_name} med args: {arguments}")
 
@@ -354,7 +558,8 @@ class MicroserviceAgent:
                 "method": "tools/call",
                 "params": {
                     "name": tool_name,
-                    "arguments": arguments
+                    "arguments": arguments,
+                    **self._jsonrpc_meta()
                 }
             }
 
@@ -415,91 +620,227 @@ class MicroserviceAgent:
             return json.dumps({"error": str(e)})
     
     def start_new_session(self, session_name: str = None):
-        """Start en ny samtalesession."""
+        """Start en ny samtalesession (gjeldende sesjon for CLI-modus)."""
         if not session_name:
             session_name = f"Microservice_Session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        self.current_session_id = self.memory.create_session(session_name)
+        self.current_session_id = self.memory.create_session(title=session_name)
         logger.info(f"Ny session startet: {self.current_session_id}")
+
+    async def create_session(self, title: Optional[str] = None, user_id: str = "default") -> str:
+        """
+        Opprett en ny sesjon i ConversationMemory uten å blokkere event loop.
+
+        HTTP API-et bruker alltid eksplisitte sesjoner, slik at alle replikaer
+        kan svare for alle sesjoner (tilstanden ligger i databasen).
+        """
+        return await self.db.create_session(user_id=user_id, title=title)
     
-    async def process_query(self, query: str) -> str:
+    async def process_query(self, query: str, priority: str = "interactive",
+                            session_id: Optional[str] = None) -> str:
         """
         Prosesser brukerforespørsel med AI og MCP verktøy.
+
+        Args:
+            query: Brukerens spørsmål
+            priority: "interactive" eller "batch" (admission control)
+            session_id: Sesjon for historikk og lagring (standard: gjeldende sesjon)
+
+        Raises:
+            AdmissionRejected: Hvis LLM-kallet ikke slippes inn (full kø, deadline, 429)
         """
-        if not self.current_session_id:
-            self.start_new_session()
-        
+        result = await self.process_query_detailed(query, priority=priority, session_id=session_id)
+        return result["response"]
+
+    async def process_query_detailed(self, query: str,
+                                     priority: str = "interactive",
+                                     session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Som process_query, men returnerer også fasetider og token-forbruk.
+
+        Returns:
+            {"response": svar, "error": feilmelding eller None,
+             "timings": TurnTimings.to_dict() eller None, "server_timing": header,
+             "session_id": sesjonen turen ble lagret i}
+
+        Raises:
+            AdmissionRejected: Hvis LLM-kallet ikke slippes inn (full kø, deadline, 429)
+        """
+        result = {"response": "", "error": None, "timings": None, "server_timing": None,
+                  "session_id": None}
+        async for event in self._run_turn(query, stream=False, priority=priority, session_id=session_id):
+            if event["event"] == "done":
+                result["response"] = event["data"]["response"]
+                result["timings"] = event["data"]["timings"]
+                result["server_timing"] = event["data"]["server_timing"]
+                result["session_id"] = event["data"]["session_id"]
+            elif event["event"] == "error":
+                result["error"] = event["data"]["message"]
+                result["response"] = f"Beklager, jeg fikk en feil: {event['data']['message']}"
+        return result
+
+    async def process_batch(self, items: List[Dict[str, Any]],
+                            concurrency: int = 8) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Prosesser mange spørsmål samtidig med prioritet "batch" (se batch.py).
+
+        Args:
+            items: Dicts med "query" og valgfritt "id", "session_id" og "title".
+                Uten session_id får elementet en ny sesjon
+            concurrency: Maksimalt antall elementer som behandles samtidig
+
+        Yields:
+            Ett resultat per element etter hvert som de blir ferdige, til slutt en oppsummering
+        """
+        async def process_item(item: Dict[str, Any]) -> Dict[str, Any]:
+            session_id = item.get("session_id") or await self.create_session(
+                title=item.get("title") or item.get("id")
+            )
+            result = await self.process_query_detailed(item["query"], priority="batch",
+                                                       session_id=session_id)
+            output = {
+                "success": result["error"] is None,
+                "session_id": session_id,
+                "response": result["response"],
+                "timings": result["timings"]
+            }
+            if result["error"] is not None:
+                output["error"] = result["error"]
+            return output
+
+        async for result in run_batch(items, process_item, concurrency=concurrency):
+            yield result
+
+    async def process_query_stream(self, query: str,
+                                   priority: str = "interactive",
+                                   session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Prosesser brukerforespørsel og strøm hendelser etter hvert som de skjer.
+
+        Hendelser (dict med "event" og "data"):
+        - tool_start: {"tool": navn, "arguments": {...}} før et MCP tool kalles
+        - tool_end:   {"tool": navn, "error": bool} når tool-kallet er ferdig
+        - token:      {"text": tekstbit} for hver tekstbit fra LLM
+        - done:       {"response": fullt svar, "cache_hit": bool, "timings": {...},
+                       "server_timing": Server-Timing verdi, "session_id": sesjon}
+        - error:      {"message": feilmelding, "retry_after": sekunder (kun ved avvisning)}
+        """
+        async for event in self._run_turn(query, stream=True, priority=priority, session_id=session_id):
+            yield event
+
+    async def _run_turn(self, query: str, stream: bool,
+                        priority: str = "interactive",
+                        session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Felles implementasjon av én samtaletur for process_query og process_query_stream.
+
+        Med stream=False gjøres vanlige LLM-kall og bare tool- og done-hendelser sendes.
+        Med stream=True strømmes LLM-svaret token for token.
+        """
+        if session_id is None:
+            if not self.current_session_id:
+                self.start_new_session()
+            session_id = self.current_session_id
+
+        speculation = None
+        timings = TurnTimings()
+
+        # Spørsmål før tools er lastet venter kort på discovery i stedet for å svare uten tools
+        if not self.tools:
+            await self.discovery.wait_ready(self.tools_wait_seconds)
+        # Samme tools gjennom hele turen selv om manifestet byttes underveis
+        tools = self.tools
+
         try:
-            # Hent samtalehistorikk
-            history = self.memory.get_conversation_history(self.current_session_id)
+            # Hent samtalehistorikk (fra hot tier, sjekket mot SQLite)
+            with timings.phase("history"):
+                history_messages, history = await self._session_messages(session_id)
+
+            # Sjekk response cache før vi bruker LLM. Historikken er del av nøkkelen,
+            # så svar bygget på en sesjons kontekst aldri gis til andre sesjoner
+            cache_key = None
+            if self.response_cache:
+                cache_key = self.response_cache.make_key(query, session_id, history_messages)
+                cached_answer = self.response_cache.get(cache_key)
+                if cached_answer is not None:
+                    logger.info("Response cache treff, hopper over LLM-kall")
+                    with timings.phase("persist"):
+                        await self._save_turn(session_id, query, cached_answer, cache_hit=True, timings=timings)
+                    if stream:
+                        yield {"event": "token", "data": {"text": cached_answer}}
+                    yield {"event": "done", "data": self._done(cached_answer, True, timings, session_id)}
+                    return
             
             # Bygg meldinger for OpenAI
             messages = [
                 {
                     "role": "system",
-                    "content": """Du er Ingrid, en vennlig og kompetent agent fra Ingrids Reisetjenester. 
-
-Du har kun lov å bruke ett verktøy, og det er det for å hente værinformasjon i hele verden. Hvis brukeren spør om noe annet enn vær, skal forespørselen avvises på en hyggelig måte.
-
-Du er fra Bergen og elsker regn, og dette passer du på å nevne i samtalen hvis det passer seg.
-Utover det, vær vennlig, personlig og hjelpsom - du representerer Ingrids Reisetjenester.
-Svar på norsk med mindre brukeren spør på et annet språk.
-
-MERK: Dette er LAB03 versjon med dynamisk tools discovery."""
+                    "content": SYSTEM_PROMPT
                 }
             ]
             
-            # Legg til samtalehistorikk
-            for msg in history:
-                if msg["role"] == "user":
-                    messages.append({"role": "user", "content": msg["content"]})
-                elif msg["role"] == "assistant":
-                    messages.append({"role": "assistant", "content": msg["content"]})
+            # Legg til samtalehistorikk i lagret rekkefølge (eldste først) - nye
+            # meldinger legges bare til på slutten, så tidligere turer forblir prefiks
+            messages.extend(history_messages)
             
             # Legg til ny brukermelding
             messages.append({"role": "user", "content": query})
             
+            # Start spekulativt tool-kall mens LLM bestemmer seg
+            if self.speculator and any(
+                tool["function"]["name"] == self.speculator.tool_name for tool in tools
+            ):
+                speculation = self.speculator.start(query, history, self.call_mcp_tool)
+
             # Første AI-kall med OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                tools=self.tools,
-                tool_choice="auto"
-            )
-            
-            response_message = response.choices[0].message
+            response_message = {}
+            with timings.phase("llm_1"):
+                async for token in self._chat_completion(messages, response_message, stream=stream,
+                                                         priority=priority,
+                                                         tools=tools, tool_choice="auto"):
+                    yield {"event": "token", "data": {"text": token}}
+            timings.add_usage(response_message["usage"])
 
             # Håndter verktøykall
             tool_calls_made = None
+            used_fast_path = False
             tool_results = []
+            # Fulle tool-resultater for response cache (metadata trunkeres)
+            full_tool_results = []
 
-            if response_message.tool_calls:
+            if response_message["tool_calls"]:
                 # Lagre tool calls informasjon
-                tool_calls_made = [
-                    {
-                        "id": tc.id,
-                        "type": tc.type,
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
-                        }
-                    }
-                    for tc in response_message.tool_calls
-                ]
+                tool_calls_made = response_message["tool_calls"]
 
                 # Legg til assistant melding med tool calls
                 messages.append({
                     "role": "assistant",
-                    "content": response_message.content,
+                    "content": response_message["content"],
                     "tool_calls": tool_calls_made
                 })
 
-                for tool_call in response_message.tool_calls:
-                    function_name = tool_call.function.name
-                    arguments = json.loads(tool_call.function.arguments)
+                for tool_call in tool_calls_made:
+                    function_name = tool_call["function"]["name"]
+                    arguments = json.loads(tool_call["function"]["arguments"])
+
+                    yield {"event": "tool_start", "data": {"tool": function_name, "arguments": arguments}}
+
+                    # Gjenbruk spekulativt resultat, ellers kall MCP server
+                    tool_result = None
+                    with timings.phase(f"tool_{function_name}"):
+                        if self.speculator:
+                            tool_result = await self.speculator.take(speculation, function_name, arguments)
+                        if tool_result is None:
+                            tool_result = await self.call_mcp_tool(function_name, arguments)
+                    full_tool_results.append({
+                        "tool": function_name,
+                        "arguments": arguments,
+                        "result": tool_result
+                    })
+                    if self.response_cache:
+                        self.response_cache.observe_tool_result(function_name, arguments, tool_result)
 
-                    # Kall MCP server
-                    tool_result = await self.call_mcp_tool(function_name, arguments)
+                    yield {"event": "tool_end", "data": {"tool": function_name, "error": is_tool_error(tool_result)}}
 
                     # Lagre tool result for metadata
                     tool_results.append({
@@ -510,58 +851,296 @@ MERK: Dette er LAB03 versjon med dynamisk tools discovery."""
 
                     messages.append({
                         "role": "tool",
-                        "content": tool_result,
-                        "tool_call_id": tool_call.id
+                        "content": self.tool_encoder.encode(function_name, tool_result),
+                        "tool_call_id": tool_call["id"]
                     })
 
-                logger.info("Verktøykall fullført, henter endelig svar...")
-
-                # Få endelig svar med OpenAI
-                final_response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages
-                )
-
-                final_answer = final_response.choices[0].message.content
+                # Enkle værspørsmål: malbasert svar i stedet for andre LLM-kall
+                if self.fast_path:
+                    final_answer = self.fast_path.answer(
+                        query, tool_calls_made, [r["result"] for r in full_tool_results]
+                    )
+                    used_fast_path = final_answer is not None
+
+                if used_fast_path:
+                    if stream:
+                        yield {"event": "token", "data": {"text": final_answer}}
+                else:
+                    logger.info("Verktøykall fullført, henter endelig svar...")
+
+                    # Få endelig svar med OpenAI
+                    # Samme tools som i første kall (men uten nye tool-kall) gir samme
+                    # prefiks, slik at leverandøren kan gjenbruke cachen fra første kall
+                    final_message = {}
+                    with timings.phase("llm_2"):
+                        async for token in self._chat_completion(messages, final_message, stream=stream,
+                                                                 priority=priority,
+                                                                 tools=tools, tool_choice="none"):
+                            yield {"event": "token", "data": {"text": token}}
+                    timings.add_usage(final_message["usage"])
+
+                    final_answer = final_message["content"]
             else:
-                final_answer = response_message.content
+                final_answer = response_message["content"]
 
             # Lagre samtale med metadata
-            user_metadata = {
-                "timestamp": datetime.now().isoformat(),
-                "query_length": len(query)
-            }
+            with timings.phase("persist"):
+                await self._save_turn(
+                    session_id,
+                    query,
+                    final_answer,
+                    tool_calls_made=tool_calls_made,
+                    tool_results=tool_results,
+                    timings=timings,
+                    fast_path=used_fast_path
+                )
 
-            assistant_metadata = {
-                "timestamp": datetime.now().isoformat(),
-                "model": "gpt-4o-mini",
-                "had_tool_calls": tool_calls_made is not None,
-                "response_length": len(final_answer),
-                "tool_results": tool_results if tool_results else None
-            }
+            if self.response_cache:
+                self.response_cache.put(cache_key, final_answer, full_tool_results)
 
-            self.memory.add_message(
-                self.current_session_id,
-                "user",
-                query,
-                metadata=user_metadata
-            )
-            self.memory.add_message(
-                self.current_session_id,
-                "assistant",
-                final_answer,
-                tool_calls=tool_calls_made,
-                metadata=assistant_metadata
-            )
-            
-            return final_answer
+            yield {"event": "done", "data": self._done(final_answer, False, timings, session_id)}
             
+        except AdmissionRejected as e:
+            logger.warning(f"LLM-kall avvist av admission control: {e}")
+            if not stream:
+                raise
+            yield {"event": "error", "data": {"message": str(e), "retry_after": e.retry_after}}
         except Exception as e:
             logger.error(f"Query processing error: {e}")
-            return f"Beklager, jeg fikk en feil: {str(e)}"
-    
+            yield {"event": "error", "data": {"message": str(e)}}
+        finally:
+            if self.speculator:
+                self.speculator.finish(speculation)
+
+    def _done(self, response: str, cache_hit: bool, timings: TurnTimings,
+              session_id: str) -> Dict[str, Any]:
+        """Avslutt tidtaking og bygg data for done-hendelsen."""
+        timings.finish()
+        self.latency.record(timings)
+        return {
+            "response": response,
+            "cache_hit": cache_hit,
+            "timings": timings.to_dict(),
+            "server_timing": timings.server_timing(),
+            "session_id": session_id
+        }
+
+    async def _chat_completion(self, messages: List[Dict[str, Any]], result: Dict[str, Any],
+                               stream: bool = False, priority: str = "interactive",
+                               **kwargs) -> AsyncIterator[str]:
+        """
+        Kall chat completions og fyll inn result med "content", "tool_calls" og "usage".
+
+        Alle LLM-kall går gjennom admission control. Rate-limit headerne fra
+        leverandøren oppdaterer RPM/TPM bøttene etter hvert kall.
+
+        Med stream=True yieldes tekstbiter etter hvert som de kommer, og tool_calls
+        settes sammen fra deltaene. Med stream=False yieldes ingenting.
+        """
+        estimated = estimate_tokens(messages, kwargs.get("tools"))
+
+        with tracer.span("llm.chat_completion", kind="CLIENT", stream=stream,
+                         priority=priority, estimated_tokens=estimated) as span:
+            queued_at = time.monotonic()
+            async with self.admission.slot(priority, estimated):
+                span.set_tag("admission_wait_ms", round((time.monotonic() - queued_at) * 1000, 1))
+                if kwargs.get("tools"):
+                    self.prompt_cache.observe_prefix(self.prompt_prefix_hash)
+                if stream:
+                    # Siste chunk inneholder token-forbruket
+                    kwargs["stream_options"] = {"include_usage": True}
+                try:
+                    raw_response = await self.client.chat.completions.with_raw_response.create(
+                        model="gpt-4o-mini",
+                        messages=messages,
+                        stream=stream,
+                        **kwargs
+                    )
+                except RateLimitError as e:
+                    retry_after = self.admission.limiter.on_rate_limited(e.response.headers)
+                    raise AdmissionRejected("LLM leverandøren returnerte 429", retry_after)
+
+                self.admission.limiter.update_from_headers(raw_response.headers)
+                response = raw_response.parse()
+
+                if not stream:
+                    message = response.choices[0].message
+                    result["content"] = message.content
+                    result["tool_calls"] = [
+                        {
+                            "id": tc.id,
+                            "type": tc.type,
+                            "function": {
+                                "name": tc.function.name,
+                                "arguments": tc.function.arguments
+                            }
+                        }
+                        for tc in message.tool_calls
+                    ] if message.tool_calls else None
+                    result["usage"] = usage_to_dict(response.usage)
+                    self.prompt_cache.record(result["usage"])
+                    return
+
+                content_parts = []
+                tool_calls = {}  # index -> tool call under oppbygging
+                result["usage"] = None
+                async for chunk in response:
+                    if getattr(chunk, "usage", None):
+                        result["usage"] = usage_to_dict(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield delta.content
+
+                    for tc in delta.tool_calls or []:
+                        call = tool_calls.setdefault(tc.index, {
+                            "id": None,
+                            "type": "function",
+                            "function": {"name": "", "arguments": ""}
+                        })
+                        if tc.id:
+                            call["id"] = tc.id
+                        if tc.function and tc.function.name:
+                            call["function"]["name"] += tc.function.name
+                        if tc.function and tc.function.arguments:
+                            call["function"]["arguments"] += tc.function.arguments
+
+                result["content"] = "".join(content_parts) if content_parts else None
+                result["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)] or None
+                self.prompt_cache.record(result["usage"])
+
+    async def _save_turn(self, session_id: str, query: str, final_answer: str,
+                   tool_calls_made: List[Dict[str, Any]] = None,
+                   tool_results: List[Dict[str, Any]] = None,
+                   cache_hit: bool = False,
+                   timings: TurnTimings = None,
+                   fast_path: bool = False):
+        """
+        Lagre brukermelding og svar med metadata i samtalehistorikken.
+
+        Fasetidene lagres slik de er når _save_turn kalles, dvs. uten persist-fasen.
+        """
+        user_metadata = {
+            "timestamp": datetime.now().isoformat(),
+            "query_length": len(query)
+        }
+
+        assistant_metadata = {
+            "timestamp": datetime.now().isoformat(),
+            "model": "gpt-4o-mini",
+            "had_tool_calls": tool_calls_made is not None,
+            "response_length": len(final_answer),
+            "tool_results": tool_results if tool_results else None
+        }
+        if cache_hit:
+            assistant_metadata["cache_hit"] = True
+        if fast_path:
+            assistant_metadata["fast_path"] = True
+        if timings:
+            assistant_metadata["timings"] = timings.to_dict()
+
+        turn = [
+            {"role": "user", "content": query, "metadata": user_metadata},
+            {"role": "assistant", "content": final_answer, "tool_calls": tool_calls_made,
+             "metadata": assistant_metadata}
+        ]
+        if self.writer:
+            for message in turn:
+                self.writer.enqueue(session_id, **message)
+        else:
+            # Hele turen i én transaksjon
+            await self.db.add_messages(session_id, turn)
+
+    async def _load_history(self, session_id: str) -> List[Dict[str, Any]]:
+        """Hent samtalehistorikk, inkludert meldinger som ennå ikke er skrevet til disk."""
+        if self.writer:
+            # Lagret historikk pluss ventende meldinger, på databasetrådene
+            return await self.db.run(
+                self.writer.history,
+                session_id,
+                lambda: self.memory.get_conversation_history(session_id)
+            )
+        return await self.db.get_conversation_history(session_id)
+
+    async def _session_messages(self, session_id: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Hent historikken til en sesjon som LLM-meldinger.
+
+        Sesjonshalen kommer fra hot tier i ConversationMemory, som sjekkes mot
+        databasen før bruk (også når en annen replika har skrevet til sesjonen).
+
+        Returns:
+            (meldinger klare for LLM, historikk med tool_calls for spekulativ prefetch)
+        """
+        with tracer.span("db.load_history"):
+            history = await self._load_history(session_id)
+        messages = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in history if msg["role"] in ("user", "assistant")
+        ]
+        return messages, history
+
+    def start_search_backfill(self):
+        """Indekser eksisterende meldinger for fulltekstsøk i bakgrunnen hvis søkeindeksen er ny."""
+        if self.memory.search_backfill_pending and self._search_backfill is None:
+            self._search_backfill = asyncio.create_task(self._backfill_search_index())
+
+    async def _backfill_search_index(self):
+        # Én batch per databasekall, så backfill kan stoppes mellom batchene ved nedstenging
+        indexed = 0
+        after_id = 0
+        try:
+            while True:
+                result = await self.db.backfill_search_index_batch(after_id)
+                if result["done"]:
+                    break
+                indexed += result["indexed"]
+                after_id = result["last_id"]
+            logger.info(f"Søkeindeks: {indexed} eksisterende meldinger indeksert")
+        except Exception as e:
+            logger.warning(f"Indeksering for søk feilet etter id {after_id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hent ytelsesstatistikk for agenten."""
+        return {
+            "response_cache": self.response_cache.get_stats() if self.response_cache else None,
+            "speculation": self.speculator.get_stats() if self.speculator else None,
+            "fast_path": self.fast_path.get_stats() if self.fast_path else None,
+            "admission": self.admission.get_stats(),
+            "write_behind": self.writer.get_stats() if self.writer else None,
+            "memory_db": self.db.get_stats(),
+            "hot_tier": self.memory.hot.get_stats() if self.memory.hot else None,
+            "retention": self.retention.get_stats() if self.retention else None,
+            "stats_reconciler": self.stats_reconciler.get_stats() if self.stats_reconciler else None,
+            "latency": self.latency.summary(),
+            "tool_encoding": self.tool_encoder.get_stats(),
+            "prompt_cache": self.prompt_cache.get_stats(),
+            "tools": {
+                **self.discovery.get_stats(),
+                "count": len(self.tools),
+                "manifest_hash": self.manifest_hash
+            }
+        }
+
     async def close(self):
         """Rydd opp ressurser."""
+        await self.discovery.close()
+        if self.retention:
+            await self.retention.close()
+        if self.stats_reconciler:
+            await self.stats_reconciler.close()
+        if self._search_backfill:
+            self._search_backfill.cancel()
+            try:
+                await self._search_backfill
+            except asyncio.CancelledError:
+                pass
+        if self.writer:
+            await self.writer.close()
+        await self.db.close()
         await self.http_client.aclose()
 
 # Test funksjon
@@ -588,7 +1167,8 @@ async def main():
 
 def start_agent_api():
     """Start agent som HTTP API service."""
-    from fastapi import FastAPI, HTTPException
+    from fastapi import FastAPI, HTTPException, Response
+    from fastapi.responses import StreamingResponse
     from pydantic import BaseModel
     from contextlib import asynccontextmanager
     import uvicorn
@@ -605,12 +1185,16 @@ def start_agent_api():
         try:
             agent_instance = MicroserviceAgent()
 
-            # Last inn tools fra MCP server
-            tools_loaded = await agent_instance.load_tools_from_mcp_server()
-            if not tools_loaded:
-                logger.warning("Kunne ikke laste tools fra MCP server, fortsetter uten tools")
+            # Last inn tools fra MCP server i bakgrunnen (venter ikke på at MCP server er klar)
+            agent_instance.discovery.start()
+            if agent_instance.retention:
+                agent_instance.retention.start()
+            if agent_instance.stats_reconciler:
+                agent_instance.stats_reconciler.start()
+            agent_instance.start_search_backfill()
 
-            agent_instance.start_new_session("HTTP API Session")
+            # Ingen felles API-sesjon: hver forespørsel oppgir session_id (eller får en ny),
+            # slik at flere replikaer kan kjøre mot samme database
             logger.info("Ingrid Agent Service startet")
             logger.info(f"Agent instans opprettet: {agent_instance is not None}")
         except Exception as e:
@@ -634,23 +1218,207 @@ def start_agent_api():
     
     class QueryRequest(BaseModel):
         query: str
+        priority: Literal["interactive", "batch"] = "interactive"
+        session_id: Optional[str] = None  # Uten session_id opprettes en ny sesjon, ukjent gir 404
+
+    class SessionRequest(BaseModel):
+        title: Optional[str] = None
+        user_id: str = "default"
     
+    class BatchItem(BaseModel):
+        query: str
+        id: Optional[str] = None  # Klientens referanse, f.eks. booking ID
+        session_id: Optional[str] = None  # Uten session_id opprettes en ny sesjon
+        title: Optional[str] = None
+
+    class BatchRequest(BaseModel):
+        items: List[BatchItem]
+        concurrency: Optional[int] = None
+
     class QueryResponse(BaseModel):
         success: bool
         response: str
         timestamp: str
+        session_id: Optional[str] = None
+        timings: Optional[Dict[str, Any]] = None
     
+    @agent_app.middleware("http")
+    async def trace_requests(request, call_next):
+        """Start en server-span per forespørsel, koblet til web-tjenestens trace."""
+        if request.url.path == "/health":
+            return await call_next(request)
+        span = tracer.start_span(f"{request.method} {request.url.path}", kind="SERVER",
+                                 traceparent=request.headers.get("traceparent"))
+        try:
+            response = await call_next(request)
+        except BaseException as e:
+            span.set_tag("error", type(e).__name__)
+            tracer.finish_span(span)
+            raise
+        finally:
+            tracer.detach(span)
+        span.set_tag("http.status_code", response.status_code)
+        # Strømmede svar (/query/stream, /batch) er ikke ferdige før body er sendt
+        return tracer.finish_after_body(span, response)
+
     @agent_app.get("/health")
     async def health():
         return {
             "status": "healthy",
             "service": "Ingrid Agent",
             "timestamp": datetime.now().isoformat(),
-            "agent_ready": agent_instance is not None
+            "agent_ready": agent_instance is not None,
+            "tools_ready": agent_instance is not None and agent_instance.discovery.ready,
+            "tools_loaded": len(agent_instance.tools) if agent_instance else 0
         }
+
+    @agent_app.get("/ready")
+    async def ready():
+        """Readiness: 200 når tools er lastet, ellers 503 (blokkerer aldri)."""
+        if not agent_instance or not agent_instance.discovery.ready:
+            raise HTTPException(status_code=503, detail="Tools er ikke lastet ennå")
+        return {"ready": True, "tools_loaded": len(agent_instance.tools)}
+
+    async def request_session(session_id: Optional[str]) -> str:
+        """Sesjonen forespørselen oppgir, eller en ny. 404 hvis den oppgitte sesjonen ikke finnes."""
+        if not session_id:
+            return await agent_instance.create_session()
+        if not await agent_instance.db.session_exists(session_id):
+            # F.eks. slettet av retention; klienten må opprette en ny sesjon
+            raise HTTPException(status_code=404, detail=f"Sesjon {session_id} finnes ikke")
+        return session_id
+
+    @agent_app.post("/sessions")
+    async def create_session_api(request: SessionRequest):
+        """Opprett en ny sesjon. Sesjonen lagres i databasen og kan brukes på alle replikaer."""
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+        session_id = await agent_instance.create_session(title=request.title, user_id=request.user_id)
+        return {"session_id": session_id}
+
+    @agent_app.get("/sessions")
+    async def list_sessions_api(user_id: str = "default", limit: int = 20, cursor: Optional[str] = None):
+        """Sesjoner for en bruker, sist aktive først. Neste side hentes med next_cursor."""
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+        return await agent_instance.db.get_sessions_page(user_id, min(max(limit, 1), 200), cursor)
+
+    @agent_app.get("/sessions/{session_id}/messages")
+    async def list_messages_api(session_id: str, limit: int = 50,
+                                before_id: Optional[int] = None, after_id: Optional[int] = None,
+                                user_id: str = "default"):
+        """
+        Meldinger i en sesjon med keyset paginering (standard: de siste).
+
+        before_id blar bakover, after_id henter nyere meldinger. Meldinger som
+        fortsatt ligger i write-behind køen kommer med etter neste flush.
+        """
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+        try:
+            return await agent_instance.db.get_messages_page(
+                session_id, min(max(limit, 1), 200),
+                before_id=before_id, after_id=after_id, user_id=user_id
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
+    @agent_app.get("/search")
+    async def search_messages_api(q: str, user_id: Optional[str] = None, limit: int = 20,
+                                  cursor: Optional[str] = None):
+        """
+        Fulltekstsøk i meldinger, beste treff først med uthevet utdrag.
+
+        Uten user_id søkes det i alle brukeres samtaler. Neste side hentes med next_cursor.
+        """
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+        try:
+            return await agent_instance.db.search_messages(q, user_id, min(max(limit, 1), 100), cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @agent_app.post("/query/stream")
+    async def process_query_stream_api(request: QueryRequest):
+        """Strøm svaret som Server-Sent Events (tool-fremdrift og LLM tokens)."""
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+
+        logger.info(f"Stream forespørsel mottatt: {request.query}")
+
+        # Avvis før strømmen starter hvis køen allerede er full
+        try:
+            agent_instance.admission.check_capacity(request.priority)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=503,
+                detail=str(e),
+                headers={"Retry-After": e.retry_after_header}
+            )
+
+        session_id = await request_session(request.session_id)
+
+        async def event_stream():
+            async for event in agent_instance.process_query_stream(request.query, priority=request.priority,
+                                                                   session_id=session_id):
+                data = json.dumps(event["data"], ensure_ascii=False)
+                yield f"event: {event['event']}\ndata: {data}\n\n"
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    @agent_app.post("/query/batch")
+    async def process_batch_api(request: BatchRequest):
+        """
+        Prosesser mange spørsmål samtidig og strøm resultatene som NDJSON.
+
+        Én linje per element når det er ferdig, og en siste linje med "summary".
+        """
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+
+        max_items = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+        if len(request.items) > max_items:
+            raise HTTPException(status_code=413, detail=f"Maks {max_items} elementer per batch")
+
+        concurrency = min(
+            request.concurrency or int(os.getenv("BATCH_CONCURRENCY", "8")),
+            int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+        )
+        logger.info(f"Batch mottatt: {len(request.items)} elementer, concurrency {concurrency}")
+
+        async def ndjson():
+            items = [item.model_dump() for item in request.items]
+            async for result in agent_instance.process_batch(items, concurrency=concurrency):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    @agent_app.get("/stats")
+    async def stats():
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+        return agent_instance.get_stats()
+
+    @agent_app.get("/stats/latency")
+    async def latency_stats(window_seconds: float = 300):
+        """Persentiler for fasetider og tokens over de siste window_seconds."""
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+        return agent_instance.latency.summary(window_seconds)
+
+    @agent_app.get("/stats/database")
+    async def database_stats(days: int = 30, top_sessions: int = 10):
+        """Databasestatistikk fra tellertabellene (konstant tid uansett databasestørrelse)."""
+        if not agent_instance:
+            raise HTTPException(status_code=503, detail="Agent ikke tilgjengelig")
+        return await agent_instance.db.get_database_stats(min(max(days, 1), 365), min(max(top_sessions, 1), 100))
+
     @agent_app.post("/query", response_model=QueryResponse)
-    async def process_query_api(request: QueryRequest):
+    async def process_query_api(request: QueryRequest, http_response: Response):
         global agent_instance
         logger.info(f"Query forespørsel mottatt: {request.query}")
         logger.info(f"Agent instans status: {agent_instance is not None}")
@@ -661,13 +1429,28 @@ def start_agent_api():
 
         try:
             logger.info("Prosesserer query med agent...")
-            response = await agent_instance.process_query(request.query)
+            agent_instance.admission.check_capacity(request.priority)
+            session_id = await request_session(request.session_id)
+            result = await agent_instance.process_query_detailed(request.query, priority=request.priority,
+                                                                 session_id=session_id)
             logger.info("Query prosessert vellykket")
+            if result["server_timing"]:
+                http_response.headers["Server-Timing"] = result["server_timing"]
             return QueryResponse(
                 success=True,
-                response=response,
-                timestamp=datetime.now().isoformat()
+                response=result["response"],
+                timestamp=datetime.now().isoformat(),
+                session_id=session_id,
+                timings=result["timings"]
+            )
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=503,
+                detail=str(e),
+                headers={"Retry-After": e.retry_after_header}
             )
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Query prosessering feil: {e}")
             raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,347 @@
+"""
+Time-Partitioned Archive of Old Conversations
+
+Samtaler må beholdes lenge for analyse, men i den levende databasen gjør gamle
+rader hver indeks større og hver skriving tregere. Retention sletter dem; med
+et arkiv flyttes de i stedet ut til komprimerte filer per måned:
+
+  archive/
+    2026-03/
+      seg-000000012345-1f3a9c2e.data   komprimerte rammer
+      seg-000000012345-1f3a9c2e.json   indeks (rammer, statistikk, codec)
+
+Hvert segment er kolonneorientert på samme måte som Parquet: radene sorteres på
+(user_id, session_id, id) og deles i rammer på frame_rows rader. Hver ramme er
+ett JSON-objekt med én liste per kolonne, komprimert for seg med zstd (zlib
+uten zstandard). Indeksen har min/max for user_id og timestamp per ramme.
+
+scan() leser arkivet strømmende med predicate pushdown: måneder utenfor
+datointervallet åpnes ikke, og rammer der user_id eller timestamp ikke kan
+treffe dekomprimeres ikke. Datafilene memory-mappes, så bare rammene som leses
+hentes fra disk.
+
+Flyttingen (ConversationMemory.archive_expired_batch) er en tofaseskriving:
+
+  1. Segmentene skrives og fsynces, med indeksen som .json.pending
+  2. Radene slettes og segmentene registreres i archive_segments i én transaksjon
+  3. .json.pending gis nytt navn til .json (synlig for scan)
+
+Krasjer prosessen mellom stegene, ryddes det opp ved neste kjøring (recover):
+segmenter registrert i databasen publiseres, resten slettes. En fillås gjør at
+bare én prosess arkiverer om gangen.
+"""
+
+import argparse
+import fcntl
+import json
+import logging
+import mmap
+import os
+import sys
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+try:
+    import zstandard
+except ImportError:  # zstandard er valgfri, zlib brukes da
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Kolonnene i hver ramme (samme felt som get_messages_page, pluss sesjonens tittel)
+COLUMNS = ["id", "session_id", "user_id", "title", "role", "content", "tool_calls", "metadata", "timestamp"]
+
+INDEX_VERSION = 1
+
+
+class ArchiveConflict(Exception):
+    """Sesjonene ble endret mens de ble arkivert; batchen rulles tilbake og skrives på nytt uten dem."""
+
+    def __init__(self, message: str, session_ids: Optional[List[str]] = None):
+        super().__init__(message)
+        self.session_ids = session_ids or []
+
+
+class ConversationArchive:
+    """Månedspartisjonert arkiv av meldinger i komprimerte kolonnefiler."""
+
+    def __init__(self, directory: str, frame_rows: int = 2000, level: int = 3):
+        """
+        Initialiser arkivet.
+
+        Args:
+            directory: Katalog for arkivet (opprettes ved behov)
+            frame_rows: Rader per komprimert ramme (minste enhet scan leser)
+            level: Kompresjonsnivå for zstd (zlib bruker level + 3)
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.frame_rows = max(1, frame_rows)
+        self.level = level
+        self.codec = "zstd" if zstandard else "zlib"
+
+        self.segments_written = 0
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.scans = 0
+        self.frames_read = 0
+        self.frames_skipped = 0
+        self.rows_read = 0
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Eksklusiv lås på arkivet for skriving og opprydding (på tvers av prosesser)."""
+        with open(self.directory / ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Skriving
+
+    def write(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Skriv rader som nye segmenter, ett per måned (fase 1, ikke synlige for scan).
+
+        Args:
+            rows: Meldinger med feltene i COLUMNS
+
+        Returns:
+            Ett sammendrag per segment: name, month, messages, sessions, min_id, max_id
+        """
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_month.setdefault(str(row["timestamp"])[:7], []).append(row)
+
+        segments = []
+        try:
+            for month, month_rows in sorted(by_month.items()):
+                segments.append(self._write_segment(month, month_rows))
+        except BaseException:
+            self.discard([segment["name"] for segment in segments])
+            raise
+        return segments
+
+    def _write_segment(self, month: str, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        rows.sort(key=lambda row: (row["user_id"], row["session_id"], row["id"]))
+        ids = [row["id"] for row in rows]
+        # Tilfeldig suffiks: en avbrutt batch kan skrives på nytt med samme id-er
+        name = f"{month}/seg-{min(ids):012d}-{uuid.uuid4().hex[:8]}"
+        data_path = self.directory / f"{name}.data"
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+
+        compress = self._compressor()
+        frames = []
+        offset = 0
+        with open(data_path, "wb") as f:
+            for start in range(0, len(rows), self.frame_rows):
+                chunk = rows[start:start + self.frame_rows]
+                columns = {column: [row[column] for row in chunk] for column in COLUMNS}
+                data = compress(json.dumps(columns, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+                f.write(data)
+                timestamps = columns["timestamp"]
+                frames.append({
+                    "offset": offset,
+                    "length": len(data),
+                    "rows": len(chunk),
+                    "min_user": chunk[0]["user_id"],
+                    "max_user": chunk[-1]["user_id"],
+                    "min_timestamp": min(timestamps),
+                    "max_timestamp": max(timestamps)
+                })
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        index = {
+            "version": INDEX_VERSION,
+            "codec": self.codec,
+            "month": month,
+            "rows": len(rows),
+            "sessions": len({row["session_id"] for row in rows}),
+            "min_id": min(ids),
+            "max_id": max(ids),
+            "min_timestamp": min(frame["min_timestamp"] for frame in frames),
+            "max_timestamp": max(frame["max_timestamp"] for frame in frames),
+            "frames": frames
+        }
+        pending = self.directory / f"{name}.json.pending"
+        with open(pending, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.segments_written += 1
+        self.rows_written += len(rows)
+        self.bytes_written += offset
+        return {"name": name, "month": month, "messages": len(rows), "sessions": index["sessions"],
+                "min_id": index["min_id"], "max_id": index["max_id"]}
+
+    def _compressor(self) -> Callable[[bytes], bytes]:
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress
+        return lambda data: zlib.compress(data, min(self.level + 3, 9))
+
+    def publish(self, names: Iterable[str]):
+        """Gjør segmenter synlige for scan (fase 3, etter commit i databasen)."""
+        for name in names:
+            pending = self.directory / f"{name}.json.pending"
+            if pending.exists():
+                os.replace(pending, self.directory / f"{name}.json")
+
+    def discard(self, names: Iterable[str]):
+        """Slett segmenter som ikke ble registrert i databasen."""
+        for name in names:
+            for suffix in (".data", ".json.pending"):
+                path = self.directory / f"{name}{suffix}"
+                if path.exists():
+                    path.unlink()
+
+    def recover(self, committed: Callable[[List[str]], Set[str]]) -> Dict[str, int]:
+        """
+        Fullfør eller rull tilbake segmenter etter en avbrutt arkivering (kalles med locked()).
+
+        Args:
+            committed: Returnerer navnene (av de gitte) som er registrert i databasen
+
+        Returns:
+            {"published": antall, "discarded": antall}
+        """
+        names = [str(path.relative_to(self.directory))[:-len(".json.pending")]
+                 for path in self.directory.glob("*/*.json.pending")]
+        # Datafiler uten indeks: krasj mens segmentet ble skrevet
+        names += [str(path.relative_to(self.directory))[:-len(".data")]
+                  for path in self.directory.glob("*/*.data")
+                  if not path.with_suffix(".json").exists()
+                  and not path.parent.joinpath(f"{path.stem}.json.pending").exists()]
+        if not names:
+            return {"published": 0, "discarded": 0}
+
+        done = committed(names)
+        self.publish([name for name in names if name in done])
+        self.discard([name for name in names if name not in done])
+        result = {"published": len(done), "discarded": len(names) - len(done)}
+        logger.warning(f"Arkiv: ryddet opp etter avbrutt arkivering: {result}")
+        return result
+
+    # Lesing
+
+    def segments(self, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Publiserte segmenter (indeksen pluss "name"), eldste måned først, filtrert på måned."""
+        for month_dir in sorted(path for path in self.directory.iterdir() if path.is_dir()):
+            month = month_dir.name
+            if (start and month < start[:7]) or (end and month > end[:7]):
+                continue
+            for index_path in sorted(month_dir.glob("*.json")):
+                with open(index_path, encoding="utf-8") as f:
+                    index = json.load(f)
+                index["name"] = f"{month}/{index_path.stem}"
+                yield index
+
+    def scan(self, user_id: Optional[str] = None, start: Optional[str] = None,
+             end: Optional[str] = None, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Strøm arkiverte meldinger som matcher filtrene.
+
+        Innenfor et segment kommer radene sortert på (user_id, session_id, id).
+
+        Args:
+            user_id: Bare denne brukeren
+            start: Tidligste timestamp, inklusiv ("YYYY-MM-DD" eller "YYYY-MM-DD HH:MM:SS")
+            end: Seneste timestamp, eksklusiv
+            session_id: Bare denne sesjonen
+
+        Yields:
+            Meldinger med feltene i COLUMNS
+        """
+        self.scans += 1
+        for index in self.segments(start, end):
+            if (start and index["max_timestamp"] < start) or (end and index["min_timestamp"] >= end):
+                continue
+            frames = [
+                frame for frame in index["frames"]
+                if not (user_id is not None and not frame["min_user"] <= user_id <= frame["max_user"])
+                and not (start and frame["max_timestamp"] < start)
+                and not (end and frame["min_timestamp"] >= end)
+            ]
+            self.frames_skipped += len(index["frames"]) - len(frames)
+            if frames:
+                yield from self._scan_segment(index, frames, user_id, start, end, session_id)
+
+    def _scan_segment(self, index: Dict[str, Any], frames: List[Dict[str, Any]],
+                      user_id: Optional[str], start: Optional[str], end: Optional[str],
+                      session_id: Optional[str]) -> Iterator[Dict[str, Any]]:
+        decompress = self._decompressor(index["codec"])
+        with open(self.directory / f"{index['name']}.data", "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for frame in frames:
+                # Slik av mmap-en kopierer bare rammens bytes fra sidecachen
+                columns = json.loads(decompress(mapped[frame["offset"]:frame["offset"] + frame["length"]]))
+                self.frames_read += 1
+                for values in zip(*(columns[column] for column in COLUMNS)):
+                    row = dict(zip(COLUMNS, values))
+                    if (user_id is not None and row["user_id"] != user_id) \
+                            or (session_id is not None and row["session_id"] != session_id) \
+                            or (start and row["timestamp"] < start) \
+                            or (end and row["timestamp"] >= end):
+                        continue
+                    self.rows_read += 1
+                    yield row
+
+    @staticmethod
+    def _decompressor(codec: str) -> Callable[[bytes], bytes]:
+        if codec == "zstd":
+            if not zstandard:
+                raise RuntimeError("Arkivet er komprimert med zstd, men zstandard er ikke installert")
+            return zstandard.ZstdDecompressor().decompress
+        return zlib.decompress
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for arkivet.
+
+        Returns:
+            Dictionary med segmenter og størrelse på disk, skrevne rader og lesing
+        """
+        segments = list(self.directory.glob("*/*.json"))
+        return {
+            "directory": str(self.directory),
+            "codec": self.codec,
+            "segments": len(segments),
+            "size_mb": round(sum(path.with_suffix(".data").stat().st_size for path in segments) / (1024 * 1024), 2),
+            "segments_written": self.segments_written,
+            "rows_written": self.rows_written,
+            "bytes_written": self.bytes_written,
+            "scans": self.scans,
+            "frames_read": self.frames_read,
+            "frames_skipped": self.frames_skipped,
+            "rows_read": self.rows_read
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Les arkiverte samtaler som NDJSON")
+    parser.add_argument("directory", help="Arkivkatalog (f.eks. /data/archive)")
+    parser.add_argument("--user-id", default=None)
+    parser.add_argument("--session-id", default=None)
+    parser.add_argument("--start", default=None, help="Tidligste timestamp, inklusiv (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="Seneste timestamp, eksklusiv (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    archive = ConversationArchive(args.directory)
+    started = time.perf_counter()
+    for row in archive.scan(args.user_id, args.start, args.end, args.session_id):
+        sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+    stats = archive.get_stats()
+    print(f"{stats['rows_read']} meldinger, {stats['frames_read']} rammer lest, "
+          f"{stats['frames_skipped']} hoppet over ({(time.perf_counter() - started) * 1000:.0f} ms)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Async Facade for ConversationMemory
+
+ConversationMemory er synkron (sqlite3), men kalles fra async process_query.
+Kalt direkte blokkerer hver lesing og skriving event loop-en, og alle andre
+forespørsler står stille mens SQLite jobber.
+
+AsyncConversationMemory har en async versjon av hver offentlige metode. Kallene
+kjøres på egne databasetråder (ThreadPoolExecutor med prefiks "memory-db"),
+så SQLite I/O overlapper med LLM- og nettverksventing:
+
+  - Antall tråder tilsvarer lesepoolen i SQLitePool (skrivinger serialiseres
+    uansett av skrivelåsen)
+  - Køen er begrenset (max_pending). Når den er full, venter kalleren i event
+    loop-en i stedet for at ubegrenset mange kall hoper seg opp i executoren
+
+Den synkrone ConversationMemory brukes fortsatt direkte av skript og verktøy.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, TypeVar
+
+from archive import ConversationArchive
+from conversation_memory import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AsyncConversationMemory:
+    """Async API for ConversationMemory som kjører SQLite-kallene på egne tråder."""
+
+    def __init__(self, memory: ConversationMemory, max_workers: int = 4, max_pending: int = 256):
+        """
+        Initialiser fasaden.
+
+        Args:
+            memory: Synkron ConversationMemory som gjør arbeidet
+            max_workers: Antall databasetråder
+            max_pending: Maksimalt antall kall i kø eller under arbeid samtidig
+        """
+        self.memory = memory
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="memory-db")
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self.calls = 0
+        self.in_flight = 0
+        self.slot_waits = 0
+        self.max_in_flight = 0
+        self.total_ms = 0.0
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Kjør et blokkerende kall på databasetrådene.
+
+        Brukes av metodene under, og av kode som må gjøre flere databasekall
+        atomisk (f.eks. write-behind sin history()).
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._slots.locked():
+            self.slot_waits += 1
+
+        async with self._slots:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            started = time.perf_counter()
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+            finally:
+                self.in_flight -= 1
+                self.calls += 1
+                self.total_ms += (time.perf_counter() - started) * 1000
+
+    async def create_session(self, user_id: str = "default", title: Optional[str] = None) -> str:
+        """Async versjon av ConversationMemory.create_session."""
+        return await self.run(self.memory.create_session, user_id=user_id, title=title)
+
+    async def session_exists(self, session_id: str) -> bool:
+        """Async versjon av ConversationMemory.session_exists."""
+        return await self.run(self.memory.session_exists, session_id)
+
+    async def add_message(self, session_id: str, role: str, content: str,
+                          tool_calls: Optional[List[Dict]] = None,
+                          metadata: Optional[Dict] = None,
+                          user_id: str = "default"):
+        """Async versjon av ConversationMemory.add_message."""
+        await self.run(self.memory.add_message, session_id, role, content,
+                       tool_calls=tool_calls, metadata=metadata, user_id=user_id)
+
+    async def add_messages(self, session_id: str, messages: List[Dict[str, Any]],
+                           user_id: str = "default") -> int:
+        """Async versjon av ConversationMemory.add_messages."""
+        return await self.run(self.memory.add_messages, session_id, messages, user_id=user_id)
+
+    async def add_message_batch(self, messages: List[Dict[str, Any]]):
+        """Async versjon av ConversationMemory.add_message_batch."""
+        await self.run(self.memory.add_message_batch, messages)
+
+    async def get_conversation_history(self, session_id: str, limit: int = 50,
+                                       user_id: str = "default") -> List[Dict[str, Any]]:
+        """Async versjon av ConversationMemory.get_conversation_history."""
+        return await self.run(self.memory.get_conversation_history, session_id, limit, user_id)
+
+    async def get_messages_page(self, session_id: str, limit: int = 50,
+                                before_id: Optional[int] = None,
+                                after_id: Optional[int] = None,
+                                user_id: str = "default") -> Dict[str, Any]:
+        """Async versjon av ConversationMemory.get_messages_page."""
+        return await self.run(self.memory.get_messages_page, session_id, limit,
+                              before_id=before_id, after_id=after_id, user_id=user_id)
+
+    async def get_recent_context(self, session_id: str, context_window: int = 10,
+                                 user_id: str = "default") -> List[Dict[str, Any]]:
+        """Async versjon av ConversationMemory.get_recent_context."""
+        return await self.run(self.memory.get_recent_context, session_id, context_window, user_id)
+
+    async def get_sessions(self, user_id: str = "default", limit: int = 20) -> List[Dict[str, Any]]:
+        """Async versjon av ConversationMemory.get_sessions."""
+        return await self.run(self.memory.get_sessions, user_id, limit)
+
+    async def get_sessions_page(self, user_id: str = "default", limit: int = 20,
+                                cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Async versjon av ConversationMemory.get_sessions_page."""
+        return await self.run(self.memory.get_sessions_page, user_id, limit, cursor)
+
+    async def search_messages(self, query: str, user_id: Optional[str] = None,
+                              limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Async versjon av ConversationMemory.search_messages."""
+        return await self.run(self.memory.search_messages, query, user_id, limit, cursor)
+
+    async def backfill_search_index_batch(self, after_id: int = 0, batch_size: int = 2000) -> Dict[str, Any]:
+        """Async versjon av ConversationMemory.backfill_search_index_batch."""
+        return await self.run(self.memory.backfill_search_index_batch, after_id, batch_size)
+
+    async def delete_old_conversations(self, days_old: int = 30,
+                                       user_id: Optional[str] = None) -> Dict[str, int]:
+        """Async versjon av ConversationMemory.delete_old_conversations."""
+        return await self.run(self.memory.delete_old_conversations, days_old, user_id)
+
+    async def delete_expired_batch(self, cutoff: str, batch_size: int = 500,
+                                   user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Async versjon av ConversationMemory.delete_expired_batch."""
+        return await self.run(self.memory.delete_expired_batch, cutoff, batch_size, user_id)
+
+    async def archive_expired_batch(self, archive: ConversationArchive, cutoff: str,
+                                    batch_size: int = 500,
+                                    skip: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """Async versjon av ConversationMemory.archive_expired_batch."""
+        return await self.run(self.memory.archive_expired_batch, archive, cutoff, batch_size, skip)
+
+    async def incremental_vacuum(self, pages: int = 256) -> Dict[str, int]:
+        """Async versjon av ConversationMemory.incremental_vacuum."""
+        return await self.run(self.memory.incremental_vacuum, pages)
+
+    async def get_database_stats(self, days: int = 30, top_sessions: int = 10) -> Dict[str, Any]:
+        """Async versjon av ConversationMemory.get_database_stats."""
+        return await self.run(self.memory.get_database_stats, days, top_sessions)
+
+    async def reconcile_stats(self) -> Dict[str, int]:
+        """Async versjon av ConversationMemory.reconcile_stats."""
+        return await self.run(self.memory.reconcile_stats)
+
+    async def close(self):
+        """Vent på kall under arbeid, stopp trådene og lukk databasetilkoblingene."""
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self._executor.shutdown, wait=True)
+        )
+        self.memory.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for databasetrådene.
+
+        Returns:
+            Dictionary med antall kall, kø/arbeid nå og gjennomsnittlig tid per kall
+        """
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "slot_waits": self.slot_waits,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0
+        }
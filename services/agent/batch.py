@@ -0,0 +1,140 @@
+"""
+Batch Query Processing
+
+Hver morgen lages værbriefer for hundrevis av bookede reiser. I stedet for én
+/query om gangen tar POST /query/batch en liste med spørsmål:
+
+  - Hvert element har sin egen sesjon (oppgitt session_id eller en ny)
+  - Elementene kjøres samtidig (begrenset av concurrency) med prioritet "batch",
+    slik at admission control alltid slipper interaktive brukere først
+  - Resultatene strømmes tilbake som NDJSON i den rekkefølgen de blir ferdige
+  - En feil i ett element gir en feillinje for elementet, ikke avbrutt batch
+  - Like tool-kall på tvers av elementer (f.eks. samme by) deles: første kall
+    utføres, de andre venter på samme resultat (single-flight)
+
+ToolCallDeduplicator gjøres tilgjengelig for call_mcp_tool via en ContextVar
+som settes for alle oppgavene i batchen.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_deduplicator: ContextVar[Optional["ToolCallDeduplicator"]] = ContextVar(
+    "tool_call_deduplicator", default=None
+)
+
+
+def current_deduplicator() -> Optional["ToolCallDeduplicator"]:
+    """Deduplicator for batchen som kjører i gjeldende oppgave, eller None."""
+    return _current_deduplicator.get()
+
+
+def dedup_key(tool_name: str, arguments: Dict[str, Any]) -> str:
+    """Nøkkel for like tool-kall ("Oslo" og " oslo" regnes som samme sted)."""
+    normalized = {
+        key: value.strip().casefold() if isinstance(value, str) else value
+        for key, value in arguments.items()
+    }
+    return f"{tool_name}:{json.dumps(normalized, sort_keys=True, ensure_ascii=False)}"
+
+
+class ToolCallDeduplicator:
+    """Deler resultatet av like tool-kall mellom elementene i én batch."""
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Task[str]"] = {}
+        self.executed = 0
+        self.shared = 0
+
+    async def call(self, tool_name: str, arguments: Dict[str, Any],
+                   execute: Callable[[str, Dict[str, Any]], Awaitable[str]]) -> str:
+        """
+        Utfør tool-kallet, eller vent på et likt kall som allerede er startet.
+
+        Args:
+            tool_name: Navn på toolet
+            arguments: Argumenter til toolet
+            execute: Korutinefunksjon som utfører kallet
+
+        Returns:
+            Tool-resultat
+        """
+        key = dedup_key(tool_name, arguments)
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(execute(tool_name, arguments))
+            self._calls[key] = task
+            self.executed += 1
+        else:
+            self.shared += 1
+        # shield: et element som avbrytes (f.eks. forkastet spekulasjon) skal ikke
+        # avbryte kallet for de andre elementene
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"tool_calls_executed": self.executed, "tool_calls_shared": self.shared}
+
+
+async def run_batch(items: List[Dict[str, Any]],
+                    process: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                    concurrency: int = 8) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Kjør process for hvert element samtidig og yield resultatene etter hvert.
+
+    Args:
+        items: Elementer i batchen (dicts med minst "query")
+        process: Korutinefunksjon som behandler ett element og returnerer resultatet
+        concurrency: Maksimalt antall elementer som behandles samtidig
+
+    Yields:
+        Ett resultat per element ({"index", "id", "success", ...}), og til slutt
+        en oppsummering ({"summary": {...}})
+    """
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    deduplicator = ToolCallDeduplicator()
+
+    async def run_item(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = await process(item)
+            except Exception as e:
+                logger.error(f"Batch element {index} feilet: {e}")
+                result = {"success": False, "error": str(e)}
+                if hasattr(e, "retry_after"):
+                    result["retry_after"] = e.retry_after
+        return {"index": index, "id": item.get("id"), **result}
+
+    # Oppgavene arver konteksten, og dermed deduplicatoren, når de opprettes
+    token = _current_deduplicator.set(deduplicator)
+    try:
+        tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(items)]
+    finally:
+        _current_deduplicator.reset(token)
+
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            succeeded += 1 if result.get("success") else 0
+            yield result
+    finally:
+        # Klienten koblet fra: ikke fortsett å bruke LLM-kvote på resultater ingen leser
+        for task in tasks:
+            task.cancel()
+
+    yield {
+        "summary": {
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            **deduplicator.get_stats()
+        }
+    }
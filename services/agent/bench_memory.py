@@ -0,0 +1,173 @@
+"""
+Benchmark: ConversationMemory før og etter SQLitePool
+
+Måler på en midlertidig database:
+
+  - inserts/s:  add_message én og én (INSERT + UPDATE sessions + commit)
+  - turns/s:    en tur (bruker + assistent): to add_message før, én
+                add_messages (én transaksjon) etter
+  - history:    ventetid for get_conversation_history (p50/p99) på en sesjon
+                med 50 meldinger
+
+"før" gjenskaper den gamle implementasjonen: ny sqlite3.connect() per kall og
+standard rollback journal (journal_mode=DELETE, synchronous=FULL).
+"etter" er ConversationMemory med SQLitePool (WAL, synchronous=NORMAL, mmap).
+
+Med --concurrent-reader leser en bakgrunnstråd historikk kontinuerlig mens
+det skrives (som Datasette mot samme fil).
+
+  python bench_memory.py [--messages 2000] [--reads 2000] [--concurrent-reader]
+"""
+
+import argparse
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from conversation_memory import ConversationMemory
+from timings import percentile
+
+
+class LegacyMemory:
+    """De gamle spørringene med ny tilkobling per kall (for sammenligning)."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        memory = ConversationMemory(db_path)
+        memory.close()
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("PRAGMA journal_mode=DELETE")
+
+    def create_session(self, title: str) -> str:
+        session_id = f"legacy_{time.time_ns()}"
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO sessions (session_id, user_id, title) VALUES (?, 'default', ?)",
+                         (session_id, title))
+            conn.commit()
+        return session_id
+
+    def add_message(self, session_id: str, role: str, content: str, metadata: Dict[str, Any] = None):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO conversations (user_id, session_id, role, content, tool_calls, metadata)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, ("default", session_id, role, content, None, json.dumps(metadata) if metadata else None))
+            cursor.execute("""
+                UPDATE sessions
+                SET last_activity = CURRENT_TIMESTAMP,
+                    message_count = message_count + 1
+                WHERE session_id = ?
+            """, (session_id,))
+            conn.commit()
+
+    def get_conversation_history(self, session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT role, content, tool_calls, metadata, timestamp
+                FROM conversations
+                WHERE user_id = ? AND session_id = ?
+                ORDER BY timestamp ASC
+                LIMIT ?
+            """, ("default", session_id, limit))
+            return [
+                {"role": role, "content": content, "timestamp": timestamp,
+                 **({"metadata": json.loads(metadata)} if metadata else {})}
+                for role, content, tool_calls, metadata, timestamp in cursor.fetchall()
+            ]
+
+
+def run(memory: Any, create_session: Callable[[], str], messages: int, reads: int,
+        concurrent_reader: bool) -> Dict[str, float]:
+    metadata = {"timestamp": "2026-10-19T10:00:00", "query_length": 42}
+    content = "Hva er været i Bergen i morgen, og bør jeg ta med paraply? " * 3
+
+    history_session = create_session()
+    for i in range(50):
+        memory.add_message(history_session, "user" if i % 2 == 0 else "assistant", content, metadata=metadata)
+
+    stop = threading.Event()
+    background_reads = [0]
+
+    def read_loop():
+        while not stop.is_set():
+            memory.get_conversation_history(history_session)
+            background_reads[0] += 1
+
+    reader = threading.Thread(target=read_loop, daemon=True) if concurrent_reader else None
+    if reader:
+        reader.start()
+
+    session_id = create_session()
+    started = time.perf_counter()
+    for i in range(messages):
+        memory.add_message(session_id, "user" if i % 2 == 0 else "assistant", content, metadata=metadata)
+    insert_seconds = time.perf_counter() - started
+
+    turn_session = create_session()
+    turn = [{"role": "user", "content": content, "metadata": metadata},
+            {"role": "assistant", "content": content, "metadata": metadata}]
+    turns = max(1, messages // 2)
+    started = time.perf_counter()
+    for _ in range(turns):
+        if hasattr(memory, "add_messages"):
+            memory.add_messages(turn_session, turn)
+        else:
+            for message in turn:
+                memory.add_message(turn_session, **message)
+    turn_seconds = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(reads):
+        t0 = time.perf_counter()
+        memory.get_conversation_history(history_session)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    stop.set()
+    latencies.sort()
+    if reader:
+        reader.join()
+
+    return {
+        "inserts_per_second": round(messages / insert_seconds, 1),
+        "turns_per_second": round(turns / turn_seconds, 1),
+        "history_p50_ms": round(percentile(latencies, 50), 3),
+        "history_p99_ms": round(percentile(latencies, 99), 3),
+        "background_reads": background_reads[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ConversationMemory før/etter SQLitePool")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--concurrent-reader", action="store_true")
+    parser.add_argument("--dir", default=None, help="Katalog for testdatabasene (standard: tmp)")
+    args = parser.parse_args()
+
+    directory = Path(args.dir or tempfile.mkdtemp(prefix="bench_memory_"))
+    directory.mkdir(parents=True, exist_ok=True)
+
+    legacy = LegacyMemory(str(directory / "before.db"))
+    before = run(legacy, lambda: legacy.create_session("bench"), args.messages, args.reads,
+                 args.concurrent_reader)
+
+    pooled = ConversationMemory(str(directory / "after.db"))
+    after = run(pooled, lambda: pooled.create_session(title="bench"), args.messages, args.reads,
+                args.concurrent_reader)
+    pooled.close()
+
+    print(f"{'':22}{'før':>12}{'etter':>12}")
+    for key in ("inserts_per_second", "turns_per_second", "history_p50_ms", "history_p99_ms", "background_reads"):
+        if key == "background_reads" and not args.concurrent_reader:
+            continue
+        print(f"{key:22}{before[key]:>12}{after[key]:>12}")
+
+
+if __name__ == "__main__":
+    main()
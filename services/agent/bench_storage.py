@@ -0,0 +1,156 @@
+"""
+Benchmark: lagringsstørrelse og ventetid med og uten kompakt lagring
+
+Genererer et syntetisk datasett (standard én million meldinger) med samme
+form som agenten lagrer: brukermelding med metadata, assistentmelding med
+modell, fasetider, tool_calls og trunkerte tool_results. Datasettet skrives
+med add_message_batch (som write-behind) til én database per modus:
+
+  json          compact=False (JSON-tekst, som før)
+  compact-zlib  compact=True uten zstandard (reserveløsningen)
+  compact       compact=True med zstd og trent ordbok (hvis zstandard er installert)
+
+Måler filstørrelse, bytes per melding, skrivehastighet og ventetid for
+get_conversation_history (p50/p99) på tilfeldige sesjoner.
+
+  python bench_storage.py [--messages 1000000] [--session-size 50] [--reads 2000]
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import compact_storage
+from conversation_memory import ConversationMemory
+from timings import percentile
+
+CITIES = ["Oslo", "Bergen", "Trondheim", "Tromsø", "Stavanger", "Bodø", "Ålesund", "Kristiansand",
+          "Lillehammer", "Geilo", "Lofoten", "Hammerfest", "Molde", "Narvik", "Røros"]
+QUESTIONS = ["Hvordan blir været i {city} i morgen?", "Trenger jeg paraply i {city}?",
+             "Er det fint vær for fjelltur ved {city} til helgen?", "Hva er temperaturen i {city} nå?",
+             "Bør jeg pakke vinterjakke til {city}?"]
+TOOLS = ["get_weather_forecast", "get_current_weather", "get_weather_alerts"]
+
+
+def generate(messages: int, session_size: int, seed: int = 42) -> Iterator[Dict[str, Any]]:
+    """Syntetiske meldinger i samme form som MicroserviceAgent._save_turn lagrer."""
+    rng = random.Random(seed)
+    for turn in range(messages // 2):
+        session_id = f"bench_{turn * 2 // session_size:07d}"
+        city = rng.choice(CITIES)
+        query = rng.choice(QUESTIONS).format(city=city)
+        timestamp = f"2026-{1 + turn % 9:02d}-{1 + turn % 28:02d} {turn % 24:02d}:{turn % 60:02d}:{turn % 59:02d}"
+
+        tool_calls = None
+        tool_results = None
+        if rng.random() < 0.7:
+            tools = rng.sample(TOOLS, rng.choice([1, 1, 2]))
+            tool_calls = [
+                {"id": f"call_{rng.getrandbits(96):024x}", "type": "function",
+                 "function": {"name": tool, "arguments": json.dumps({"location": city, "days": rng.randint(1, 5)})}}
+                for tool in tools
+            ]
+            tool_results = [
+                {"tool": call["function"]["name"],
+                 "arguments": json.loads(call["function"]["arguments"]),
+                 "result": json.dumps({"location": {"name": city, "country": "NO"},
+                                       "current": {"temperature": round(rng.uniform(-15, 25), 1),
+                                                   "description": rng.choice(["lett regn", "skyet", "klarvær", "snø"]),
+                                                   "wind_speed": round(rng.uniform(0, 15), 1)}},
+                                      ensure_ascii=False)[:200]}
+                for call in tool_calls
+            ]
+        answer = (f"I {city} blir det {rng.choice(['lett regn', 'oppholdsvær', 'sol', 'snøbyger'])} "
+                  f"og rundt {rng.randint(-10, 22)} grader. " * rng.randint(1, 4))
+
+        yield {"session_id": session_id, "role": "user", "content": query, "timestamp": timestamp,
+               "metadata": {"timestamp": timestamp.replace(" ", "T") + ".123456", "query_length": len(query)}}
+        metadata = {
+            "timestamp": timestamp.replace(" ", "T") + ".654321",
+            "model": "gpt-4o-mini",
+            "had_tool_calls": tool_calls is not None,
+            "response_length": len(answer),
+            "tool_results": tool_results,
+            "timings": {"history": round(rng.uniform(0.1, 2), 2), "llm_1": round(rng.uniform(300, 900), 1),
+                        "llm_2": round(rng.uniform(300, 1500), 1), "total": round(rng.uniform(700, 3000), 1)}
+        }
+        yield {"session_id": session_id, "role": "assistant", "content": answer, "tool_calls": tool_calls,
+               "metadata": metadata, "timestamp": timestamp}
+
+
+def run(db_path: str, compact: bool, messages: int, session_size: int, reads: int) -> Dict[str, float]:
+    memory = ConversationMemory(db_path, compact=compact)
+    sessions = max(1, messages // session_size)
+    with memory.pool.writer() as conn:
+        conn.executemany("INSERT INTO sessions (session_id, title) VALUES (?, 'bench')",
+                         [(f"bench_{i:07d}",) for i in range(sessions)])
+
+    batch: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+    for message in generate(messages, session_size):
+        batch.append(message)
+        if len(batch) == 1000:
+            memory.add_message_batch(batch)
+            batch = []
+    if batch:
+        memory.add_message_batch(batch)
+    write_seconds = time.perf_counter() - started
+
+    with memory.pool.writer() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = Path(db_path).stat().st_size
+
+    rng = random.Random(7)
+    latencies = []
+    for _ in range(reads):
+        session_id = f"bench_{rng.randrange(sessions):07d}"
+        t0 = time.perf_counter()
+        memory.get_conversation_history(session_id, limit=session_size)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    latencies.sort()
+    memory.close()
+
+    return {
+        "size_mb": round(size / (1024 * 1024), 1),
+        "bytes_per_message": round(size / messages, 1),
+        "messages_per_second": round(messages / write_seconds),
+        "history_p50_ms": round(percentile(latencies, 50), 3),
+        "history_p99_ms": round(percentile(latencies, 99), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark kompakt lagring av meldinger")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--session-size", type=int, default=50)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--dir", default=None, help="Katalog for testdatabasene (standard: tmp)")
+    args = parser.parse_args()
+
+    directory = Path(args.dir or tempfile.mkdtemp(prefix="bench_storage_"))
+    directory.mkdir(parents=True, exist_ok=True)
+
+    zstd = compact_storage.zstandard
+    modes = [("json", False, zstd), ("compact-zlib", True, None)]
+    if zstd:
+        modes.append(("compact", True, zstd))
+
+    results = {}
+    for name, compact, module in modes:
+        compact_storage.zstandard = module
+        results[name] = run(str(directory / f"{name}.db"), compact, args.messages,
+                            args.session_size, args.reads)
+        print(f"{name}: {results[name]}", flush=True)
+    compact_storage.zstandard = zstd
+
+    print(f"\n{'':22}" + "".join(f"{name:>14}" for name in results))
+    for key in ("size_mb", "bytes_per_message", "messages_per_second", "history_p50_ms", "history_p99_ms"):
+        print(f"{key:22}" + "".join(f"{result[key]:>14}" for result in results.values()))
+
+
+if __name__ == "__main__":
+    main()
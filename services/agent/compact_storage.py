@@ -0,0 +1,368 @@
+"""
+Compact Storage for Message Metadata and Tool Payloads
+
+Hver assistentmelding lagret metadata som ukomprimert JSON-tekst: samme
+modellnavn i hver rad, en ISO-tidsstempel som dupliserer timestamp-kolonnen og
+trunkerte tool_results. tool_calls ble lagret ordrett. Ved mange meldinger var
+dette mesteparten av databasestørrelsen og sidecachen.
+
+Med compact=True i ConversationMemory lagres nye meldinger slik:
+
+  - metadata-kolonnen får en BLOB uten timestamp (gjenskapes fra kolonnen ved
+    lesing), med modellnavnet erstattet av en id i lookup_values
+  - tool_calls og tool_results flyttes til message_payloads (én rad per
+    melding), med tool-navn som id-er i lookup_values
+  - BLOB-ene komprimeres med zstd og en ordbok som trenes på de første
+    meldingene (lagret i compression_dicts). Uten zstandard-pakken brukes zlib
+
+Lesing er transparent: get_conversation_history og get_messages_page
+returnerer samme dicts som før, og rader lagret som JSON-tekst (før compact
+ble slått på) leses som før. Datasette viser BLOB-kolonnene som binærdata.
+
+Første byte i hver BLOB forteller formatet:
+
+  0x00  ukomprimert JSON
+  0x01  zlib
+  0x02  zstd uten ordbok
+  0x03  zstd med ordbok, etterfulgt av ordbokens id (4 bytes, big-endian)
+
+Måling av størrelse og ventetid: python bench_storage.py
+"""
+
+import json
+import logging
+import threading
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstandard er valgfri, zlib brukes da
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+RAW, ZLIB, ZSTD, ZSTD_DICT = 0, 1, 2, 3
+
+
+class CompactStorage:
+    """Koding og dekoding av kompakt metadata og tool payloads for ConversationMemory."""
+
+    def __init__(self, min_compress_bytes: int = 64,
+                 train_samples: int = 1000,
+                 dict_size: int = 16 * 1024,
+                 level: int = 3):
+        """
+        Initialiser kompakt lagring.
+
+        Args:
+            min_compress_bytes: Mindre BLOB-er lagres ukomprimert
+            train_samples: Antall BLOB-er som samles før zstd-ordboken trenes
+            dict_size: Størrelse på zstd-ordboken i bytes
+            level: Kompresjonsnivå (zstd), zlib bruker nivå 6
+        """
+        self.min_compress_bytes = min_compress_bytes
+        self.train_samples = train_samples
+        self.dict_size = dict_size
+        self.level = level
+        self.algorithm = "zstd" if zstandard else "zlib"
+
+        # lookup_values i begge retninger, (kind, value) -> id og id -> value
+        self._ids: Dict[Tuple[str, str], int] = {}
+        self._values: Dict[int, str] = {}
+        self._dicts: Dict[int, Any] = {}
+        self._dict_id: Optional[int] = None
+        self._compressor = zstandard.ZstdCompressor(level=level) if zstandard else None
+        self._samples: List[bytes] = []
+        # Nye lookup-verdier og ordbok fra skrivetransaksjonen som pågår, brukes
+        # av andre først etter commit (ved rollback finnes ikke radene). Endres
+        # bare mens skrivelåsen holdes, se commit() og rollback()
+        self._pending_ids: Dict[Tuple[str, str], int] = {}
+        self._pending_dict: Optional[Tuple[int, bytes]] = None
+        self._lock = threading.Lock()
+        # Dekompressorer er ikke trådsikre, hver lesetråd får sine egne
+        self._local = threading.local()
+
+        self.encoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init_schema(self, cursor):
+        """Opprett tabellene for kompakt lagring og last lookup-verdier og ordbøker."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lookup_values (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                UNIQUE(kind, value)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS message_payloads (
+                message_id INTEGER PRIMARY KEY,
+                tool_calls BLOB,
+                tool_results BLOB
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS compression_dicts (
+                id INTEGER PRIMARY KEY,
+                algorithm TEXT NOT NULL,
+                dict BLOB NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Payloads følger meldingen (retention, sletting i Datasette)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS message_payloads_delete AFTER DELETE ON conversations
+            BEGIN
+                DELETE FROM message_payloads WHERE message_id = old.id;
+            END
+        """)
+        self.load(cursor)
+
+    def load(self, cursor):
+        """Les lookup-verdier og ordbøker fra databasen (også de andre replikaer har lagt til)."""
+        rows = cursor.execute("SELECT id, kind, value FROM lookup_values").fetchall()
+        dict_rows = cursor.execute(
+            "SELECT id, dict FROM compression_dicts WHERE algorithm = 'zstd' ORDER BY id"
+        ).fetchall()
+        with self._lock:
+            for value_id, kind, value in rows:
+                self._ids[(kind, value)] = value_id
+                self._values[value_id] = value
+            if zstandard:
+                for dict_id, data in dict_rows:
+                    self._use_dict(dict_id, data)
+
+    def _use_dict(self, dict_id: int, data: bytes):
+        self._dicts[dict_id] = zstandard.ZstdCompressionDict(data)
+        if self._dict_id is None or dict_id > self._dict_id:
+            self._dict_id = dict_id
+            self._compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self._dicts[dict_id])
+
+    # ------------------------------------------------------------------ skriving
+
+    def commit(self):
+        """
+        Ta i bruk nye lookup-verdier og ny ordbok fra skrivetransaksjonen.
+
+        Kalles fra pool.writer(on_commit=...), mens skrivelåsen holdes, slik at
+        en annen skriver aldri ser verdier fra en transaksjon som ikke er committet.
+        """
+        with self._lock:
+            for key, value_id in self._pending_ids.items():
+                self._ids[key] = value_id
+                self._values[value_id] = key[1]
+            self._pending_ids.clear()
+            if self._pending_dict:
+                self._use_dict(*self._pending_dict)
+                self._pending_dict = None
+
+    def rollback(self):
+        """Forkast nye lookup-verdier og ordbok. Kalles fra pool.writer(on_rollback=...)."""
+        self._pending_ids.clear()
+        self._pending_dict = None
+
+    def encode(self, cursor, tool_calls: Optional[List[Dict[str, Any]]],
+               metadata: Optional[Dict[str, Any]]) -> Tuple[Optional[bytes], Optional[Tuple[Optional[bytes], Optional[bytes]]]]:
+        """
+        Kod én melding for lagring. Kalles i skrivetransaksjonen.
+
+        Args:
+            cursor: Cursor på skrivetilkoblingen (for nye lookup-verdier)
+            tool_calls: OpenAI tool_calls eller None
+            metadata: Metadata eller None
+
+        Returns:
+            (metadata BLOB eller None, (tool_calls BLOB, tool_results BLOB) eller None)
+        """
+        payload = None
+        metadata_blob = None
+
+        tool_results = None
+        if metadata:
+            metadata = dict(metadata)
+            # Dupliserer timestamp-kolonnen, gjenskapes ved lesing
+            if "timestamp" in metadata:
+                metadata["timestamp"] = None
+            if metadata.get("tool_results"):
+                tool_results = metadata.pop("tool_results")
+            if "model" in metadata:
+                metadata["model"] = self._lookup(cursor, "model", metadata["model"])
+            metadata_blob = self._pack(metadata)
+
+        if tool_calls or tool_results:
+            payload = (
+                self._pack(self._pack_tool_calls(cursor, tool_calls)) if tool_calls else None,
+                self._pack([
+                    [self._lookup(cursor, "tool", item["tool"]), item.get("arguments"), item.get("result")]
+                    for item in tool_results
+                ]) if tool_results else None
+            )
+        return metadata_blob, payload
+
+    def _lookup(self, cursor, kind: str, value: str) -> int:
+        key = (kind, value)
+        value_id = self._ids.get(key) or self._pending_ids.get(key)
+        if value_id is None:
+            cursor.execute("INSERT OR IGNORE INTO lookup_values (kind, value) VALUES (?, ?)", key)
+            value_id = cursor.execute(
+                "SELECT id FROM lookup_values WHERE kind = ? AND value = ?", key
+            ).fetchone()[0]
+            self._pending_ids[key] = value_id
+        return value_id
+
+    def _pack_tool_calls(self, cursor, tool_calls: List[Dict[str, Any]]) -> Any:
+        """[[id, tool-id, arguments], ...] når alle kall har standardformen, ellers uendret."""
+        packed = []
+        for call in tool_calls:
+            function = call.get("function") or {}
+            if call.get("type") != "function" or set(call) != {"id", "type", "function"} \
+                    or set(function) != {"name", "arguments"}:
+                return {"raw": tool_calls}
+            packed.append([call["id"], self._lookup(cursor, "tool", function["name"]), function["arguments"]])
+        return packed
+
+    def _pack(self, value: Any) -> bytes:
+        data = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        self.encoded += 1
+        self.bytes_in += len(data)
+        if len(data) < self.min_compress_bytes:
+            blob = bytes([RAW]) + data
+        elif zstandard:
+            self._collect_sample(data)
+            compressed = self._compressor.compress(data)
+            if self._dict_id is not None:
+                blob = bytes([ZSTD_DICT]) + self._dict_id.to_bytes(4, "big") + compressed
+            else:
+                blob = bytes([ZSTD]) + compressed
+        else:
+            blob = bytes([ZLIB]) + zlib.compress(data, 6)
+        self.bytes_out += len(blob)
+        return blob
+
+    def _collect_sample(self, data: bytes):
+        if self._dict_id is None and len(self._samples) < self.train_samples:
+            self._samples.append(data)
+
+    def train_if_ready(self, cursor) -> Optional[int]:
+        """
+        Tren zstd-ordboken når nok eksempler er samlet. Kalles i skrivetransaksjonen.
+
+        Returns:
+            Id for den nye ordboken, eller None
+        """
+        if not zstandard or self._dict_id is not None or self._pending_dict \
+                or len(self._samples) < self.train_samples:
+            return None
+        samples, self._samples = self._samples, []
+        try:
+            trained = zstandard.train_dictionary(self.dict_size, samples)
+        except Exception as e:  # f.eks. for lite eller for like eksempler
+            logger.warning(f"Kunne ikke trene zstd-ordbok: {e}")
+            return None
+        data = trained.as_bytes()
+        cursor.execute("INSERT INTO compression_dicts (algorithm, dict) VALUES ('zstd', ?)", (data,))
+        dict_id = cursor.lastrowid
+        self._pending_dict = (dict_id, data)
+        logger.info(f"zstd-ordbok {dict_id} trent på {len(samples)} meldinger ({len(data)} bytes)")
+        return dict_id
+
+    # ------------------------------------------------------------------ lesing
+
+    def decode(self, tool_calls_blob: Optional[bytes], tool_results_blob: Optional[bytes],
+               metadata_blob: Optional[bytes], timestamp: Optional[str],
+               reload: Optional[Callable[[], None]] = None) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+        """
+        Dekod kompakt lagrede felt tilbake til tool_calls og metadata.
+
+        Args:
+            tool_calls_blob, tool_results_blob: Kolonnene fra message_payloads
+            metadata_blob: metadata-kolonnen (BLOB)
+            timestamp: timestamp-kolonnen ("YYYY-MM-DD HH:MM:SS" UTC)
+            reload: Funksjon som kaller load() med en lesetilkobling, brukes når
+                en id ikke er kjent (lagt til av en annen prosess)
+
+        Returns:
+            (tool_calls eller None, metadata eller None)
+        """
+        tool_calls = None
+        if tool_calls_blob is not None:
+            packed = self._unpack(tool_calls_blob, reload)
+            if isinstance(packed, dict):
+                tool_calls = packed["raw"]
+            else:
+                tool_calls = [
+                    {"id": call_id, "type": "function",
+                     "function": {"name": self._value(tool_id, reload), "arguments": arguments}}
+                    for call_id, tool_id, arguments in packed
+                ]
+
+        metadata = None
+        if metadata_blob is not None:
+            metadata = self._unpack(metadata_blob, reload)
+            if "model" in metadata:
+                metadata["model"] = self._value(metadata["model"], reload)
+            if "timestamp" in metadata and metadata["timestamp"] is None and timestamp:
+                metadata["timestamp"] = timestamp.replace(" ", "T")
+            if tool_results_blob is not None:
+                metadata["tool_results"] = [
+                    {"tool": self._value(tool_id, reload), "arguments": arguments, "result": result}
+                    for tool_id, arguments, result in self._unpack(tool_results_blob, reload)
+                ]
+        return tool_calls, metadata
+
+    def _value(self, value_id: int, reload: Optional[Callable[[], None]]) -> str:
+        if value_id not in self._values and reload:
+            reload()
+        return self._values[value_id]
+
+    def _unpack(self, blob: bytes, reload: Optional[Callable[[], None]]) -> Any:
+        tag = blob[0]
+        if tag == RAW:
+            data = blob[1:]
+        elif tag == ZLIB:
+            data = zlib.decompress(blob[1:])
+        elif zstandard is None:
+            raise RuntimeError("Meldingen er komprimert med zstd, men zstandard er ikke installert")
+        elif tag == ZSTD:
+            data = self._decompressor(None, reload).decompress(blob[1:])
+        elif tag == ZSTD_DICT:
+            dict_id = int.from_bytes(blob[1:5], "big")
+            data = self._decompressor(dict_id, reload).decompress(blob[5:])
+        else:
+            raise ValueError(f"Ukjent format på lagret melding: {tag}")
+        return json.loads(data.decode("utf-8"))
+
+    def _decompressor(self, dict_id: Optional[int], reload: Optional[Callable[[], None]]):
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            if dict_id is None:
+                decompressor = zstandard.ZstdDecompressor()
+            else:
+                if dict_id not in self._dicts and reload:
+                    reload()
+                decompressor = zstandard.ZstdDecompressor(dict_data=self._dicts[dict_id])
+            decompressors[dict_id] = decompressor
+        return decompressor
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for kompakt lagring.
+
+        Returns:
+            Dictionary med algoritme, ordbok og kompresjonsgrad for BLOB-er skrevet av denne prosessen
+        """
+        return {
+            "algorithm": self.algorithm,
+            "dict_id": self._dict_id,
+            "lookup_values": len(self._values),
+            "encoded": self.encoded,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None
+        }
@@ -15,6 +15,22 @@ conversations:
   - metadata: JSON object with additional context
   - timestamp: Message timestamp
 
+conversations_fts:
+  - FTS5 indeks over conversations.content (external content, rowid = conversations.id),
+    holdt oppdatert av triggere på conversations
+
+lookup_values, message_payloads, compression_dicts:
+  - Kompakt lagring (compact=True): modell- og tool-navn som id-er, tool_calls og
+    tool_results i egen tabell, komprimert metadata. Se compact_storage.py
+
+archive_segments:
+  - Segmenter i arkivet (archive.py) med meldinger flyttet ut av databasen
+
+stats_counters, stats_roles, stats_daily, stats_users:
+  - Tellere for get_database_stats (totaler, meldinger per rolle og per dag,
+    sesjoner per bruker), holdt oppdatert av triggere og avstemt av reconcile_stats
+    (stats_counters 'reconciled' teller avstemminger som har rettet noe)
+
 sessions:
   - session_id: Primary key
   - user_id: User identifier
@@ -41,36 +57,79 @@ Assistant messages:
   }
 """
 
-import sqlite3
 import json
 import logging
+import re
+import uuid
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Set
 from pathlib import Path
 
+from archive import ArchiveConflict, ConversationArchive
+from compact_storage import CompactStorage
+from hot_tier import HotTier
+from sqlite_pool import SQLitePool
+
 logger = logging.getLogger(__name__)
 
+# Meldingskolonner i rekkefølgen _decode_message forventer
+MESSAGE_SELECT = """
+    SELECT c.id, c.role, c.content, c.tool_calls, c.metadata, c.timestamp,
+           p.tool_calls, p.tool_results
+    FROM conversations c
+    LEFT JOIN message_payloads p ON p.message_id = c.id
+"""
+
 class ConversationMemory:
     """Persistent hukommelse for samtaler med SQLite database."""
     
-    def __init__(self, db_path: str = "data/conversations.db"):
+    def __init__(self, db_path: str = "data/conversations.db", compact: bool = False,
+                 hot_tier_bytes: int = 0, hot_tail_size: int = 50, hot_validate: bool = True,
+                 auto_vacuum: bool = False, **pool_options):
         """
         Initialiser hukommelse med database.
         
         Args:
             db_path: Sti til SQLite database fil
+            compact: Lagre nye meldinger kompakt (se compact_storage.py). Meldinger
+                lagret i begge formater kan alltid leses
+            hot_tier_bytes: Minnetak for dekodede sesjonshaler (se hot_tier.py), 0 slår av
+            hot_tail_size: Antall siste meldinger per sesjon i hot tier
+            hot_validate: Sjekk hot tier mot databasen før bruk (nødvendig når flere
+                prosesser skriver til samme database)
+            auto_vacuum: Opprett nye databaser med auto_vacuum=INCREMENTAL (retention).
+                En eksisterende database må migreres med enable_incremental_vacuum
+            **pool_options: Innstillinger for SQLitePool (readers, mmap_size,
+                cache_size_kib, busy_timeout_ms, cached_statements)
         """
         self.db_path = db_path
         
         # Opprett data katalog hvis den ikke eksisterer
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        # Langlivede tilkoblinger (WAL, én skriver og en pool med lesere)
+        self.pool = SQLitePool(db_path, auto_vacuum="INCREMENTAL" if auto_vacuum else None,
+                               **pool_options)
+
+        # Settes hvis søkeindeksen ble opprettet for en database med eksisterende meldinger
+        self.search_backfill_pending = False
+
+        self.compact = compact
+        self.compact_storage = CompactStorage()
+
+        self.hot = HotTier(hot_tier_bytes, hot_tail_size) if hot_tier_bytes > 0 else None
+        self.hot_validate = hot_validate
         
         # Initialiser database
         self._init_database()
+
+        if auto_vacuum and not self.incremental_vacuum_enabled():
+            logger.warning(f"{db_path} har ikke auto_vacuum=INCREMENTAL, så retention krymper ikke "
+                           f"filen. Engangsmigrering (VACUUM): make db-enable-vacuum")
         
     def _init_database(self):
         """Opprett database tabeller hvis de ikke eksisterer."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             
             # Hovedtabell for samtaler
@@ -110,10 +169,358 @@ class ConversationMemory:
                 CREATE INDEX IF NOT EXISTS idx_conversations_timestamp 
                 ON conversations(timestamp)
             """)
-            
-            conn.commit()
+
+            # Keyset paginering per sesjon: id er monotont og entydig, i motsetning til
+            # timestamp (sekundoppløsning). "Siste N meldinger" blir ett indeks-søk
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversations_user_session_id
+                ON conversations(user_id, session_id, id)
+            """)
+
+            # Arkivering henter meldingene i en sesjon uansett user_id (meldingene kan
+            # være lagret med en annen user_id enn sesjonsraden)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversations_session_id
+                ON conversations(session_id, id)
+            """)
+
+            # Sesjonsliste sortert på siste aktivitet (session_id skiller like tidspunkt)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_user_activity
+                ON sessions(user_id, last_activity, session_id)
+            """)
+
+            # Retention for alle brukere finner utløpte sesjoner uten full skanning
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_last_activity
+                ON sessions(last_activity)
+            """)
+
+            # Største sesjoner for get_database_stats uten å sortere hele tabellen
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_message_count
+                ON sessions(message_count)
+            """)
+
+            # Segmenter i arkivet (archive.py), registrert i samme transaksjon som slettingen
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS archive_segments (
+                    name TEXT PRIMARY KEY,
+                    month TEXT NOT NULL,
+                    messages INTEGER NOT NULL,
+                    sessions INTEGER NOT NULL,
+                    min_id INTEGER NOT NULL,
+                    max_id INTEGER NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            self._init_search_index(cursor)
+            self._init_stats(cursor)
+            self.compact_storage.init_schema(cursor)
             logger.info(f"Database initialisert: {self.db_path}")
     
+    def _init_search_index(self, cursor):
+        """
+        Opprett FTS5-indeksen over meldingsinnholdet og triggerne som holder den oppdatert.
+
+        Indeksen lagrer ikke teksten selv (content='conversations'), bare
+        termene. Søket skiller ikke mellom store og små bokstaver, og
+        remove_diacritics gjør at "cafe" finner "café". æ, ø og å er egne
+        bokstaver og må skrives som de er.
+        """
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'"
+        ).fetchone()
+
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+                content,
+                content='conversations',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations
+            BEGIN
+                INSERT INTO conversations_fts(rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        # Rader som ikke er indeksert ennå (backfill pågår) må ikke "slettes" fra indeksen
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations
+            WHEN EXISTS (SELECT 1 FROM conversations_fts_docsize WHERE id = old.id)
+            BEGIN
+                INSERT INTO conversations_fts(conversations_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF content ON conversations
+            WHEN EXISTS (SELECT 1 FROM conversations_fts_docsize WHERE id = old.id)
+            BEGIN
+                INSERT INTO conversations_fts(conversations_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+                INSERT INTO conversations_fts(rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+
+        if not exists and cursor.execute("SELECT 1 FROM conversations LIMIT 1").fetchone():
+            self.search_backfill_pending = True
+            logger.info("Søkeindeks opprettet for eksisterende database, meldinger må indekseres "
+                        "(backfill_search_index)")
+
+    def _init_stats(self, cursor):
+        """
+        Opprett statistikktabellene og triggerne som holder dem oppdatert.
+
+        get_database_stats leser da noen få rader i stedet for å telle hele
+        conversations og sessions. Triggerne fanger alle skrivinger (også
+        retention og SQL direkte mot filen). UPDATE av role, timestamp eller
+        user_id telles ikke om, det retter reconcile_stats.
+        """
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats_counters'"
+        ).fetchone()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_roles (
+                role TEXT PRIMARY KEY,
+                messages INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_daily (
+                day TEXT PRIMARY KEY,
+                messages INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_users (
+                user_id TEXT PRIMARY KEY,
+                sessions INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stats_conversations_insert AFTER INSERT ON conversations
+            BEGIN
+                INSERT INTO stats_counters(name, value) VALUES ('messages', 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + 1;
+                INSERT INTO stats_roles(role, messages) VALUES (new.role, 1)
+                ON CONFLICT(role) DO UPDATE SET messages = messages + 1;
+                INSERT INTO stats_daily(day, messages) VALUES (date(new.timestamp), 1)
+                ON CONFLICT(day) DO UPDATE SET messages = messages + 1;
+            END
+        """)
+        # Tidligere versjoner av triggeren lot rader med 0 meldinger bli stående i stats_roles
+        cursor.execute("DROP TRIGGER IF EXISTS stats_conversations_delete")
+        cursor.execute("DELETE FROM stats_roles WHERE messages <= 0")
+        cursor.execute("""
+            CREATE TRIGGER stats_conversations_delete AFTER DELETE ON conversations
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'messages';
+                UPDATE stats_roles SET messages = messages - 1 WHERE role = old.role;
+                DELETE FROM stats_roles WHERE role = old.role AND messages <= 0;
+                UPDATE stats_daily SET messages = messages - 1 WHERE day = date(old.timestamp);
+                DELETE FROM stats_daily WHERE day = date(old.timestamp) AND messages <= 0;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stats_sessions_insert AFTER INSERT ON sessions
+            BEGIN
+                INSERT INTO stats_counters(name, value) VALUES ('sessions', 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + 1;
+                INSERT INTO stats_users(user_id, sessions) VALUES (new.user_id, 1)
+                ON CONFLICT(user_id) DO UPDATE SET sessions = sessions + 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stats_sessions_delete AFTER DELETE ON sessions
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'sessions';
+                UPDATE stats_users SET sessions = sessions - 1 WHERE user_id = old.user_id;
+                DELETE FROM stats_users WHERE user_id = old.user_id AND sessions <= 0;
+            END
+        """)
+        # Antall unike brukere = antall rader i stats_users
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON stats_users
+            BEGIN
+                INSERT INTO stats_counters(name, value) VALUES ('users', 1)
+                ON CONFLICT(name) DO UPDATE SET value = value + 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON stats_users
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+            END
+        """)
+
+        if not exists:
+            actual, stored = self._count_stats(cursor)
+            if self._stats_drift(actual, stored):
+                self._apply_stats(cursor, actual, stored)
+                logger.info("Statistikktabeller fylt fra eksisterende data")
+
+    def reconcile_stats(self, attempts: int = 3) -> Dict[str, int]:
+        """
+        Tell opp statistikken på nytt fra conversations og sessions og rett tellerne.
+
+        De fulle skanningene kjøres på en lesetilkobling, med tabellene og tellerne
+        fra samme øyeblikksbilde, så skriveren blokkeres ikke mens det telles.
+        Skrivetransaksjonen legger bare til differansen (faktisk minus lagret i
+        øyeblikksbildet) for radene med avvik. Triggerne har endret tabellene og
+        tellerne likt siden øyeblikksbildet, så differansen gjelder fortsatt; det
+        gjør den ikke hvis en annen avstemming (annen replika, make
+        db-stats-reconcile) har rettet i mellomtiden. Det sjekkes mot telleren
+        'reconciled' fra øyeblikksbildet, og da telles det opp igjen (høyst
+        attempts ganger). Ment for en sjelden bakgrunnsjobb (StatsReconciler).
+
+        Args:
+            attempts: Antall øyeblikksbilder før avstemmingen gir opp til neste kjøring
+
+        Returns:
+            Avvik som ble rettet: for totalene (messages, sessions, users) faktisk
+            minus lagret verdi, for roles, days og user_rows antall rader som var feil.
+            Tom dict hvis alt stemte
+        """
+        for _ in range(max(1, attempts)):
+            with self.pool.reader() as conn:
+                conn.execute("BEGIN")
+                cursor = conn.cursor()
+                actual, stored = self._count_stats(cursor)
+                generation = self._stored_counter(cursor, "reconciled")
+            drift = self._stats_drift(actual, stored)
+            if not drift:
+                return drift
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                applied = self._stored_counter(cursor, "reconciled") == generation
+                if applied:
+                    self._apply_stats(cursor, actual, stored)
+            if applied:
+                logger.warning(f"Statistikktellere var ute av takt og er rettet: {drift}")
+                return drift
+        logger.info("Statistikken ble avstemt av en annen prosess underveis, prøver igjen ved neste kjøring")
+        return {}
+
+    # Tellertabell, nøkkelkolonne og verdikolonne per gruppe i _count_stats
+    _STATS_TABLES = {
+        "user_rows": ("stats_users", "user_id", "sessions"),
+        "roles": ("stats_roles", "role", "messages"),
+        "days": ("stats_daily", "day", "messages"),
+        "counters": ("stats_counters", "name", "value")
+    }
+
+    @staticmethod
+    def _stored_counter(cursor, name: str) -> int:
+        row = cursor.execute("SELECT value FROM stats_counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _count_stats(cursor) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[str, int]]]:
+        """Faktiske verdier fra tabellene og lagrede tellerverdier, per gruppe i _STATS_TABLES."""
+        def table(sql: str) -> Dict[str, int]:
+            return dict(cursor.execute(sql).fetchall())
+
+        actual = {
+            "counters": {
+                "messages": cursor.execute("SELECT COUNT(*) FROM conversations").fetchone()[0],
+                "sessions": cursor.execute("SELECT COUNT(*) FROM sessions").fetchone()[0],
+                "users": cursor.execute("SELECT COUNT(DISTINCT user_id) FROM sessions").fetchone()[0]
+            },
+            "roles": table("SELECT role, COUNT(*) FROM conversations GROUP BY role"),
+            "days": table("SELECT date(timestamp), COUNT(*) FROM conversations GROUP BY date(timestamp)"),
+            "user_rows": table("SELECT user_id, COUNT(*) FROM sessions GROUP BY user_id")
+        }
+        stored = {
+            name: table(f"SELECT {key}, {value} FROM {table_name}")
+            for name, (table_name, key, value) in ConversationMemory._STATS_TABLES.items()
+        }
+        stored["counters"] = {name: value for name, value in stored["counters"].items()
+                              if name in actual["counters"]}
+        return actual, stored
+
+    @staticmethod
+    def _stats_drift(actual: Dict[str, Dict[str, int]],
+                     stored: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+        counters = stored["counters"]
+        drift = {
+            name: value - counters.get(name, 0)
+            for name, value in actual["counters"].items()
+            if value != counters.get(name, 0)
+        }
+        for name in ("roles", "days", "user_rows"):
+            # En manglende rad og en rad med 0 betyr det samme
+            wrong = sum(1 for key in actual[name].keys() | stored[name].keys()
+                        if actual[name].get(key, 0) != stored[name].get(key, 0))
+            if wrong:
+                drift[name] = wrong
+        return drift
+
+    @staticmethod
+    def _apply_stats(cursor, actual: Dict[str, Dict[str, int]],
+                     stored: Dict[str, Dict[str, int]]):
+        """Legg differansen actual - stored til radene med avvik, og tell opp 'reconciled'."""
+        # stats_users-triggerne endrer 'users' når rader legges til eller fjernes,
+        # så den delen av differansen er allerede lagt til når stats_counters rettes
+        users_before = ConversationMemory._stored_counter(cursor, "users")
+        for name, (table_name, key, value) in ConversationMemory._STATS_TABLES.items():
+            deltas = {
+                row: actual[name].get(row, 0) - stored[name].get(row, 0)
+                for row in actual[name].keys() | stored[name].keys()
+                if actual[name].get(row, 0) != stored[name].get(row, 0)
+            }
+            if name == "counters" and "users" in deltas:
+                deltas["users"] -= ConversationMemory._stored_counter(cursor, "users") - users_before
+            cursor.executemany(f"""
+                INSERT INTO {table_name}({key}, {value}) VALUES (?, ?)
+                ON CONFLICT({key}) DO UPDATE SET {value} = {value} + excluded.{value}
+            """, deltas.items())
+            if name != "counters":
+                cursor.executemany(f"DELETE FROM {table_name} WHERE {key} = ? AND {value} <= 0",
+                                   [(row,) for row in deltas])
+        cursor.execute("""
+            INSERT INTO stats_counters(name, value) VALUES ('reconciled', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1
+        """)
+
+    def incremental_vacuum_enabled(self) -> bool:
+        """True hvis databasen bruker auto_vacuum=INCREMENTAL."""
+        # Lesetilkoblingene husker modusen fra da de ble åpnet, også etter VACUUM
+        with self.pool.writer() as conn:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    def enable_incremental_vacuum(self) -> Dict[str, Any]:
+        """
+        Engangsmigrering til auto_vacuum=INCREMENTAL, slik at retention kan gi
+        slettede sider tilbake til filsystemet med incremental_vacuum.
+
+        Innstillingen får først virkning etter VACUUM, som skriver om hele filen
+        og holder skrivelåsen så lenge. Kjøres eksplisitt (make db-enable-vacuum),
+        helst når det er lite trafikk.
+
+        Returns:
+            {"auto_vacuum": "incremental", "rewritten": True hvis filen ble skrevet om}
+        """
+        if self.incremental_vacuum_enabled():
+            return {"auto_vacuum": "incremental", "rewritten": False}
+        logger.info(f"Skriver om {self.db_path} med VACUUM for auto_vacuum=INCREMENTAL")
+        with self.pool.writer() as conn:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        with self.pool.writer() as conn:
+            conn.execute("VACUUM")
+        return {"auto_vacuum": "incremental", "rewritten": True}
+
     def create_session(self, user_id: str = "default", title: Optional[str] = None) -> str:
         """
         Opprett ny samtalesesjon.
@@ -125,18 +532,25 @@ class ConversationMemory:
         Returns:
             Session ID
         """
-        session_id = f"{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        # Suffiks slik at flere sesjoner i samme sekund (f.eks. batch) får unik ID
+        session_id = f"{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.writer() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO sessions (session_id, user_id, title)
                 VALUES (?, ?, ?)
             """, (session_id, user_id, title))
-            conn.commit()
             
         logger.info(f"Ny sesjon opprettet: {session_id}")
         return session_id
+
+    def session_exists(self, session_id: str) -> bool:
+        """True hvis sesjonen finnes (ikke slettet eller arkivert av retention)."""
+        with self.pool.reader() as conn:
+            return conn.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone() is not None
     
     def add_message(self, session_id: str, role: str, content: str, 
                    tool_calls: Optional[List[Dict]] = None,
@@ -144,6 +558,8 @@ class ConversationMemory:
                    user_id: str = "default"):
         """
         Legg til melding i samtalehistorikk.
+
+        For flere meldinger på en gang, bruk add_messages (én transaksjon).
         
         Args:
             session_id: Sesjon ID
@@ -153,33 +569,163 @@ class ConversationMemory:
             metadata: Ekstra metadata
             user_id: Bruker ID
         """
-        tool_calls_json = json.dumps(tool_calls) if tool_calls else None
-        metadata_json = json.dumps(metadata) if metadata else None
-        
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Legg til melding
-            cursor.execute("""
-                INSERT INTO conversations (user_id, session_id, role, content, tool_calls, metadata)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (user_id, session_id, role, content, tool_calls_json, metadata_json))
-            
-            # Oppdater sesjon statistikk
-            cursor.execute("""
-                UPDATE sessions 
-                SET last_activity = CURRENT_TIMESTAMP,
-                    message_count = message_count + 1
-                WHERE session_id = ?
-            """, (session_id,))
-            
-            conn.commit()
+        self.add_messages(session_id, [{
+            "role": role,
+            "content": content,
+            "tool_calls": tool_calls,
+            "metadata": metadata
+        }], user_id=user_id)
+
+    def add_messages(self, session_id: str, messages: List[Dict[str, Any]],
+                     user_id: str = "default") -> int:
+        """
+        Legg til mange meldinger i én sesjon i én transaksjon.
+
+        Alle radene settes inn med executemany, og sesjonens message_count og
+        last_activity oppdateres én gang. En hel tur (bruker, assistent med
+        tool_calls, tool-meldinger) koster dermed én commit.
+
+        Args:
+            session_id: Sesjon ID
+            messages: Liste med dicts med nøklene role, content og valgfritt
+                tool_calls, metadata og timestamp ("YYYY-MM-DD HH:MM:SS" UTC,
+                samme format som CURRENT_TIMESTAMP)
+            user_id: Bruker ID
+
+        Returns:
+            Antall meldinger lagret
+        """
+        if not messages:
+            return 0
+        self._insert_messages([(session_id, user_id, msg) for msg in messages],
+                              {session_id: len(messages)})
+        return len(messages)
     
+    def add_message_batch(self, messages: List[Dict[str, Any]],
+                          assign_ids: Optional[Callable[[List[int]], None]] = None):
+        """
+        Legg til mange meldinger (på tvers av sesjoner) i én transaksjon.
+
+        Brukes av write-behind pipelinen i agenten for å samle flere meldinger
+        per fsync. Som add_messages, men med session_id (og evt. user_id) per melding.
+
+        Args:
+            messages: Liste med dicts med nøklene session_id, role, content og
+                valgfritt tool_calls, metadata, user_id og timestamp
+            assign_ids: Kalles med meldingenes id-er (i samme rekkefølge) før commit,
+                slik at en leser kan se hvilke meldinger et øyeblikksbilde inneholder
+        """
+        if not messages:
+            return
+
+        items = []
+        session_counts: Dict[str, int] = {}
+        for msg in messages:
+            items.append((msg["session_id"], msg.get("user_id", "default"), msg))
+            session_counts[msg["session_id"]] = session_counts.get(msg["session_id"], 0) + 1
+        self._insert_messages(items, session_counts, assign_ids)
+
+    @staticmethod
+    def _message_row(session_id: str, user_id: str, msg: Dict[str, Any]) -> tuple:
+        tool_calls = msg.get("tool_calls")
+        metadata = msg.get("metadata")
+        return (
+            user_id,
+            session_id,
+            msg["role"],
+            msg["content"],
+            json.dumps(tool_calls) if tool_calls else None,
+            json.dumps(metadata) if metadata else None,
+            msg.get("timestamp") or datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        )
+
+    def _insert_messages(self, items: List[tuple], session_counts: Dict[str, int],
+                         assign_ids: Optional[Callable[[List[int]], None]] = None):
+        """Sett inn (session_id, user_id, melding) og oppdater sesjon statistikk i én transaksjon."""
+        insert = """
+            INSERT INTO conversations (user_id, session_id, role, content, tool_calls, metadata, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """
+        update_session = """
+            UPDATE sessions 
+            SET last_activity = CURRENT_TIMESTAMP,
+                message_count = message_count + ?
+            WHERE session_id = ?
+        """
+        # Lagrede rader i samme form som MESSAGE_SELECT, for write-through til hot tier
+        stored: List[Tuple[str, str, tuple]] = []
+        counted: Dict[str, bool] = {}
+        ids: List[int] = []
+
+        def write_through():
+            # Etter commit og før skrivelåsen slippes: halene oppdateres i id-rekkefølge
+            per_session: Dict[Tuple[str, str], List[Tuple[Dict[str, Any], int]]] = {}
+            for session_id, user_id, row in stored:
+                per_session.setdefault((session_id, user_id), []).append(
+                    (self._decode_message(row), self._stored_size(row))
+                )
+            for (session_id, user_id), messages in per_session.items():
+                self.hot.append(session_id, user_id, messages, counted.get(session_id, False))
+
+        def on_commit():
+            self.compact_storage.commit()
+            if self.hot:
+                write_through()
+
+        with self.pool.writer(on_commit=on_commit, on_rollback=self.compact_storage.rollback) as conn:
+            cursor = conn.cursor()
+            if self.compact:
+                # Én INSERT per melding, payload-raden trenger meldingens id
+                for session_id, user_id, msg in items:
+                    metadata_blob, payload = self.compact_storage.encode(
+                        cursor, msg.get("tool_calls"), msg.get("metadata")
+                    )
+                    timestamp = msg.get("timestamp") or datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+                    cursor.execute(insert, (
+                        user_id, session_id, msg["role"], msg["content"], None, metadata_blob, timestamp
+                    ))
+                    message_id = cursor.lastrowid
+                    ids.append(message_id)
+                    if payload:
+                        cursor.execute("""
+                            INSERT INTO message_payloads (message_id, tool_calls, tool_results)
+                            VALUES (?, ?, ?)
+                        """, (message_id, *payload))
+                    if self.hot:
+                        stored.append((session_id, user_id, (
+                            message_id, msg["role"], msg["content"], None, metadata_blob, timestamp,
+                            *(payload or (None, None))
+                        )))
+                self.compact_storage.train_if_ready(cursor)
+            else:
+                rows = [self._message_row(session_id, user_id, msg) for session_id, user_id, msg in items]
+                cursor.executemany(insert, rows)
+                if (self.hot or assign_ids) and rows:
+                    # AUTOINCREMENT i én skrivetransaksjon: radene har fortløpende id-er
+                    first_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0] - len(rows) + 1
+                    ids.extend(range(first_id, first_id + len(rows)))
+                    if self.hot:
+                        for offset, (user_id, session_id, *columns) in enumerate(rows):
+                            stored.append((session_id, user_id, (first_id + offset, *columns, None, None)))
+            if assign_ids:
+                assign_ids(ids)
+
+            # Oppdater sesjon statistikk én gang per sesjon
+            if self.hot:
+                # Hot tier må vite om message_count faktisk ble økt (sesjonsraden kan mangle)
+                for session_id, count in session_counts.items():
+                    cursor.execute(update_session, (count, session_id))
+                    counted[session_id] = cursor.rowcount > 0
+            else:
+                cursor.executemany(update_session, [
+                    (count, session_id) for session_id, count in session_counts.items()
+                ])
+
     def get_conversation_history(self, session_id: str, 
                                limit: int = 50,
                                user_id: str = "default") -> List[Dict[str, Any]]:
         """
-        Hent samtalehistorikk for en sesjon.
+        Hent de siste meldingene i en sesjon.
         
         Args:
             session_id: Sesjon ID
@@ -187,37 +733,187 @@ class ConversationMemory:
             user_id: Bruker ID
             
         Returns:
-            Liste med meldinger
+            De siste limit meldingene, eldste først (i lagret rekkefølge)
+        """
+        return self.get_messages_page(session_id, limit=limit, user_id=user_id)["messages"]
+
+    def get_messages_page(self, session_id: str, limit: int = 50,
+                          before_id: Optional[int] = None,
+                          after_id: Optional[int] = None,
+                          user_id: str = "default") -> Dict[str, Any]:
+        """
+        Hent en side med meldinger med keyset paginering på (session_id, id).
+
+        Uten cursor hentes de siste meldingene. Med before_id blas det bakover
+        (eldre meldinger), med after_id fremover (nyere meldinger). Hver side er
+        ett indeks-søk, uansett hvor langt ut i historikken siden ligger.
+
+        Args:
+            session_id: Sesjon ID
+            limit: Maksimalt antall meldinger på siden
+            before_id: Hent meldinger med id mindre enn denne
+            after_id: Hent meldinger med id større enn denne
+            user_id: Bruker ID
+
+        Returns:
+            {"messages": [...] eldste først, med "id",
+             "before_id": cursor for eldre side eller None,
+             "after_id": cursor for nyere side (siste id, eller after_id hvis tom)}
         """
-        with sqlite3.connect(self.db_path) as conn:
+        if before_id is not None and after_id is not None:
+            raise ValueError("Bruk enten before_id eller after_id, ikke begge")
+
+        if self.hot and before_id is None and after_id is None and limit <= self.hot.tail_size:
+            return self._hot_page(session_id, limit, user_id)
+
+        forward = after_id is not None
+        conditions = "c.user_id = ? AND c.session_id = ?"
+        params: List[Any] = [user_id, session_id]
+        if forward:
+            conditions += " AND c.id > ?"
+            params.append(after_id)
+        elif before_id is not None:
+            conditions += " AND c.id < ?"
+            params.append(before_id)
+
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT role, content, tool_calls, metadata, timestamp
-                FROM conversations
-                WHERE user_id = ? AND session_id = ?
-                ORDER BY timestamp ASC
+            # En ekstra rad forteller om det finnes flere meldinger i samme retning
+            cursor.execute(f"""
+                {MESSAGE_SELECT}
+                WHERE {conditions}
+                ORDER BY c.id {"ASC" if forward else "DESC"}
                 LIMIT ?
-            """, (user_id, session_id, limit))
-            
-            messages = []
-            for row in cursor.fetchall():
-                role, content, tool_calls_json, metadata_json, timestamp = row
-                
-                message = {
-                    "role": role,
-                    "content": content,
-                    "timestamp": timestamp
-                }
-                
-                if tool_calls_json:
-                    message["tool_calls"] = json.loads(tool_calls_json)
-                
-                if metadata_json:
-                    message["metadata"] = json.loads(metadata_json)
-                
-                messages.append(message)
-            
-            return messages
+            """, (*params, limit + 1))
+            rows = cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+        messages = [self._decode_message(row) for row in rows]
+
+        if forward:
+            return {
+                "messages": messages,
+                "before_id": messages[0]["id"] if messages else None,
+                "after_id": messages[-1]["id"] if messages else after_id,
+                "has_more": has_more
+            }
+        return {
+            "messages": messages,
+            "before_id": messages[0]["id"] if messages and has_more else None,
+            "after_id": messages[-1]["id"] if messages else before_id,
+            "has_more": has_more
+        }
+
+    def _hot_page(self, session_id: str, limit: int, user_id: str) -> Dict[str, Any]:
+        """Siste side fra hot tier, eller fra disk (og legg sesjonen inn i hot tier)."""
+        cached = self.hot.get(session_id, user_id, limit)
+        if cached is not None:
+            if self.hot_validate:
+                # Ett indeksoppslag: har noen (f.eks. en annen prosess) skrevet til sesjonen?
+                with self.pool.reader() as conn:
+                    version = self._session_version(conn, session_id, user_id)
+                if version != (cached["last_id"], cached["message_count"]):
+                    self.hot.stale(session_id)
+                    cached = None
+            if cached is not None:
+                self.hot.hit()
+
+        if cached is None:
+            messages, has_more = self._load_hot(session_id, limit, user_id)
+        else:
+            messages, has_more = cached["messages"], cached["has_more"]
+
+        return {
+            "messages": messages,
+            "before_id": messages[0]["id"] if messages and has_more else None,
+            "after_id": messages[-1]["id"] if messages else None,
+            "has_more": has_more
+        }
+
+    def _load_hot(self, session_id: str, limit: int, user_id: str) -> Tuple[List[Dict[str, Any]], bool]:
+        tail_size = self.hot.tail_size
+        self.hot.begin_load(session_id)
+        try:
+            with self.pool.reader() as conn:
+                # Meldinger og message_count fra samme øyeblikksbilde
+                conn.execute("BEGIN")
+                rows = conn.execute(f"""
+                    {MESSAGE_SELECT}
+                    WHERE c.user_id = ? AND c.session_id = ?
+                    ORDER BY c.id DESC
+                    LIMIT ?
+                """, (user_id, session_id, tail_size + 1)).fetchall()
+                session = conn.execute(
+                    "SELECT message_count FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+            complete = len(rows) <= tail_size
+            rows = rows[:tail_size]
+            rows.reverse()
+            loaded = [(self._decode_message(row), self._stored_size(row)) for row in rows]
+        except BaseException:
+            self.hot.cancel_load(session_id)
+            raise
+        self.hot.load(session_id, user_id, loaded, complete, session[0] if session else None)
+
+        # Kopier, så kallere ikke endrer meldingene i hot tier
+        page = [dict(message) for message, _ in loaded[max(len(loaded) - limit, 0):]] if limit > 0 else []
+        return page, len(loaded) > len(page) or not complete
+
+    @staticmethod
+    def _session_version(conn, session_id: str, user_id: str) -> tuple:
+        return conn.execute("""
+            SELECT (SELECT MAX(id) FROM conversations WHERE user_id = ? AND session_id = ?),
+                   (SELECT message_count FROM sessions WHERE session_id = ?)
+        """, (user_id, session_id, session_id)).fetchone()
+
+    @staticmethod
+    def _stored_size(row: tuple) -> int:
+        """Lagret størrelse for en rad fra MESSAGE_SELECT (grunnlag for minnetaket i hot tier)."""
+        size = len(row[2])
+        for value in (row[3], row[4], row[6], row[7]):
+            if value:
+                # Komprimerte felt tar omtrent tre ganger så mye plass dekodet
+                size += len(value) * 3 if isinstance(value, bytes) else len(value)
+        return size
+
+    def _decode_message(self, row: tuple) -> Dict[str, Any]:
+        (message_id, role, content, tool_calls_json, metadata_json, timestamp,
+         tool_calls_blob, tool_results_blob) = row
+        
+        message = {
+            "id": message_id,
+            "role": role,
+            "content": content,
+            "timestamp": timestamp
+        }
+        
+        if tool_calls_json:
+            message["tool_calls"] = json.loads(tool_calls_json)
+        
+        if isinstance(metadata_json, str):
+            message["metadata"] = json.loads(metadata_json)
+
+        # Kompakt lagret (compact=True): metadata er en BLOB, tool payloads i message_payloads
+        if isinstance(metadata_json, bytes) or tool_calls_blob is not None:
+            tool_calls, metadata = self.compact_storage.decode(
+                tool_calls_blob, tool_results_blob,
+                metadata_json if isinstance(metadata_json, bytes) else None,
+                timestamp, reload=self._reload_compact_storage
+            )
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            if metadata is not None:
+                message["metadata"] = metadata
+        
+        return message
+
+    def _reload_compact_storage(self):
+        """Les lookup-verdier og ordbøker på nytt (lagt til av en annen prosess)."""
+        with self.pool.reader() as conn:
+            self.compact_storage.load(conn.cursor())
     
     def get_recent_context(self, session_id: str, 
                           context_window: int = 10,
@@ -261,100 +957,565 @@ class ConversationMemory:
             limit: Maksimalt antall sesjoner
             
         Returns:
-            Liste med sesjon informasjon
+            Liste med sesjon informasjon, sist aktive først
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        return self.get_sessions_page(user_id, limit)["sessions"]
+
+    def get_sessions_page(self, user_id: str = "default", limit: int = 20,
+                          cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Hent en side med sesjoner, sist aktive først (keyset paginering).
+
+        Args:
+            user_id: Bruker ID
+            limit: Maksimalt antall sesjoner på siden
+            cursor: next_cursor fra forrige side
+
+        Returns:
+            {"sessions": [...], "next_cursor": cursor for neste side eller None}
+        """
+        conditions = "user_id = ?"
+        params: List[Any] = [user_id]
+        if cursor:
+            last_activity, _, session_id = cursor.partition("|")
+            conditions += " AND (last_activity, session_id) < (?, ?)"
+            params += [last_activity, session_id]
+
+        with self.pool.reader() as conn:
+            db_cursor = conn.cursor()
+            db_cursor.execute(f"""
                 SELECT session_id, title, created_at, last_activity, message_count
                 FROM sessions
-                WHERE user_id = ?
-                ORDER BY last_activity DESC
+                WHERE {conditions}
+                ORDER BY last_activity DESC, session_id DESC
                 LIMIT ?
-            """, (user_id, limit))
+            """, (*params, limit + 1))
+            rows = db_cursor.fetchall()
             
-            sessions = []
-            for row in cursor.fetchall():
-                session_id, title, created_at, last_activity, message_count = row
-                sessions.append({
-                    "session_id": session_id,
-                    "title": title or "Uten tittel",
-                    "created_at": created_at,
-                    "last_activity": last_activity,
-                    "message_count": message_count
-                })
-            
-            return sessions
+        sessions = []
+        for row in rows[:limit]:
+            session_id, title, created_at, last_activity, message_count = row
+            sessions.append({
+                "session_id": session_id,
+                "title": title or "Uten tittel",
+                "created_at": created_at,
+                "last_activity": last_activity,
+                "message_count": message_count
+            })
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = sessions[-1]
+            next_cursor = f"{last['last_activity']}|{last['session_id']}"
+        return {"sessions": sessions, "next_cursor": next_cursor}
     
+    def search_messages(self, query: str, user_id: Optional[str] = None,
+                        limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fulltekstsøk i meldingsinnhold, beste treff først (bm25).
+
+        Hvert ord i query må finnes i meldingen. Et ord som slutter på * er et
+        prefikssøk ("regn*" finner "regnet" og "regnjakke"). FTS5-operatorer i
+        query tolkes ikke.
+
+        Args:
+            query: Søketekst
+            user_id: Spesifikk bruker ID, eller None for alle brukere
+            limit: Maksimalt antall treff på siden
+            cursor: next_cursor fra forrige side
+
+        Returns:
+            {"results": [{"id", "session_id", "user_id", "title", "role",
+                          "timestamp", "snippet", "rank"}],
+             "next_cursor": cursor for neste side eller None}
+
+        Raises:
+            ValueError: Ved ugyldig cursor
+        """
+        match = self._fts_query(query)
+        if not match:
+            return {"results": [], "next_cursor": None}
+
+        conditions = "conversations_fts MATCH ?"
+        params: List[Any] = [match]
+        if user_id:
+            conditions += " AND c.user_id = ?"
+            params.append(user_id)
+        if cursor:
+            try:
+                rank, _, message_id = cursor.partition("|")
+                rank, message_id = float(rank), int(message_id)
+            except ValueError:
+                raise ValueError(f"Ugyldig cursor: {cursor}")
+            conditions += " AND (f.rank > ? OR (f.rank = ? AND c.id > ?))"
+            params += [rank, rank, message_id]
+
+        with self.pool.reader() as conn:
+            rows = conn.execute(f"""
+                SELECT c.id, c.session_id, c.user_id, s.title, c.role, c.timestamp,
+                       snippet(conversations_fts, 0, '<mark>', '</mark>', '…', 16),
+                       f.rank
+                FROM conversations_fts f
+                JOIN conversations c ON c.id = f.rowid
+                LEFT JOIN sessions s ON s.session_id = c.session_id
+                WHERE {conditions}
+                ORDER BY f.rank, c.id
+                LIMIT ?
+            """, (*params, limit + 1)).fetchall()
+
+        results = [
+            {"id": message_id, "session_id": session_id, "user_id": row_user_id,
+             "title": title or "Uten tittel", "role": role, "timestamp": timestamp,
+             "snippet": snippet, "rank": rank}
+            for message_id, session_id, row_user_id, title, role, timestamp, snippet, rank in rows[:limit]
+        ]
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = results[-1]
+            # repr gir nok siffer til at rangen leses tilbake eksakt
+            next_cursor = f"{last['rank']!r}|{last['id']}"
+        return {"results": results, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _fts_query(query: str) -> str:
+        """Gjør brukerens søketekst om til en FTS5-spørring med hvert ord som egen frase."""
+        terms = re.findall(r"\w+\*?", query)
+        return " ".join(
+            f'"{term[:-1]}"*' if term.endswith("*") else f'"{term}"'
+            for term in terms
+        )
+
+    def backfill_search_index_batch(self, after_id: int = 0, batch_size: int = 2000) -> Dict[str, Any]:
+        """
+        Indekser neste batch meldinger med id > after_id som mangler i søkeindeksen.
+
+        Args:
+            after_id: last_id fra forrige batch (0 for å starte)
+            batch_size: Antall meldinger som gås gjennom per transaksjon
+
+        Returns:
+            {"indexed": nye rader i indeksen, "last_id": siste id i batchen,
+             "done": True når alle meldinger er gått gjennom}
+        """
+        with self.pool.writer() as conn:
+            rows = conn.execute(
+                "SELECT id FROM conversations WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, batch_size)
+            ).fetchall()
+            if not rows:
+                self.search_backfill_pending = False
+                return {"indexed": 0, "last_id": after_id, "done": True}
+
+            last_id = rows[-1][0]
+            indexed = conn.execute("""
+                INSERT INTO conversations_fts(rowid, content)
+                SELECT c.id, c.content FROM conversations c
+                WHERE c.id > ? AND c.id <= ?
+                  AND NOT EXISTS (SELECT 1 FROM conversations_fts_docsize d WHERE d.id = c.id)
+            """, (after_id, last_id)).rowcount
+
+        return {"indexed": indexed, "last_id": last_id, "done": False}
+
+    def backfill_search_index(self, batch_size: int = 2000) -> int:
+        """
+        Indekser alle eksisterende meldinger som mangler i søkeindeksen.
+
+        Kjøres i batcher med én kort transaksjon hver og kan trygt kjøres flere
+        ganger (meldinger som allerede er indeksert hoppes over).
+
+        Returns:
+            Antall meldinger som ble lagt til i indeksen
+        """
+        total = 0
+        after_id = 0
+        while True:
+            result = self.backfill_search_index_batch(after_id, batch_size)
+            if result["done"]:
+                break
+            total += result["indexed"]
+            after_id = result["last_id"]
+        logger.info(f"Søkeindeks: {total} meldinger indeksert")
+        return total
+
     def delete_old_conversations(self, days_old: int = 30, 
-                               user_id: Optional[str] = None):
+                               user_id: Optional[str] = None,
+                               batch_size: int = 500) -> Dict[str, int]:
         """
         Slett gamle samtaler for å spare plass.
+
+        Sletter i batcher med én kort transaksjon hver (se delete_expired_batch),
+        slik at andre skrivinger slipper til mellom batchene. Agenten bruker
+        RetentionTask (retention.py) som gjør det samme i bakgrunnen med pauser.
         
         Args:
             days_old: Antall dager gamle samtaler som skal slettes
             user_id: Spesifikk bruker ID, eller None for alle brukere
+            batch_size: Maksimalt antall rader per transaksjon
+
+        Returns:
+            {"messages": slettede meldinger, "sessions": slettede sesjoner}
         """
-        cutoff_date = datetime.now() - timedelta(days=days_old)
-        
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        cutoff = self.retention_cutoff(days_old)
+        totals = {"messages": 0, "sessions": 0}
+        while True:
+            result = self.delete_expired_batch(cutoff, batch_size, user_id)
+            totals["messages"] += result["messages"]
+            totals["sessions"] += result["sessions"]
+            if not result["more"]:
+                break
             
-            if user_id:
-                cursor.execute("""
-                    DELETE FROM conversations 
-                    WHERE user_id = ? AND timestamp < ?
-                """, (user_id, cutoff_date))
-                
-                cursor.execute("""
-                    DELETE FROM sessions 
-                    WHERE user_id = ? AND last_activity < ?
-                """, (user_id, cutoff_date))
-            else:
-                cursor.execute("""
-                    DELETE FROM conversations 
-                    WHERE timestamp < ?
-                """, (cutoff_date,))
-                
-                cursor.execute("""
-                    DELETE FROM sessions 
-                    WHERE last_activity < ?
-                """, (cutoff_date,))
-            
-            deleted_conversations = cursor.rowcount
-            conn.commit()
-            
-            logger.info(f"Slettet {deleted_conversations} gamle samtaler eldre enn {days_old} dager")
+        logger.info(f"Slettet {totals['messages']} meldinger og {totals['sessions']} sesjoner "
+                    f"eldre enn {days_old} dager")
+        return totals
+
+    @staticmethod
+    def retention_cutoff(days_old: float) -> str:
+        """Tidsgrense i samme format og tidssone (UTC) som timestamp/last_activity."""
+        return (datetime.utcnow() - timedelta(days=days_old)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def delete_expired_batch(self, cutoff: str, batch_size: int = 500,
+                             user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Slett opptil batch_size meldinger og batch_size sesjoner eldre enn cutoff
+        i én transaksjon.
+
+        message_count for sesjoner som beholdes justeres for meldingene som slettes.
+
+        Args:
+            cutoff: Tidsgrense ("YYYY-MM-DD HH:MM:SS" UTC)
+            batch_size: Maksimalt antall rader av hver type
+            user_id: Spesifikk bruker ID, eller None for alle brukere
+
+        Returns:
+            {"messages": antall, "sessions": antall,
+             "session_ids": sesjoner som er slettet eller har mistet meldinger,
+             "more": True hvis det kan finnes flere utløpte rader}
+        """
+        user_filter = " AND user_id = ?" if user_id else ""
+        user_params = (user_id,) if user_id else ()
+        message_rows: List[tuple] = []
+        session_rows: List[tuple] = []
+
+        def invalidate():
+            self.hot.invalidate([session_id for _, session_id in message_rows] +
+                                [session_id for session_id, in session_rows])
+
+        with self.pool.writer(on_commit=invalidate if self.hot else None) as conn:
+            cursor = conn.cursor()
+
+            # Meldinger: velg id-er via timestamp-indeksen, slett dem og juster tellerne
+            cursor.execute(f"""
+                SELECT id, session_id FROM conversations
+                WHERE timestamp < ?{user_filter}
+                ORDER BY timestamp
+                LIMIT ?
+            """, (cutoff, *user_params, batch_size))
+            message_rows.extend(cursor.fetchall())
+            if message_rows:
+                cursor.executemany("DELETE FROM conversations WHERE id = ?",
+                                   [(message_id,) for message_id, _ in message_rows])
+                per_session: Dict[str, int] = {}
+                for _, session_id in message_rows:
+                    per_session[session_id] = per_session.get(session_id, 0) + 1
+                cursor.executemany("""
+                    UPDATE sessions
+                    SET message_count = MAX(message_count - ?, 0)
+                    WHERE session_id = ?
+                """, [(count, session_id) for session_id, count in per_session.items()])
+
+            # Sesjoner uten aktivitet siden cutoff
+            cursor.execute(f"""
+                SELECT session_id FROM sessions
+                WHERE last_activity < ?{user_filter}
+                LIMIT ?
+            """, (cutoff, *user_params, batch_size))
+            session_rows.extend(cursor.fetchall())
+            if session_rows:
+                cursor.executemany("DELETE FROM sessions WHERE session_id = ?", session_rows)
+
+        return {
+            "messages": len(message_rows),
+            "sessions": len(session_rows),
+            "session_ids": sorted({session_id for _, session_id in message_rows} |
+                                  {session_id for session_id, in session_rows}),
+            "more": len(message_rows) == batch_size or len(session_rows) == batch_size
+        }
+
+    def archive_expired_batch(self, archive: ConversationArchive, cutoff: str,
+                              batch_size: int = 500,
+                              skip: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """
+        Flytt opptil batch_size meldinger fra sesjoner uten aktivitet siden cutoff til arkivet.
+
+        Sesjonene tas med eldste først til batchen har batch_size meldinger. En sesjon
+        med flere meldinger enn det er plass til flyttes over flere batcher (eldste
+        meldinger først) og slettes sammen med sine siste meldinger. Sesjoner uten
+        meldinger slettes bare. Meldingene skrives til månedssegmenter før de slettes
+        fra databasen i én transaksjon (se archive.py).
+
+        Sesjoner som endres underveis (ny aktivitet, meldinger lagt til eller slettet
+        av andre) hoppes over: batchen skrives på nytt uten dem, og de returneres i
+        "skipped" så kalleren kan utelate dem fra resten av kjøringen.
+
+        Args:
+            archive: Arkivet meldingene flyttes til
+            cutoff: Tidsgrense ("YYYY-MM-DD HH:MM:SS" UTC) for sessions.last_activity
+            batch_size: Maksimalt antall meldinger (og sesjoner) i batchen
+            skip: Sesjoner som ikke skal arkiveres
+
+        Returns:
+            {"messages": antall, "sessions": slettede sesjoner, "segments": segmentnavn,
+             "session_ids": sesjoner som er slettet eller har mistet meldinger,
+             "skipped": sesjoner som ble endret underveis,
+             "more": True hvis det kan finnes flere}
+        """
+        skip = set(skip or ())
+        skipped: List[str] = []
+        with archive.locked():
+            archive.recover(self._committed_segments)
+            while True:
+                try:
+                    result = self._archive_batch(archive, cutoff, batch_size, skip)
+                except ArchiveConflict as e:
+                    logger.info(f"Arkivering hopper over {len(e.session_ids)} sesjoner: {e}")
+                    skip.update(e.session_ids)
+                    skipped += e.session_ids
+                    continue
+                result["skipped"] = skipped
+                return result
+
+    def _archive_batch(self, archive: ConversationArchive, cutoff: str, batch_size: int,
+                       skip: Set[str]) -> Dict[str, Any]:
+        """
+        Én arkiveringsbatch (under archive.locked()).
+
+        Raises:
+            ArchiveConflict: Med session_ids for sesjoner som ble endret underveis
+                (ingenting er slettet, og segmentene er forkastet)
+        """
+        with self.pool.reader() as conn:
+            # Sesjoner og meldinger fra samme øyeblikksbilde
+            conn.execute("BEGIN")
+            candidates = conn.execute("""
+                SELECT session_id, title FROM sessions
+                WHERE last_activity < ?
+                ORDER BY last_activity
+                LIMIT ?
+            """, (cutoff, batch_size + len(skip))).fetchall()
+            sessions = [session for session in candidates if session[0] not in skip][:batch_size]
+            more = len(candidates) == batch_size + len(skip)
+
+            rows = []
+            # Sesjoner der alle meldingene er med (slettes), og sesjonen som fikk bare
+            # de eldste meldingene sine med (beholdes til neste batch)
+            complete: List[str] = []
+            partial: List[str] = []
+            for session_id, _ in sessions:
+                room = batch_size - len(rows)
+                if room == 0:
+                    more = True
+                    break
+                session_rows = conn.execute("""
+                    SELECT c.session_id, c.user_id, c.id, c.role, c.content, c.tool_calls,
+                           c.metadata, c.timestamp, p.tool_calls, p.tool_results
+                    FROM conversations c
+                    LEFT JOIN message_payloads p ON p.message_id = c.id
+                    WHERE c.session_id = ?
+                    ORDER BY c.id
+                    LIMIT ?
+                """, (session_id, room + 1)).fetchall()
+                if len(session_rows) > room:
+                    rows += session_rows[:room]
+                    partial.append(session_id)
+                    more = True
+                    break
+                rows += session_rows
+                complete.append(session_id)
+
+        if not complete and not partial:
+            return {"messages": 0, "sessions": 0, "segments": [], "session_ids": [], "more": False}
+
+        titles = dict(sessions)
+        records = []
+        ids: Dict[str, List[int]] = {}
+        for row in rows:
+            message = self._decode_message(row[2:])
+            ids.setdefault(row[0], []).append(message["id"])
+            records.append({
+                "id": message["id"],
+                "session_id": row[0],
+                "user_id": row[1],
+                "title": titles[row[0]],
+                "role": message["role"],
+                "content": message["content"],
+                "tool_calls": message.get("tool_calls"),
+                "metadata": message.get("metadata"),
+                "timestamp": message["timestamp"]
+            })
+        segments = archive.write(records) if records else []
+        session_ids = complete + partial
+
+        def invalidate():
+            self.hot.invalidate(session_ids)
+
+        try:
+            with self.pool.writer(on_commit=invalidate if self.hot else None) as conn:
+                cursor = conn.cursor()
+                conflicts = []
+                for session_id in session_ids:
+                    message_ids = ids.get(session_id, [])
+                    if message_ids:
+                        cursor.executemany("DELETE FROM conversations WHERE id = ?",
+                                           [(message_id,) for message_id in message_ids])
+                        if cursor.rowcount != len(message_ids):
+                            conflicts.append(session_id)
+                            continue
+                    if session_id in partial:
+                        cursor.execute("""
+                            UPDATE sessions SET message_count = MAX(0, message_count - ?)
+                            WHERE session_id = ? AND last_activity < ?
+                        """, (len(message_ids), session_id, cutoff))
+                    else:
+                        cursor.execute("DELETE FROM sessions WHERE session_id = ? AND last_activity < ?",
+                                       (session_id, cutoff))
+                    if cursor.rowcount != 1:
+                        # Ble aktiv eller slettet under arkiveringen
+                        conflicts.append(session_id)
+                        continue
+                    # Nye meldinger etter øyeblikksbildet ville ellers blitt liggende uten sesjon
+                    if session_id in complete and cursor.execute(
+                        "SELECT 1 FROM conversations WHERE session_id = ? LIMIT 1", (session_id,)
+                    ).fetchone():
+                        conflicts.append(session_id)
+                if conflicts:
+                    raise ArchiveConflict("Sesjoner ble endret under arkiveringen", conflicts)
+                cursor.executemany("""
+                    INSERT INTO archive_segments (name, month, messages, sessions, min_id, max_id)
+                    VALUES (:name, :month, :messages, :sessions, :min_id, :max_id)
+                """, segments)
+        except BaseException:
+            archive.discard([segment["name"] for segment in segments])
+            raise
+        archive.publish([segment["name"] for segment in segments])
+
+        return {
+            "messages": len(records),
+            "sessions": len(complete),
+            "segments": [segment["name"] for segment in segments],
+            "session_ids": session_ids,
+            "more": more
+        }
+
+    def archive_old_conversations(self, archive: ConversationArchive, days_old: float = 30,
+                                  batch_size: int = 500) -> Dict[str, int]:
+        """
+        Flytt alle sesjoner uten aktivitet de siste days_old dagene til arkivet, i batcher.
+
+        Returns:
+            {"messages": antall, "sessions": antall, "segments": antall,
+             "skipped": sesjoner som ble endret underveis og står igjen}
+        """
+        cutoff = self.retention_cutoff(days_old)
+        totals = {"messages": 0, "sessions": 0, "segments": 0, "skipped": 0}
+        skip: Set[str] = set()
+        while True:
+            result = self.archive_expired_batch(archive, cutoff, batch_size, skip)
+            totals["messages"] += result["messages"]
+            totals["sessions"] += result["sessions"]
+            totals["segments"] += len(result["segments"])
+            skip.update(result["skipped"])
+            if not result["more"]:
+                break
+        totals["skipped"] = len(skip)
+        logger.info(f"Arkiverte {totals['messages']} meldinger fra {totals['sessions']} sesjoner "
+                    f"i {totals['segments']} segmenter")
+        return totals
+
+    def _committed_segments(self, names: List[str]) -> set:
+        """Navnene (av de gitte) som er registrert i archive_segments."""
+        with self.pool.reader() as conn:
+            return {
+                name for name in names
+                if conn.execute("SELECT 1 FROM archive_segments WHERE name = ?", (name,)).fetchone()
+            }
+
+    def incremental_vacuum(self, pages: int = 256) -> Dict[str, int]:
+        """
+        Frigi opptil pages ledige sider tilbake til filsystemet (auto_vacuum=INCREMENTAL).
+
+        Returns:
+            {"freed_pages": frigitte sider, "free_pages": ledige sider igjen}
+        """
+        with self.pool.writer() as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() steg pragmaen bare én gang (én side); executescript kjører den ferdig
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {"freed_pages": before - after, "free_pages": after}
     
-    def get_database_stats(self) -> Dict[str, Any]:
+    def get_database_stats(self, days: int = 30, top_sessions: int = 10) -> Dict[str, Any]:
         """
         Hent statistikk om databasen.
-        
+
+        Leser tellertabellene (se _init_stats), så kostnaden avhenger ikke av
+        hvor mange meldinger databasen inneholder.
+
+        Args:
+            days: Antall dager med meldingsvolum (siste først)
+            top_sessions: Antall største sesjoner
+
         Returns:
             Dictionary med database statistikk
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.reader() as conn:
             cursor = conn.cursor()
             
-            # Antall samtaler
-            cursor.execute("SELECT COUNT(*) FROM conversations")
-            total_messages = cursor.fetchone()[0]
-            
-            # Antall sesjoner
-            cursor.execute("SELECT COUNT(*) FROM sessions")
-            total_sessions = cursor.fetchone()[0]
-            
-            # Antall unike brukere
-            cursor.execute("SELECT COUNT(DISTINCT user_id) FROM sessions")
-            unique_users = cursor.fetchone()[0]
-            
-            # Database størrelse
-            db_size = Path(self.db_path).stat().st_size / (1024 * 1024)  # MB
+            counters = dict(cursor.execute("SELECT name, value FROM stats_counters").fetchall())
+            by_role = dict(cursor.execute(
+                "SELECT role, messages FROM stats_roles ORDER BY messages DESC"
+            ).fetchall())
+            per_day = dict(cursor.execute(
+                "SELECT day, messages FROM stats_daily ORDER BY day DESC LIMIT ?", (days,)
+            ).fetchall())
+            cursor.execute("""
+                SELECT session_id, user_id, title, message_count
+                FROM sessions
+                ORDER BY message_count DESC
+                LIMIT ?
+            """, (top_sessions,))
+            largest_sessions = [
+                {"session_id": session_id, "user_id": user_id,
+                 "title": title or "Uten tittel", "message_count": message_count}
+                for session_id, user_id, title, message_count in cursor.fetchall()
+            ]
+            archived = cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(messages), 0) FROM archive_segments"
+            ).fetchone()
             
-            return {
-                "total_messages": total_messages,
-                "total_sessions": total_sessions,
-                "unique_users": unique_users,
-                "database_size_mb": round(db_size, 2),
-                "database_path": self.db_path
-            }
+        # Database størrelse (WAL-filen inneholder commits som ikke er checkpointet ennå)
+        db_size = Path(self.db_path).stat().st_size / (1024 * 1024)  # MB
+        wal_path = Path(f"{self.db_path}-wal")
+        wal_size = wal_path.stat().st_size / (1024 * 1024) if wal_path.exists() else 0.0
+        
+        return {
+            "total_messages": counters.get("messages", 0),
+            "total_sessions": counters.get("sessions", 0),
+            "unique_users": counters.get("users", 0),
+            "messages_by_role": by_role,
+            "messages_per_day": per_day,
+            "largest_sessions": largest_sessions,
+            "database_size_mb": round(db_size, 2),
+            "wal_size_mb": round(wal_size, 2),
+            "database_path": self.db_path,
+            "search_backfill_pending": self.search_backfill_pending,
+            "archived": {"segments": archived[0], "messages": archived[1]},
+            "compact": self.compact,
+            "compact_storage": self.compact_storage.get_stats(),
+            "hot_tier": self.hot.get_stats() if self.hot else None,
+            "connections": self.pool.get_stats()
+        }
+
+    def close(self):
+        """Lukk databasetilkoblingene."""
+        self.pool.close()
@@ -0,0 +1,225 @@
+"""
+Templated Fast Path for Simple Weather Lookups
+
+For rene "hva er været i X" spørsmål gjør det andre LLM-kallet bare om
+get_weather_forecast resultatet til en setning. Det dobler ventetid og kostnad.
+
+Med FAST_PATH_ENABLED=true hoppes det andre kallet over når:
+
+  1. Det første kallet ba om nøyaktig ett tool-kall, og det er get_weather_forecast
+  2. SimpleIntentClassifier kjenner igjen spørsmålet som et enkelt værspørsmål
+     (norsk eller engelsk, uten ekstra ønsker som pakkeliste eller sammenligning)
+  3. Tool-resultatet har structuredContent med current-feltene malen trenger
+
+Da lager WeatherTemplateRenderer svaret lokalt på spørsmålets språk
+(værbeskrivelsene kommer fra OpenWeather med lang=no og brukes uendret).
+Alt annet går som før via LLM. Hvor ofte fast path brukes, og hvorfor den ikke ble brukt,
+rapporteres via get_stats().
+"""
+
+import json
+import logging
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Enkle værspørsmål. Stedet kan være flere ord ("New York"), men spørsmålet skal
+# ikke inneholde noe mer enn været (og evt. "nå", "i dag", "denne uken").
+_PLACE = r"(?P<place>[\wæøåÆØÅ .'-]{2,40}?)"
+_WHEN_NO = r"(?:\s+(?:nå|i dag|akkurat nå|for tiden|de neste dagene|denne uken|i helgen))?"
+_WHEN_EN = r"(?:\s+(?:now|right now|today|this week|this weekend|for the next few days))?"
+
+SIMPLE_PATTERNS = {
+    "no": [
+        rf"^(?:hei[,!]?\s+)?(?:hva|hvordan) er (?:været|værmeldingen|temperaturen|vêret) (?:i|på|for) {_PLACE}{_WHEN_NO}\s*\??$",
+        rf"^(?:været|værmelding(?:en)?|vær) (?:i|på|for) {_PLACE}{_WHEN_NO}\s*\??$",
+        rf"^(?:blir det|er det) (?:regn|sol|fint vær) (?:i|på) {_PLACE}{_WHEN_NO}\s*\??$",
+    ],
+    "en": [
+        rf"^(?:hi[,!]?\s+)?(?:what's|what is|how's|how is) the (?:weather|forecast|temperature)(?: like)? (?:in|for|at) {_PLACE}{_WHEN_EN}\s*\??$",
+        rf"^(?:weather|forecast) (?:in|for) {_PLACE}{_WHEN_EN}\s*\??$",
+    ]
+}
+
+# Ord som betyr at brukeren vil mer enn en værmelding
+COMPLEX_MARKERS = re.compile(
+    r"\b(og|eller|men|bør|pakke|anbefal\w*|sammenlign\w*|hvorfor|klær|aktivitet\w*|"
+    r"and|or|but|should|pack|recommend\w*|compare|why|wear|activit\w*)\b",
+    re.IGNORECASE
+)
+
+WEEKDAYS = {
+    "no": ["mandag", "tirsdag", "onsdag", "torsdag", "fredag", "lørdag", "søndag"],
+    "en": ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+}
+
+
+class SimpleIntentClassifier:
+    """Gjenkjenner enkle værspørsmål og språket de er stilt på."""
+
+    def __init__(self, patterns: Dict[str, List[str]] = None):
+        self._patterns = {
+            language: [re.compile(p, re.IGNORECASE) for p in language_patterns]
+            for language, language_patterns in (patterns or SIMPLE_PATTERNS).items()
+        }
+
+    def classify(self, query: str) -> Optional[Dict[str, str]]:
+        """
+        Klassifiser et spørsmål.
+
+        Returns:
+            {"language": "no"|"en", "place": sted} for enkle værspørsmål, ellers None
+        """
+        text = " ".join(query.strip().split())
+        for language, patterns in self._patterns.items():
+            for pattern in patterns:
+                match = pattern.match(text)
+                if match and not COMPLEX_MARKERS.search(match.group("place")):
+                    return {"language": language, "place": match.group("place").strip()}
+        return None
+
+
+def _weekday(value: str, language: str) -> str:
+    try:
+        return WEEKDAYS[language][date.fromisoformat(value).weekday()]
+    except (TypeError, ValueError):
+        return value
+
+
+def _forecast_rows(forecast: Any) -> List[Dict[str, Any]]:
+    """Prognosedager fra både vanlig liste og compact tabellformat (tool_encoding)."""
+    if isinstance(forecast, dict) and "columns" in forecast:
+        return [dict(zip(forecast["columns"], row)) for row in forecast.get("rows", [])]
+    return forecast if isinstance(forecast, list) else []
+
+
+class WeatherTemplateRenderer:
+    """Lager et kort svar fra get_weather_forecast structuredContent."""
+
+    def render(self, data: Dict[str, Any], language: str, max_days: int = 3) -> Optional[str]:
+        """
+        Formater svaret.
+
+        Returns:
+            Svartekst, eller None hvis dataene mangler felt malen trenger
+        """
+        current = data.get("current") or {}
+        name = (data.get("location") or {}).get("name")
+        if not name or current.get("temperature") is None or not current.get("description"):
+            return None
+
+        days = _forecast_rows(data.get("forecast"))[:max_days]
+        rainy = any("regn" in str(day.get("description", "")) or "rain" in str(day.get("description", ""))
+                    for day in days + [current])
+
+        if language == "en":
+            lines = [
+                f"Right now it's {current['temperature']}°C in {name} with {current['description']}"
+                + (f" (feels like {current['feels_like']}°C)" if current.get("feels_like") is not None else "")
+                + (f" and wind at {current['wind_speed']} m/s." if current.get("wind_speed") is not None else ".")
+            ]
+            if days:
+                lines.append("")
+                lines.append("The next few days:")
+                lines += [
+                    f"- {_weekday(day.get('date'), 'en')}: {day.get('temp_min')}–{day.get('temp_max')}°C, {day.get('description')}"
+                    for day in days
+                ]
+            lines.append("")
+            lines.append("Rain on the way - as a Bergen native I can only say: lovely! Bring a good jacket."
+                         if rainy else "Have a great trip, and let me know if you want the weather anywhere else!")
+            return "\n".join(lines)
+
+        lines = [
+            f"Akkurat nå er det {current['temperature']}°C i {name} med {current['description']}"
+            + (f" (føles som {current['feels_like']}°C)" if current.get("feels_like") is not None else "")
+            + (f" og vind på {current['wind_speed']} m/s." if current.get("wind_speed") is not None else ".")
+        ]
+        if days:
+            lines.append("")
+            lines.append("De neste dagene:")
+            lines += [
+                f"- {_weekday(day.get('date'), 'no').capitalize()}: {day.get('temp_min')}–{day.get('temp_max')}°C, {day.get('description')}"
+                for day in days
+            ]
+        lines.append("")
+        lines.append("Det blir regn - og som bergenser kan jeg bare si: herlig! Husk en god regnjakke."
+                     if rainy else "God tur, og si ifra hvis du vil vite været et annet sted!")
+        return "\n".join(lines)
+
+
+class FastPath:
+    """Avgjør om det andre LLM-kallet kan erstattes av en mal, og teller utfallet."""
+
+    def __init__(self, tool_name: str = "get_weather_forecast",
+                 classifier: Optional[SimpleIntentClassifier] = None,
+                 renderer: Optional[WeatherTemplateRenderer] = None):
+        """
+        Initialiser fast path.
+
+        Args:
+            tool_name: Toolet malen kan formatere resultatet fra
+            classifier: Klassifiserer for enkle spørsmål
+            renderer: Malen som lager svaret
+        """
+        self.tool_name = tool_name
+        self.classifier = classifier or SimpleIntentClassifier()
+        self.renderer = renderer or WeatherTemplateRenderer()
+
+        self.taken = 0
+        self.skipped: Dict[str, int] = {"tool_calls": 0, "not_simple": 0, "tool_error": 0, "render_failed": 0}
+
+    def answer(self, query: str, tool_calls: List[Dict[str, Any]],
+               tool_results: List[str]) -> Optional[str]:
+        """
+        Lag et malbasert svar hvis fast path kan brukes.
+
+        Args:
+            query: Brukerens spørsmål
+            tool_calls: Tool-kall fra det første LLM-kallet
+            tool_results: Resultatene fra call_mcp_tool (JSON), samme rekkefølge
+
+        Returns:
+            Ferdig svar, eller None hvis det andre LLM-kallet må gjøres
+        """
+        if len(tool_calls) != 1 or tool_calls[0]["function"]["name"] != self.tool_name:
+            return self._skip("tool_calls")
+
+        intent = self.classifier.classify(query)
+        if intent is None:
+            return self._skip("not_simple")
+
+        try:
+            data = json.loads(tool_results[0])
+        except (TypeError, ValueError):
+            return self._skip("render_failed")
+        if not isinstance(data, dict) or "error" in data:
+            return self._skip("tool_error")
+
+        rendered = self.renderer.render(data, intent["language"])
+        if rendered is None:
+            return self._skip("render_failed")
+
+        self.taken += 1
+        logger.info(f"Fast path: malbasert svar ({intent['language']}) uten andre LLM-kall")
+        return rendered
+
+    def _skip(self, reason: str) -> None:
+        self.skipped[reason] += 1
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for fast path.
+
+        Returns:
+            Dictionary med antall ganger fast path ble brukt, grunner til at den ikke ble det, og andel
+        """
+        considered = self.taken + sum(self.skipped.values())
+        return {
+            "taken": self.taken,
+            "skipped": dict(self.skipped),
+            "rate": round(self.taken / considered, 3) if considered else 0.0
+        }
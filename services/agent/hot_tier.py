@@ -0,0 +1,237 @@
+"""
+Hot Tier for Active Sessions in ConversationMemory
+
+De fleste lesingene treffer noen hundre aktive sesjoner, men hvert kall til
+get_conversation_history og get_recent_context gikk til SQLite og JSON-dekodet
+(eller dekomprimerte) radene på nytt.
+
+HotTier holder per sesjon i minnet:
+
+  - halen: de siste tail_size meldingene, ferdig dekodet (samme dicts som fra disk)
+  - sesjonsmetadata: user_id, message_count og siste meldings-id, brukt til å
+    oppdage endringer gjort av andre prosesser
+
+Skrivinger i ConversationMemory oppdaterer halen direkte (write-through).
+Sesjoner som ikke er i minnet (kalde) leses fra disk og legges inn. Minnet er
+en LRU med et tak på anslått minnebruk.
+
+Flere agent-replikaer deler samme databasefil. Med validate=True (standard)
+sammenlignes message_count og siste id med databasen i ett indeksoppslag før
+halen brukes, så meldinger skrevet av en annen replika aldri mangler. Det er
+fortsatt mye billigere enn å lese og dekode halen.
+
+Lesing fra disk og skriving kan skje samtidig på ulike tråder. Får en sesjon
+nye meldinger mens den lastes (begin_load ... load), kan øyeblikksbildet mangle
+dem, og sesjonen legges da ikke inn denne gangen.
+"""
+
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Anslått fast overhead per melding (dicts, strenger) i tillegg til de lagrede feltene
+MESSAGE_OVERHEAD_BYTES = 300
+
+
+class HotTier:
+    """LRU med dekodede sesjonshaler og sesjonsmetadata, med tak på minnebruk."""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, tail_size: int = 50):
+        """
+        Initialiser hot tier.
+
+        Args:
+            max_bytes: Tak på anslått minnebruk for alle sesjoner
+            tail_size: Antall siste meldinger som holdes per sesjon
+        """
+        self.max_bytes = max_bytes
+        self.tail_size = tail_size
+
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Sesjoner som lastes fra disk nå (antall samtidige lastinger), og de som
+        # har fått nye meldinger underveis
+        self._loading: Dict[str, int] = {}
+        self._stale: Set[str] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def get(self, session_id: str, user_id: str, limit: int) -> Optional[Dict[str, Any]]:
+        """
+        Hent de siste limit meldingene fra minnet.
+
+        Returns:
+            {"messages": [...] (kopier), "has_more": bool, "last_id", "message_count"},
+            eller None hvis sesjonen ikke er i minnet eller halen er for kort
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry["user_id"] != user_id \
+                    or (limit > len(entry["messages"]) and not entry["complete"]):
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            messages = [dict(message) for message, _ in list(entry["messages"])[-limit:]] if limit > 0 else []
+            return {
+                "messages": messages,
+                "has_more": len(entry["messages"]) > limit or not entry["complete"],
+                "last_id": entry["last_id"],
+                "message_count": entry["message_count"]
+            }
+
+    def hit(self):
+        """Tell et treff (etter at get() er validert mot databasen)."""
+        with self._lock:
+            self.hits += 1
+
+    def stale(self, session_id: str):
+        """Sesjonen er endret av en annen prosess: fjern den og tell som miss."""
+        with self._lock:
+            self.stale_hits += 1
+            self.misses += 1
+            self._drop(session_id)
+
+    def begin_load(self, session_id: str):
+        """Marker at sesjonen lastes fra disk (kalles før lesingen starter)."""
+        with self._lock:
+            self._loading[session_id] = self._loading.get(session_id, 0) + 1
+
+    def cancel_load(self, session_id: str):
+        """Avslutt en lasting som feilet."""
+        with self._lock:
+            self._finish_load(session_id)
+
+    def load(self, session_id: str, user_id: str, messages: List[Tuple[Dict[str, Any], int]],
+             complete: bool, message_count: Optional[int]):
+        """
+        Legg inn en sesjon lest fra disk (etter begin_load).
+
+        Args:
+            session_id: Sesjon ID
+            user_id: Bruker ID
+            messages: (melding, lagret størrelse i bytes), eldste først, maksimalt tail_size
+            complete: True hvis messages er hele sesjonen
+            message_count: sessions.message_count (None hvis sesjonsraden mangler)
+        """
+        with self._lock:
+            if self._finish_load(session_id):
+                return
+            self._drop(session_id)
+            entry = {
+                "user_id": user_id,
+                "messages": deque(),
+                "bytes": 0,
+                "complete": complete,
+                "last_id": None,
+                "message_count": message_count
+            }
+            self._sessions[session_id] = entry
+            self._add(entry, messages)
+            self._evict()
+
+    def _finish_load(self, session_id: str) -> bool:
+        """Returnerer True hvis sesjonen fikk nye meldinger under lastingen."""
+        stale = session_id in self._stale
+        remaining = self._loading.get(session_id, 1) - 1
+        if remaining > 0:
+            self._loading[session_id] = remaining
+        else:
+            self._loading.pop(session_id, None)
+            self._stale.discard(session_id)
+        return stale
+
+    def append(self, session_id: str, user_id: str, messages: List[Tuple[Dict[str, Any], int]],
+               counted: bool):
+        """
+        Legg skrevne meldinger til en sesjon i minnet (write-through, etter commit).
+
+        Sesjoner som ikke er i minnet hoppes over; de leses fra disk ved neste oppslag.
+
+        Args:
+            session_id: Sesjon ID
+            user_id: Bruker ID
+            messages: (melding med id, lagret størrelse i bytes), eldste først
+            counted: True hvis sessions.message_count ble økt for meldingene
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry["user_id"] != user_id:
+                if session_id in self._loading:
+                    self._stale.add(session_id)
+                if entry is not None:
+                    self._drop(session_id)
+                return
+            if counted and entry["message_count"] is not None:
+                entry["message_count"] += len(messages)
+            self._sessions.move_to_end(session_id)
+            # Meldinger som allerede var med da sesjonen ble lastet, legges ikke inn på nytt
+            last_id = entry["last_id"] or 0
+            self._add(entry, [(message, size) for message, size in messages if message["id"] > last_id])
+            self._evict()
+
+    def invalidate(self, session_ids: Optional[List[str]] = None):
+        """Fjern sesjonene (f.eks. etter sletting), eller alle sesjoner, fra minnet."""
+        with self._lock:
+            if session_ids is None:
+                self._sessions.clear()
+                self._bytes = 0
+                self._stale.update(self._loading)
+                return
+            for session_id in session_ids:
+                self._drop(session_id)
+                if session_id in self._loading:
+                    self._stale.add(session_id)
+
+    def _add(self, entry: Dict[str, Any], messages: List[Tuple[Dict[str, Any], int]]):
+        for message, stored_bytes in messages:
+            size = MESSAGE_OVERHEAD_BYTES + stored_bytes
+            entry["messages"].append((message, size))
+            entry["bytes"] += size
+            self._bytes += size
+            entry["last_id"] = message["id"]
+        while len(entry["messages"]) > self.tail_size:
+            _, size = entry["messages"].popleft()
+            entry["bytes"] -= size
+            self._bytes -= size
+            entry["complete"] = False
+
+    def _drop(self, session_id: str):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry["bytes"]
+
+    def _evict(self):
+        # Den nyeste sesjonen beholdes alltid, selv om den alene er over taket
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            session_id, entry = self._sessions.popitem(last=False)
+            self._bytes -= entry["bytes"]
+            self.evictions += 1
+            logger.debug(f"Hot tier: kastet ut sesjon {session_id}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for hot tier.
+
+        Returns:
+            Dictionary med antall sesjoner, minnebruk, treff, bom og utkastinger
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "tail_size": self.tail_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions
+            }
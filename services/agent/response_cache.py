@@ -0,0 +1,258 @@
+"""
+Response Cache for Travel Weather Agent
+
+Cacher ferdige svar fra agenten slik at gjentatte spørsmål (f.eks. eksemplene
+fra /examples i web-tjenesten) ikke trenger to LLM-kall og et tool-kall.
+
+Nøkkel:
+-------
+  (normalisert spørsmål, kontekst, friskhetsvindu)
+
+  - Normalisert spørsmål: Unicode NFKC, casefold, sammenslått whitespace og
+    uten avsluttende tegnsetting ("Hva er været i  Oslo?" == "hva er været i oslo")
+  - Kontekst: tom for en sesjon uten historikk, ellers en hash av sesjonens id
+    og historikkmeldingene. Et svar laget med én sesjons historikk i prompten
+    (tidligere reiser, personlige detaljer) gis dermed aldri til andre sesjoner
+    eller brukere; bare svar på spørsmål uten historikk deles mellom sesjoner.
+  - Friskhetsvindu: int(tid / ttl). Værdata er bare ferske i en begrenset
+    periode, så et svar kan aldri leve lenger enn vinduet det ble laget i.
+
+Invalidering:
+-------------
+Hvert cachet svar husker hvilke tool-kall (navn + argumenter) det bygger på og
+et fingeravtrykk av tool-dataene. Når agenten senere henter de samme tool-dataene
+og fingeravtrykket er endret (f.eks. ny værmelding for Oslo), fjernes alle svar
+som bygger på dem.
+
+Bare "selvstendige" svar caches: alle streng-argumenter til tool-kallene må finnes
+i selve spørsmålet. Da er svaret bestemt av spørsmålet og ikke av samtalehistorikken.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Felter som endres ved hvert kall uten at dataene er nye
+VOLATILE_FIELDS = {"timestamp"}
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normaliser spørsmålstekst for cache-oppslag.
+
+    Args:
+        query: Brukerens spørsmål
+
+    Returns:
+        Normalisert tekst (casefold, sammenslått whitespace, uten avsluttende tegnsetting)
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.")
+
+
+def tool_key(tool_name: str, arguments: Dict[str, Any]) -> str:
+    """Kanonisk nøkkel for et tool-kall (navn + sorterte argumenter)."""
+    return f"{tool_name}:{json.dumps(arguments, sort_keys=True, ensure_ascii=False)}"
+
+
+def _strip_volatile(value: Any) -> Any:
+    """Fjern felter som endres ved hvert kall (f.eks. timestamp) rekursivt."""
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+def fingerprint(tool_result: str) -> str:
+    """
+    Fingeravtrykk av et tool-resultat uten flyktige felter.
+
+    Args:
+        tool_result: JSON streng returnert fra MCP tool
+
+    Returns:
+        SHA-1 hex digest
+    """
+    try:
+        data = _strip_volatile(json.loads(tool_result))
+        canonical = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    except (TypeError, ValueError):
+        canonical = tool_result
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU cache for ferdige agent-svar med friskhetsvindu og tool-basert invalidering."""
+
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = 256):
+        """
+        Initialiser response cache.
+
+        Args:
+            ttl_seconds: Friskhetsvindu for tool-data i sekunder
+            max_entries: Maksimalt antall cachede svar
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        # (normalisert spørsmål, kontekst, vindu) -> {"answer", "deps", "created"}
+        self._entries: "OrderedDict[Tuple[str, str, int], Dict[str, Any]]" = OrderedDict()
+        # tool nøkkel -> siste kjente fingeravtrykk, sist observert sist
+        self._fingerprints: "OrderedDict[str, str]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _window(self, now: Optional[float] = None) -> int:
+        return int((now if now is not None else time.time()) // self.ttl_seconds)
+
+    def make_key(self, query: str, session_id: str = "",
+                 history: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, str, int]:
+        """
+        Bygg cache-nøkkel fra spørsmål, samtalekontekst og gjeldende friskhetsvindu.
+
+        Args:
+            query: Brukerens spørsmål
+            session_id: Sesjonen spørsmålet stilles i
+            history: Historikkmeldingene ({"role", "content"}) som sendes til LLM
+        """
+        context = ""
+        if history:
+            digest = hashlib.sha1(session_id.encode("utf-8"))
+            for message in history:
+                digest.update(f"\x00{message['role']}\x00{message['content']}".encode("utf-8"))
+            context = digest.hexdigest()
+        return normalize_query(query), context, self._window()
+
+    def get(self, key: Tuple[str, str, int]) -> Optional[str]:
+        """
+        Slå opp et cachet svar.
+
+        Args:
+            key: Nøkkel fra make_key()
+
+        Returns:
+            Cachet svar, eller None ved miss
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry["answer"]
+
+    def put(self, key: Tuple[str, str, int], answer: str, tool_results: List[Dict[str, Any]]):
+        """
+        Lagre et svar dersom det er selvstendig og bygger på gyldige tool-data.
+
+        Args:
+            key: Nøkkel fra make_key()
+            answer: Ferdig svar fra agenten
+            tool_results: Liste med {"tool", "arguments", "result"} (fullt resultat)
+        """
+        if not tool_results:
+            # Svar uten tool-data er typisk samtaleavhengige - cache dem ikke
+            return
+
+        normalized_query = key[0]
+        deps = []
+        for item in tool_results:
+            try:
+                if "error" in json.loads(item["result"]):
+                    return
+            except (TypeError, ValueError):
+                return
+
+            for value in item["arguments"].values():
+                if isinstance(value, str) and normalize_query(value) not in normalized_query:
+                    # Argumentet kommer fra historikken, ikke fra spørsmålet
+                    return
+            deps.append(tool_key(item["tool"], item["arguments"]))
+
+        # Svar fra tidligere vinduer kan aldri treffes igjen
+        for old_key in [k for k in self._entries if k[2] < key[2]]:
+            del self._entries[old_key]
+
+        self._entries[key] = {"answer": answer, "deps": deps, "created": time.time()}
+        self._entries.move_to_end(key)
+        self.stores += 1
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def observe_tool_result(self, tool_name: str, arguments: Dict[str, Any], tool_result: str):
+        """
+        Registrer ferske tool-data og invalider svar som bygger på utdaterte data.
+
+        Args:
+            tool_name: Navn på tool
+            arguments: Argumenter til tool
+            tool_result: JSON streng returnert fra MCP tool
+        """
+        key = tool_key(tool_name, arguments)
+        new_fingerprint = fingerprint(tool_result)
+        old_fingerprint = self._fingerprints.get(key)
+        self._fingerprints[key] = new_fingerprint
+        self._fingerprints.move_to_end(key)
+        self._trim_fingerprints()
+
+        if old_fingerprint is None or old_fingerprint == new_fingerprint:
+            return
+
+        stale = [k for k, entry in self._entries.items() if key in entry["deps"]]
+        for k in stale:
+            del self._entries[k]
+        if stale:
+            self.invalidations += len(stale)
+            logger.info(f"Invaliderte {len(stale)} cachede svar for {key}")
+
+    def _trim_fingerprints(self):
+        """
+        Glem de eldste fingeravtrykkene ingen cachede svar bygger på.
+
+        Kjøres når det er dobbelt så mange fingeravtrykk som max_entries, og
+        trimmer ned til max_entries (pluss de som svar fortsatt bygger på).
+        """
+        if len(self._fingerprints) <= 2 * self.max_entries:
+            return
+        deps = {dep for entry in self._entries.values() for dep in entry["deps"]}
+        excess = len(self._fingerprints) - self.max_entries
+        for key in [k for k in self._fingerprints if k not in deps][:excess]:
+            del self._fingerprints[key]
+
+    def clear(self):
+        """Tøm cachen."""
+        self._entries.clear()
+        self._fingerprints.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for cachen.
+
+        Returns:
+            Dictionary med treff, bom og størrelse
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "fingerprints": len(self._fingerprints),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+            "ttl_seconds": self.ttl_seconds
+        }
@@ -0,0 +1,188 @@
+"""
+Background Retention for Conversation Memory
+
+delete_old_conversations slettet tidligere alle utløpte rader med én DELETE
+per tabell i én transaksjon. På en stor database holdt det skrivelåsen så
+lenge at alle agentens skrivinger sto stille, antallet som ble rapportert var
+bare sesjonene, og filen ble aldri mindre.
+
+RetentionTask kjører oppryddingen som en bakgrunnsoppgave i agenten:
+
+  - Hvert interval sekund slettes meldinger og sesjoner eldre enn days dager
+  - Slettingen skjer i batcher (delete_expired_batch) med én kort transaksjon
+    hver og en pause mellom batchene, så andre skrivinger slipper til
+  - Deretter gis ledige sider tilbake til filsystemet med incremental_vacuum
+    (auto_vacuum=INCREMENTAL), vacuum_pages sider om gangen med pause mellom
+  - on_deleted kalles med berørte sesjoner slik at minnebuffere kan invalideres
+
+Med et arkiv (archive.py) flyttes utløpte sesjoner dit i stedet for å slettes
+(archive_expired_batch). Da er det last_activity for sesjonen som teller, så
+gamle meldinger i sesjoner som fortsatt er aktive blir liggende. Sesjoner som
+endres mens de arkiveres hoppes over resten av kjøringen i stedet for at hele
+kjøringen feiler.
+
+Alle databasekall går via AsyncConversationMemory og blokkerer ikke event loop.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from archive import ConversationArchive
+from async_memory import AsyncConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionTask:
+    """Bakgrunnsoppgave som sletter gamle samtaler i batcher og krymper databasefilen."""
+
+    def __init__(self, db: AsyncConversationMemory,
+                 days: float = 30.0,
+                 interval: float = 3600.0,
+                 batch_size: int = 500,
+                 pause: float = 0.05,
+                 vacuum_pages: int = 256,
+                 on_deleted: Optional[Callable[[List[str]], None]] = None,
+                 archive: Optional[ConversationArchive] = None):
+        """
+        Initialiser retention.
+
+        Args:
+            db: Async databasefasade
+            days: Meldinger og sesjoner eldre enn dette antall dager slettes
+            interval: Sekunder mellom kjøringer
+            batch_size: Maksimalt antall rader per transaksjon
+            pause: Sekunder mellom batcher (og mellom vacuum-steg)
+            vacuum_pages: Sider som frigis per incremental_vacuum (0 slår av vacuum)
+            on_deleted: Kalles med session_id-er som er slettet eller har mistet meldinger
+            archive: Flytt utløpte sesjoner til dette arkivet i stedet for å slette dem
+        """
+        self.db = db
+        self.days = days
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.on_deleted = on_deleted
+        self.archive = archive
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.batches = 0
+        self.deleted_messages = 0
+        self.deleted_sessions = 0
+        self.archived_segments = 0
+        self.skipped_sessions = 0
+        self.freed_pages = 0
+        self.last_run: Optional[float] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """Start bakgrunnsoppgaven (returnerer umiddelbart)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def run_once(self) -> Dict[str, int]:
+        """
+        Kjør én full opprydding: batchvis sletting og deretter incremental vacuum.
+
+        Returns:
+            {"messages": slettede meldinger, "sessions": slettede sesjoner,
+             "batches": antall transaksjoner, "segments": arkivsegmenter,
+             "skipped": sesjoner arkiveringen hoppet over, "freed_pages": frigitte sider}
+        """
+        started = time.perf_counter()
+        cutoff = self.db.memory.retention_cutoff(self.days)
+        totals = {"messages": 0, "sessions": 0, "batches": 0, "segments": 0, "skipped": 0,
+                  "freed_pages": 0}
+        # Sesjoner som ble endret under arkiveringen; prøves igjen ved neste kjøring
+        skip: Set[str] = set()
+
+        while True:
+            if self.archive:
+                result = await self.db.archive_expired_batch(self.archive, cutoff, self.batch_size, skip)
+                totals["segments"] += len(result["segments"])
+                skip.update(result["skipped"])
+                totals["skipped"] = len(skip)
+            else:
+                result = await self.db.delete_expired_batch(cutoff, self.batch_size)
+            totals["batches"] += 1
+            totals["messages"] += result["messages"]
+            totals["sessions"] += result["sessions"]
+            if result["session_ids"] and self.on_deleted:
+                self.on_deleted(result["session_ids"])
+            if not result["more"]:
+                break
+            await asyncio.sleep(self.pause)
+
+        if self.vacuum_pages > 0 and (totals["messages"] or totals["sessions"]):
+            while True:
+                vacuum = await self.db.incremental_vacuum(self.vacuum_pages)
+                totals["freed_pages"] += vacuum["freed_pages"]
+                if vacuum["freed_pages"] == 0 or vacuum["free_pages"] == 0:
+                    break
+                await asyncio.sleep(self.pause)
+
+        self.runs += 1
+        self.batches += totals["batches"]
+        self.deleted_messages += totals["messages"]
+        self.deleted_sessions += totals["sessions"]
+        self.archived_segments += totals["segments"]
+        self.skipped_sessions += totals["skipped"]
+        self.freed_pages += totals["freed_pages"]
+        self.last_run = time.time()
+        self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        if totals["messages"] or totals["sessions"]:
+            action = f"arkiverte ({totals['segments']} segmenter)" if self.archive else "slettet"
+            logger.info(f"Retention: {action} {totals['messages']} meldinger og {totals['sessions']} sesjoner "
+                        f"eldre enn {self.days} dager i {totals['batches']} batcher, "
+                        f"frigjorde {totals['freed_pages']} sider ({self.last_duration_ms} ms)")
+        return totals
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"Retention feilet: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        """Stopp bakgrunnsoppgaven (en batch som kjører fullføres i databasetråden)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for retention.
+
+        Returns:
+            Dictionary med konfigurasjon, slettede og arkiverte rader, frigitte sider og siste kjøring
+        """
+        return {
+            "days": self.days,
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "runs": self.runs,
+            "batches": self.batches,
+            "deleted_messages": self.deleted_messages,
+            "deleted_sessions": self.deleted_sessions,
+            "archived_segments": self.archived_segments,
+            "skipped_sessions": self.skipped_sessions,
+            "archive": self.archive.get_stats() if self.archive else None,
+            "freed_pages": self.freed_pages,
+            "last_run": self.last_run,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,225 @@
+"""
+Speculative Tool Prefetch for Travel Weather Agent
+
+For de fleste værspørsmål bestemmer det første LLM-kallet bare at
+get_weather_forecast skal kalles for en by som står i spørsmålet. I spekulativ
+modus finner agenten sannsynlige steder lokalt og starter tool-kallet samtidig
+med det første LLM-kallet:
+
+  1. LocationExtractor finner et sted i spørsmålet (gazetteer) eller gjenbruker
+     et sted fra samtalen (tidligere tool-kall i sesjonen)
+  2. Speculator starter tool-kallet som en asyncio task
+  3. Ber modellen om samme tool med samme argumenter -> resultatet gjenbrukes (treff)
+     Ellers -> tasken avbrytes og resultatet forkastes (bom)
+
+Treffrate rapporteres via get_stats().
+"""
+
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Steder som ofte dukker opp i spørsmål til Ingrids Reisetjenester
+DEFAULT_GAZETTEER = [
+    # Norge
+    "Oslo", "Bergen", "Trondheim", "Stavanger", "Tromsø", "Kristiansand", "Drammen",
+    "Fredrikstad", "Sandnes", "Ålesund", "Bodø", "Haugesund", "Tønsberg", "Moss",
+    "Arendal", "Hamar", "Lillehammer", "Molde", "Narvik", "Harstad", "Alta",
+    "Kirkenes", "Hammerfest", "Gol", "Geilo", "Voss", "Flåm", "Geiranger",
+    "Lofoten", "Svolvær", "Longyearbyen", "Svalbard", "Røros", "Gardermoen",
+    # Norden og Europa
+    "København", "Copenhagen", "Stockholm", "Göteborg", "Gothenburg", "Helsinki",
+    "Reykjavik", "London", "Paris", "Berlin", "Roma", "Rome", "Madrid", "Barcelona",
+    "Lisboa", "Lisbon", "Amsterdam", "Praha", "Prague", "Wien", "Vienna", "Athen",
+    "Athens", "Dublin", "Edinburgh", "München", "Munich", "Zürich",
+    "Malaga", "Alicante", "Gran Canaria", "Tenerife", "Mallorca", "Kreta",
+    # Resten av verden
+    "New York", "Los Angeles", "San Francisco", "Chicago", "Miami", "Toronto",
+    "Tokyo", "Bangkok", "Singapore", "Sydney", "Dubai", "Cape Town",
+]
+
+
+def _fold(value: str) -> str:
+    return value.casefold().strip()
+
+
+class LocationExtractor:
+    """Billig lokal uthenting av sannsynlige steder fra et spørsmål."""
+
+    def __init__(self, gazetteer: Iterable[str] = DEFAULT_GAZETTEER):
+        """
+        Initialiser extractor.
+
+        Args:
+            gazetteer: Stedsnavn som kan gjenkjennes i spørsmål
+        """
+        # Lengste navn først slik at "New York" vinner over "York"
+        names = sorted(set(gazetteer), key=len, reverse=True)
+        self._names = {_fold(name): name for name in names}
+        self._pattern = re.compile(
+            r"(?<!\w)(" + "|".join(re.escape(_fold(name)) for name in names) + r")(?!\w)"
+        ) if names else None
+
+    def extract(self, query: str, recent_locations: List[str] = None) -> Optional[str]:
+        """
+        Finn mest sannsynlige sted i spørsmålet.
+
+        Args:
+            query: Brukerens spørsmål
+            recent_locations: Steder fra tidligere tool-kall i sesjonen, nyeste først
+
+        Returns:
+            Stedsnavn, eller None hvis ingen kandidat ble funnet
+        """
+        folded = _fold(query)
+
+        # Steder brukeren allerede har spurt om i sesjonen (også utenfor gazetteer)
+        for location in recent_locations or []:
+            if re.search(r"(?<!\w)" + re.escape(_fold(location)) + r"(?!\w)", folded):
+                return location
+
+        if self._pattern:
+            match = self._pattern.search(folded)
+            if match:
+                return self._names[match.group(1)]
+
+        return None
+
+
+class Speculation:
+    """Et pågående spekulativt tool-kall."""
+
+    def __init__(self, tool_name: str, arguments: Dict[str, Any], task: "asyncio.Task[str]"):
+        self.tool_name = tool_name
+        self.arguments = arguments
+        self.task = task
+        self.used = False
+
+    def matches(self, tool_name: str, arguments: Dict[str, Any]) -> bool:
+        """Sjekk om modellen ba om samme tool med samme argumenter."""
+        if tool_name != self.tool_name or set(arguments) != set(self.arguments):
+            return False
+        for key, value in arguments.items():
+            expected = self.arguments[key]
+            if isinstance(value, str) and isinstance(expected, str):
+                if _fold(value) != _fold(expected):
+                    return False
+            elif value != expected:
+                return False
+        return True
+
+
+class Speculator:
+    """Starter spekulative tool-kall og teller treff og bom."""
+
+    def __init__(self, tool_name: str = "get_weather_forecast",
+                 argument: str = "location",
+                 extractor: Optional[LocationExtractor] = None):
+        """
+        Initialiser speculator.
+
+        Args:
+            tool_name: Tool som kalles spekulativt
+            argument: Navn på stedsargumentet til toolet
+            extractor: Stedsextractor (standard: innebygd gazetteer)
+        """
+        self.tool_name = tool_name
+        self.argument = argument
+        self.extractor = extractor or LocationExtractor()
+
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def recent_locations(self, history: List[Dict[str, Any]]) -> List[str]:
+        """
+        Hent steder fra tidligere tool-kall i samtalehistorikken.
+
+        Args:
+            history: Meldinger fra ConversationMemory, eldste først
+
+        Returns:
+            Stedsnavn, nyeste først
+        """
+        locations = []
+        for msg in reversed(history):
+            for tool_call in msg.get("tool_calls") or []:
+                function = tool_call.get("function", {})
+                if function.get("name") != self.tool_name:
+                    continue
+                try:
+                    value = json.loads(function.get("arguments") or "{}").get(self.argument)
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(value, str) and value not in locations:
+                    locations.append(value)
+        return locations
+
+    def start(self, query: str, history: List[Dict[str, Any]],
+              call_tool: Callable[[str, Dict[str, Any]], Awaitable[str]]) -> Optional[Speculation]:
+        """
+        Start et spekulativt tool-kall hvis spørsmålet nevner et kjent sted.
+
+        Args:
+            query: Brukerens spørsmål
+            history: Samtalehistorikk for sesjonen
+            call_tool: Korutinefunksjon som utfører tool-kallet (tool_name, arguments)
+
+        Returns:
+            Speculation, eller None hvis ingen kandidat ble funnet
+        """
+        location = self.extractor.extract(query, self.recent_locations(history))
+        if location is None:
+            self.skipped += 1
+            return None
+
+        arguments = {self.argument: location}
+        task = asyncio.create_task(call_tool(self.tool_name, arguments))
+        self.started += 1
+        logger.info(f"Spekulativt tool-kall startet: {self.tool_name} {arguments}")
+        return Speculation(self.tool_name, arguments, task)
+
+    async def take(self, speculation: Optional[Speculation], tool_name: str,
+                   arguments: Dict[str, Any]) -> Optional[str]:
+        """
+        Hent resultatet fra et spekulativt kall hvis modellen ba om det samme.
+
+        Returns:
+            Tool-resultat ved treff, ellers None
+        """
+        if speculation is None or speculation.used or not speculation.matches(tool_name, arguments):
+            return None
+
+        speculation.used = True
+        self.hits += 1
+        return await speculation.task
+
+    def finish(self, speculation: Optional[Speculation]):
+        """Avslutt en spekulasjon; ubrukte resultater forkastes og telles som bom."""
+        if speculation is None or speculation.used:
+            return
+        speculation.task.cancel()
+        self.misses += 1
+        logger.info(f"Spekulativt tool-kall forkastet: {speculation.tool_name} {speculation.arguments}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for spekulative kall.
+
+        Returns:
+            Dictionary med antall startet, treff, bom og treffrate
+        """
+        resolved = self.hits + self.misses
+        return {
+            "tool": self.tool_name,
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": round(self.hits / resolved, 3) if resolved else 0.0
+        }
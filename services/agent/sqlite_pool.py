@@ -0,0 +1,180 @@
+"""
+Pooled SQLite Connections for ConversationMemory
+
+Tidligere åpnet hver metode i ConversationMemory en ny tilkobling med
+sqlite3.connect() og brukte standard rollback journal. Hver tilkobling måtte
+lese skjemaet på nytt, kompilere SQL-setningene på nytt og starte med tom
+sidecache, og skrivere og lesere (agenten, Datasette) låste hverandre ute.
+
+SQLitePool holder tilkoblingene åpne:
+
+  - Én skrivetilkobling, beskyttet av en lås (SQLite har uansett bare én skriver)
+  - En liten pool med lesetilkoblinger som lånes ut og leveres tilbake
+  - Kompilerte setninger gjenbrukes via sqlite3 sin statement cache per tilkobling
+    (cached_statements), som bare lønner seg når tilkoblingen lever lenge
+
+Pragmas (per tilkobling):
+
+  journal_mode=WAL      Lesere blokkerer ikke skriveren og omvendt
+  synchronous=NORMAL    Fsync ved checkpoint i stedet for ved hver commit.
+                        Trygt i WAL-modus (ingen korrupsjon), men de siste
+                        transaksjonene kan gå tapt ved strømbrudd
+  mmap_size             Lesing via minnemapping i stedet for read()
+  cache_size            Sidecache per tilkobling (KiB)
+  busy_timeout          Vent på låser i stedet for "database is locked"
+  temp_store=MEMORY     Midlertidige tabeller/sortering i minnet
+
+Måling før/etter: python bench_memory.py
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePool:
+    """Én skrivetilkobling og en pool med lesetilkoblinger til samme SQLite-fil."""
+
+    def __init__(self, db_path: str, readers: int = 4,
+                 mmap_size: int = 256 * 1024 * 1024,
+                 cache_size_kib: int = 16 * 1024,
+                 busy_timeout_ms: int = 5000,
+                 cached_statements: int = 256,
+                 auto_vacuum: Optional[str] = None):
+        """
+        Initialiser pool.
+
+        Args:
+            db_path: Sti til SQLite database fil
+            readers: Maksimalt antall lesetilkoblinger
+            mmap_size: Bytes av databasefilen som minnemappes
+            cache_size_kib: Sidecache per tilkobling i KiB
+            busy_timeout_ms: Hvor lenge en tilkobling venter på en lås
+            cached_statements: Antall kompilerte setninger som caches per tilkobling
+            auto_vacuum: auto_vacuum-modus (f.eks. "INCREMENTAL") for en ny database.
+                En eksisterende fil beholder sin modus til den skrives om med VACUUM
+        """
+        self.db_path = db_path
+        self.max_readers = max(1, readers)
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+
+        self._writer = self._connect()
+        self._writer_lock = threading.Lock()
+        if auto_vacuum:
+            # Gratis i en ny fil, men bare før WAL-hodet og første tabell skrives
+            self._writer.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+        # journal_mode lagres i databasefilen, så det holder å sette den én gang
+        self.journal_mode = self._writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if self.journal_mode.lower() != "wal":
+            logger.warning(f"SQLite støtter ikke WAL for {db_path}, bruker {self.journal_mode}")
+
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all_readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+        self.writes = 0
+        self.reads = 0
+        self.reader_waits = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Tilkoblingene brukes fra både event loop og arbeidstråder (asyncio.to_thread),
+        # men aldri av to tråder samtidig: skriveren er låst, lesere lånes ut én om gangen
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @contextmanager
+    def writer(self, on_commit: Optional[Callable[[], None]] = None,
+               on_rollback: Optional[Callable[[], None]] = None) -> Iterator[sqlite3.Connection]:
+        """
+        Lån skrivetilkoblingen for én transaksjon.
+
+        Committer når blokken fullføres, og ruller tilbake ved unntak.
+
+        Args:
+            on_commit: Kalles etter vellykket commit, mens skrivelåsen fortsatt
+                holdes (cacher oppdateres da i samme rekkefølge som skrivingene)
+            on_rollback: Kalles etter rollback, også mens skrivelåsen holdes
+        """
+        with self._writer_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                if on_rollback:
+                    on_rollback()
+                raise
+            self.writes += 1
+            if on_commit:
+                on_commit()
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Lån en lesetilkobling. Blokkerer hvis alle er i bruk."""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            # Avslutt eventuell lesetransaksjon slik at WAL checkpoint ikke holdes igjen
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+            self.reads += 1
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if len(self._all_readers) < self.max_readers:
+                conn = self._connect()
+                self._all_readers.append(conn)
+                return conn
+        self.reader_waits += 1
+        return self._readers.get()
+
+    def close(self):
+        """Lukk alle tilkoblinger (kjører en siste WAL checkpoint via skriveren)."""
+        if self._closed:
+            return
+        self._closed = True
+        for conn in self._all_readers:
+            conn.close()
+        with self._writer_lock:
+            self._writer.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for poolen.
+
+        Returns:
+            Dictionary med journal mode, antall lesetilkoblinger og bruk
+        """
+        return {
+            "journal_mode": self.journal_mode,
+            "readers_open": len(self._all_readers),
+            "readers_max": self.max_readers,
+            "writes": self.writes,
+            "reads": self.reads,
+            "reader_waits": self.reader_waits
+        }
@@ -0,0 +1,103 @@
+"""
+Background Reconciliation of Database Statistics
+
+get_database_stats leser tellertabeller som triggere holder oppdatert ved hver
+skriving, i stedet for COUNT(*) over hele conversations og sessions. Tellerne
+kan likevel komme ut av takt (f.eks. UPDATE av role eller timestamp direkte i
+Datasette, eller en database som er kopiert inn fra en eldre versjon).
+
+StatsReconciler kjører reconcile_stats sjelden i bakgrunnen: teller opp på nytt
+fra tabellene, retter avvik og rapporterer hva som var feil via get_stats().
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from async_memory import AsyncConversationMemory
+
+logger = logging.getLogger(__name__)
+
+
+class StatsReconciler:
+    """Bakgrunnsoppgave som avstemmer statistikktellerne mot tabellene."""
+
+    def __init__(self, db: AsyncConversationMemory, interval: float = 3600.0):
+        """
+        Initialiser avstemming.
+
+        Args:
+            db: Async databasefasade
+            interval: Sekunder mellom avstemminger (første kjøring etter interval,
+                tellerne fylles ved oppstart av ConversationMemory)
+        """
+        self.db = db
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.corrections = 0
+        self.last_drift: Dict[str, int] = {}
+        self.last_run: Optional[float] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """Start bakgrunnsoppgaven (returnerer umiddelbart)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def run_once(self) -> Dict[str, int]:
+        """
+        Avstem tellerne én gang.
+
+        Returns:
+            Avvikene som ble rettet (tom dict hvis alt stemte)
+        """
+        started = time.perf_counter()
+        drift = await self.db.reconcile_stats()
+        self.runs += 1
+        if drift:
+            self.corrections += 1
+        self.last_drift = drift
+        self.last_run = time.time()
+        self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        return drift
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"Avstemming av statistikk feilet: {e}")
+
+    async def close(self):
+        """Stopp bakgrunnsoppgaven."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for avstemmingen.
+
+        Returns:
+            Dictionary med antall kjøringer, rettede avvik og siste kjøring
+        """
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "corrections": self.corrections,
+            "last_drift": self.last_drift,
+            "last_run": self.last_run,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,24 @@
+"""
+Felles oppsett for agentens tester.
+
+Testene importerer modulene direkte (som i containeren, der alt ligger i /app),
+og tracing.py fra services/shared. Kjøres fra services/agent: python -m pytest -q
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+AGENT_DIR = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(AGENT_DIR), str(AGENT_DIR.parent / "shared")]
+
+from conversation_memory import ConversationMemory  # noqa: E402
+
+
+@pytest.fixture
+def memory(tmp_path):
+    """Tom ConversationMemory i en midlertidig database."""
+    memory = ConversationMemory(str(tmp_path / "conversations.db"))
+    yield memory
+    memory.close()
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, RateLimiter
+
+
+def _controller(**kwargs):
+    limiter = RateLimiter(requests_per_minute=10_000, tokens_per_minute=10_000_000)
+    return AdmissionController(limiter=limiter, **kwargs)
+
+
+def test_full_queue_rejects_unknown_priority_with_retry_after():
+    admission = _controller(max_queue=0)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.check_capacity("urgent")
+
+    assert rejected.value.retry_after_header.isdigit()
+    assert admission.get_stats()["rejected"] == {"interactive": 1, "batch": 0}
+
+
+def test_check_capacity_normalizes_priority():
+    admission = _controller()
+    assert admission.check_capacity("batch") == "batch"
+    assert admission.check_capacity("urgent") == "interactive"
+
+
+@pytest.mark.asyncio
+async def test_interactive_is_admitted_before_batch():
+    admission = _controller(max_concurrency=1)
+    order = []
+    release = asyncio.Event()
+
+    async def call(name, priority):
+        async with admission.slot(priority):
+            order.append(name)
+            if name == "first":
+                await release.wait()
+
+    first = asyncio.create_task(call("first", "interactive"))
+    await asyncio.sleep(0)
+    waiting = [asyncio.create_task(call("batch", "batch")),
+               asyncio.create_task(call("interactive", "interactive"))]
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(first, *waiting)
+
+    assert order == ["first", "interactive", "batch"]
+
+
+@pytest.mark.asyncio
+async def test_queued_call_past_deadline_is_rejected_and_frees_its_place():
+    admission = _controller(max_concurrency=1, deadlines={"interactive": 0.05, "batch": 0.05})
+    release = asyncio.Event()
+
+    async def hold():
+        async with admission.slot("interactive"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected):
+        async with admission.slot("batch"):
+            pass
+    release.set()
+    await holder
+
+    stats = admission.get_stats()
+    assert stats["expired"]["batch"] == 1
+    assert stats["queued"] == {"interactive": 0, "batch": 0} and stats["active"] == 0
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from archive import ConversationArchive
+from async_memory import AsyncConversationMemory
+from retention import RetentionTask
+
+CUTOFF = "2025-02-01 00:00:00"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return ConversationArchive(str(tmp_path / "archive"), frame_rows=50)
+
+
+def _expire(memory, *session_ids):
+    with memory.pool.writer() as conn:
+        conn.executemany("UPDATE sessions SET last_activity = '2025-01-05 00:00:00' WHERE session_id = ?",
+                         [(session_id,) for session_id in session_ids])
+
+
+def _session(memory, user_id, messages, message_user=None):
+    session_id = memory.create_session(user_id)
+    memory.add_messages(session_id, [{"role": "user", "content": f"m{n}", "timestamp": "2025-01-05 00:00:00"}
+                                     for n in range(messages)], user_id=message_user or user_id)
+    return session_id
+
+
+def test_archives_messages_stored_under_another_user_id(memory, archive):
+    # POST /sessions kan opprette sesjonen for u1, mens turene lagres med user_id "default"
+    session_id = _session(memory, "u1", 2, message_user="default")
+    _expire(memory, session_id)
+
+    result = memory.archive_old_conversations(archive, days_old=30)
+
+    assert result["messages"] == 2 and result["sessions"] == 1
+    assert memory.get_database_stats()["total_messages"] == 0
+    assert [row["content"] for row in archive.scan()] == ["m0", "m1"]
+
+
+def test_large_session_is_archived_over_several_batches(memory, archive):
+    big = _session(memory, "u", 25)
+    _expire(memory, big)
+
+    first = memory.archive_expired_batch(archive, CUTOFF, batch_size=10)
+    assert (first["messages"], first["sessions"], first["more"]) == (10, 0, True)
+    history = memory.get_conversation_history(big, 50, user_id="u")
+    assert [m["content"] for m in history][:1] == ["m10"] and len(history) == 15
+
+    totals = memory.archive_old_conversations(archive, days_old=30, batch_size=10)
+    assert totals["messages"] == 15 and totals["sessions"] == 1
+    rows = list(archive.scan())
+    assert [row["content"] for row in sorted(rows, key=lambda row: row["id"])] == [f"m{n}" for n in range(25)]
+
+
+@pytest.mark.asyncio
+async def test_conflicting_session_is_skipped_without_failing_the_run(memory, archive):
+    sessions = [_session(memory, "u", 3) for _ in range(5)]
+    _expire(memory, *sessions)
+    racing = sessions[0]
+    write = archive.write
+
+    def write_and_race(records):
+        segments = write(records)
+        if any(record["session_id"] == racing for record in records):
+            # Ny melding i sesjonen mens batchen arkiveres
+            memory.add_message(racing, "user", "ny", user_id="u")
+            _expire(memory, racing)
+        return segments
+
+    archive.write = write_and_race
+    task = RetentionTask(AsyncConversationMemory(memory), days=30, batch_size=100, pause=0, archive=archive)
+    totals = await task.run_once()
+
+    assert totals["skipped"] == 1 and totals["sessions"] == 4 and totals["messages"] == 12
+    assert task.get_stats()["skipped_sessions"] == 1
+    assert len(list(archive.scan())) == 12
+    assert [m["content"] for m in memory.get_conversation_history(racing, user_id="u")] == ["m0", "m1", "m2", "ny"]
+
+
+def test_recover_publishes_committed_and_discards_uncommitted_segments(memory, archive):
+    row = {"id": 1, "session_id": "s", "user_id": "u", "title": None, "role": "user",
+           "content": "x", "tool_calls": None, "metadata": None, "timestamp": "2025-01-05 00:00:00"}
+    committed = archive.write([row])
+    uncommitted = archive.write([dict(row, id=2)])
+    with memory.pool.writer() as conn:
+        conn.execute("""
+            INSERT INTO archive_segments (name, month, messages, sessions, min_id, max_id)
+            VALUES (:name, :month, :messages, :sessions, :min_id, :max_id)
+        """, committed[0])
+
+    with archive.locked():
+        result = archive.recover(memory._committed_segments)
+
+    assert result == {"published": 1, "discarded": 1}
+    assert [row["id"] for row in archive.scan()] == [1]
+    assert uncommitted[0]["name"] not in memory._committed_segments([uncommitted[0]["name"]])
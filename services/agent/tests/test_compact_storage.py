@@ -0,0 +1,94 @@
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from conversation_memory import ConversationMemory
+
+
+@pytest.fixture
+def compact_memory(tmp_path):
+    memory = ConversationMemory(str(tmp_path / "conversations.db"), compact=True)
+    yield memory
+    memory.close()
+
+
+def _fail_models(memory, prefix):
+    """Rull tilbake skrivinger som har lagt til en modell som begynner med prefix."""
+    storage = memory.compact_storage
+    train_if_ready = storage.train_if_ready
+
+    def failing(cursor):
+        if any(kind == "model" and value.startswith(prefix) for kind, value in storage._pending_ids):
+            raise RuntimeError("skriving feilet")
+        return train_if_ready(cursor)
+
+    storage.train_if_ready = failing
+
+
+def _assert_lookup_ids_committed(memory):
+    with memory.pool.reader() as conn:
+        rows = {(kind, value): value_id for value_id, kind, value
+                in conn.execute("SELECT id, kind, value FROM lookup_values")}
+    assert memory.compact_storage._ids == rows
+
+
+def test_rolled_back_write_does_not_publish_lookup_ids(compact_memory):
+    session_id = compact_memory.create_session()
+    _fail_models(compact_memory, "fail")
+
+    with pytest.raises(RuntimeError):
+        compact_memory.add_message(session_id, "assistant", "x", metadata={"model": "fail-1"})
+    compact_memory.add_message(session_id, "assistant", "y", metadata={"model": "ok"})
+
+    assert ("model", "fail-1") not in compact_memory.compact_storage._ids
+    assert not compact_memory.compact_storage._pending_ids
+    _assert_lookup_ids_committed(compact_memory)
+    history = compact_memory.get_conversation_history(session_id)
+    assert [(m["content"], m["metadata"]["model"]) for m in history] == [("y", "ok")]
+
+
+def test_other_writer_does_not_publish_uncommitted_lookup_ids(compact_memory):
+    # B har committet og sluppet skrivelåsen når A legger til en ny modell i sin
+    # transaksjon. B må ikke ta i bruk A sin id, som forsvinner ved rollback
+    session_id = compact_memory.create_session()
+    storage = compact_memory.compact_storage
+    pool_writer = compact_memory.pool.writer
+    train_if_ready = storage.train_if_ready
+    b_committed, a_encoded, b_done = threading.Event(), threading.Event(), threading.Event()
+
+    @contextmanager
+    def writer(*args, **kwargs):
+        with pool_writer(*args, **kwargs) as conn:
+            yield conn
+        if threading.current_thread().name == "b":
+            b_committed.set()
+            a_encoded.wait(5)
+
+    def failing(cursor):
+        if threading.current_thread().name == "a":
+            a_encoded.set()
+            b_done.wait(5)
+            raise RuntimeError("skriving feilet")
+        return train_if_ready(cursor)
+
+    compact_memory.pool.writer = writer
+    storage.train_if_ready = failing
+
+    def write_b():
+        compact_memory.add_message(session_id, "assistant", "b", metadata={"model": "ok"})
+        b_done.set()
+
+    def write_a():
+        b_committed.wait(5)
+        with pytest.raises(RuntimeError):
+            compact_memory.add_message(session_id, "assistant", "a", metadata={"model": "rolled-back"})
+
+    threads = [threading.Thread(target=write_b, name="b"), threading.Thread(target=write_a, name="a")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert ("model", "rolled-back") not in storage._ids
+    _assert_lookup_ids_committed(compact_memory)
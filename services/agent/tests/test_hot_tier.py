@@ -0,0 +1,75 @@
+from conversation_memory import ConversationMemory
+from hot_tier import HotTier
+
+
+def _message(message_id):
+    return {"id": message_id, "role": "user", "content": f"m{message_id}", "timestamp": None}
+
+
+def test_load_is_dropped_when_the_session_is_written_meanwhile():
+    hot = HotTier(tail_size=10)
+    hot.begin_load("s")
+    # Skrevet etter at lasteren tok øyeblikksbildet sitt
+    hot.append("s", "u", [(_message(3), 10)], counted=True)
+    hot.load("s", "u", [(_message(1), 10), (_message(2), 10)], complete=True, message_count=2)
+
+    assert hot.get("s", "u", 5) is None
+    # Neste lasting er ikke lenger påvirket
+    hot.begin_load("s")
+    hot.load("s", "u", [(_message(n), 10) for n in (1, 2, 3)], complete=True, message_count=3)
+    assert [m["id"] for m in hot.get("s", "u", 5)["messages"]] == [1, 2, 3]
+
+
+def test_invalidate_during_load_and_overlapping_loads():
+    hot = HotTier(tail_size=10)
+    hot.begin_load("s")
+    hot.begin_load("s")
+    hot.invalidate(["s"])
+    hot.load("s", "u", [(_message(1), 10)], complete=True, message_count=1)
+    # Den andre lastingen startet også før invalideringen
+    hot.load("s", "u", [(_message(1), 10)], complete=True, message_count=1)
+    assert hot.get("s", "u", 5) is None
+
+    hot.begin_load("s")
+    hot.cancel_load("s")
+    hot.begin_load("s")
+    hot.load("s", "u", [(_message(1), 10)], complete=True, message_count=1)
+    assert hot.get("s", "u", 5) is not None
+
+
+def test_tail_is_validated_against_another_writer(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    memory = ConversationMemory(path, hot_tier_bytes=1024 * 1024, hot_tail_size=10)
+    other = ConversationMemory(path)
+    try:
+        session_id = memory.create_session()
+        memory.add_messages(session_id, [{"role": "user", "content": f"m{n}"} for n in range(3)])
+        assert len(memory.get_conversation_history(session_id, 5)) == 3
+        assert len(memory.get_conversation_history(session_id, 5)) == 3
+        assert memory.hot.get_stats()["hits"] == 1
+
+        other.add_message(session_id, "assistant", "fra en annen replika")
+
+        history = memory.get_conversation_history(session_id, 5)
+        assert [m["content"] for m in history] == ["m0", "m1", "m2", "fra en annen replika"]
+        assert memory.hot.get_stats()["stale_hits"] == 1
+    finally:
+        other.close()
+        memory.close()
+
+
+def test_write_through_keeps_the_tail_and_short_tail_falls_back_to_disk(tmp_path):
+    memory = ConversationMemory(str(tmp_path / "conversations.db"), hot_tier_bytes=1024 * 1024, hot_tail_size=4)
+    try:
+        session_id = memory.create_session()
+        memory.add_messages(session_id, [{"role": "user", "content": f"m{n}"} for n in range(6)])
+        memory.get_conversation_history(session_id, 4)
+        memory.add_message(session_id, "assistant", "svar")
+
+        page = memory.get_messages_page(session_id, 4)
+        assert [m["content"] for m in page["messages"]] == ["m3", "m4", "m5", "svar"]
+        assert page["has_more"] and page["before_id"] == page["messages"][0]["id"]
+        # Lengre enn halen: leses fra disk
+        assert len(memory.get_conversation_history(session_id, 10)) == 7
+    finally:
+        memory.close()
@@ -0,0 +1,52 @@
+
+def _fill(memory, session_id, count, user_id="default"):
+    memory.add_messages(session_id, [{"role": "user", "content": f"m{n}"} for n in range(count)], user_id=user_id)
+
+
+def test_history_pages_walk_backwards_and_forwards(memory):
+    session_id = memory.create_session()
+    _fill(memory, session_id, 12)
+
+    pages = []
+    page = memory.get_messages_page(session_id, limit=5)
+    while True:
+        pages.append([m["content"] for m in page["messages"]])
+        if page["before_id"] is None:
+            break
+        page = memory.get_messages_page(session_id, limit=5, before_id=page["before_id"])
+    assert pages == [["m7", "m8", "m9", "m10", "m11"], ["m2", "m3", "m4", "m5", "m6"], ["m0", "m1"]]
+
+    first = memory.get_messages_page(session_id, limit=5, after_id=0)
+    assert [m["content"] for m in first["messages"]] == ["m0", "m1", "m2", "m3", "m4"] and first["has_more"]
+    last = memory.get_messages_page(session_id, limit=5, after_id=first["after_id"] + 5)
+    assert [m["content"] for m in last["messages"]] == ["m10", "m11"] and not last["has_more"]
+    # Ingen nye meldinger: cursoren står stille, klar for polling
+    empty = memory.get_messages_page(session_id, limit=5, after_id=last["after_id"])
+    assert empty["messages"] == [] and empty["after_id"] == last["after_id"]
+
+
+def test_history_page_is_limited_to_the_user(memory):
+    session_id = memory.create_session("u1")
+    _fill(memory, session_id, 3, user_id="u1")
+
+    assert memory.get_messages_page(session_id, user_id="u2")["messages"] == []
+
+
+def test_session_cursor_visits_every_session_once(memory):
+    sessions = [memory.create_session("u") for _ in range(7)]
+    # Lik last_activity: session_id avgjør rekkefølgen
+    with memory.pool.writer() as conn:
+        conn.execute("UPDATE sessions SET last_activity = '2025-01-01 00:00:00' WHERE session_id IN (?, ?, ?)",
+                     sessions[:3])
+    memory.create_session("andre")
+
+    seen, cursor = [], None
+    while True:
+        page = memory.get_sessions_page("u", limit=3, cursor=cursor)
+        seen += [session["session_id"] for session in page["sessions"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == sorted(sessions) and len(seen) == 7
+    assert seen[-3:] == sorted(sessions[:3], reverse=True)
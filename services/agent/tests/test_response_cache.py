@@ -0,0 +1,40 @@
+import json
+
+from response_cache import ResponseCache
+
+
+def _weather(city, temperature):
+    return json.dumps({"city": city, "temperature": temperature, "timestamp": "nå"})
+
+
+def _ask(cache, city, temperature):
+    arguments = {"city": city}
+    result = _weather(city, temperature)
+    cache.observe_tool_result("get_weather", arguments, result)
+    key = cache.make_key(f"Været i {city}?")
+    cache.put(key, f"{temperature} grader", [{"tool": "get_weather", "arguments": arguments, "result": result}])
+    return key
+
+
+def test_fingerprints_are_bounded():
+    cache = ResponseCache(max_entries=4)
+    for n in range(100):
+        _ask(cache, f"by{n}", n)
+
+    assert cache.get_stats()["entries"] == 4
+    assert cache.get_stats()["fingerprints"] <= 2 * cache.max_entries
+
+
+def test_cached_answers_keep_their_fingerprints():
+    cache = ResponseCache(max_entries=4)
+    oslo = _ask(cache, "oslo", 5)
+    for n in range(3):
+        _ask(cache, f"by{n}", n)
+    # Mange tool-kall som ikke gir cachede svar skyver ut gamle fingeravtrykk
+    for n in range(50):
+        cache.observe_tool_result("get_weather", {"city": f"annen{n}"}, _weather(f"annen{n}", n))
+
+    assert cache.get(oslo) == "5 grader"
+    cache.observe_tool_result("get_weather", {"city": "oslo"}, _weather("oslo", 7))
+    assert cache.get(oslo) is None
+    assert cache.invalidations == 1
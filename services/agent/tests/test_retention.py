@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from async_memory import AsyncConversationMemory
+from conversation_memory import ConversationMemory
+from retention import RetentionTask
+
+
+def _old_sessions(memory, sessions, messages, user_id="u"):
+    session_ids = []
+    for _ in range(sessions):
+        session_id = memory.create_session(user_id)
+        memory.add_messages(session_id, [{"role": "user", "content": "x" * 2000, "timestamp": "2025-01-05 00:00:00"}
+                                         for _ in range(messages)], user_id=user_id)
+        session_ids.append(session_id)
+    with memory.pool.writer() as conn:
+        conn.execute("UPDATE sessions SET last_activity = '2025-01-05 00:00:00'")
+    return session_ids
+
+
+def _checkpointed_size(memory, path):
+    with memory.pool.writer() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+
+def test_new_database_is_created_with_incremental_vacuum(tmp_path):
+    memory = ConversationMemory(str(tmp_path / "new.db"), auto_vacuum=True)
+    try:
+        assert memory.incremental_vacuum_enabled()
+        assert memory.enable_incremental_vacuum() == {"auto_vacuum": "incremental", "rewritten": False}
+    finally:
+        memory.close()
+
+
+def test_existing_database_is_migrated_once(tmp_path):
+    path = str(tmp_path / "old.db")
+    ConversationMemory(path).close()
+    # auto_vacuum=True endrer ikke en eksisterende fil
+    memory = ConversationMemory(path, auto_vacuum=True)
+    try:
+        with memory.pool.reader():
+            pass  # en pooled leser åpnet før migreringen
+        assert not memory.incremental_vacuum_enabled()
+        session_id = memory.create_session()
+        memory.add_message(session_id, "user", "beholdes")
+
+        assert memory.enable_incremental_vacuum() == {"auto_vacuum": "incremental", "rewritten": True}
+        assert memory.incremental_vacuum_enabled()
+        assert memory.enable_incremental_vacuum()["rewritten"] is False
+        assert [m["content"] for m in memory.get_conversation_history(session_id)] == ["beholdes"]
+    finally:
+        memory.close()
+
+
+@pytest.mark.asyncio
+async def test_retention_deletes_in_batches_and_shrinks_the_file(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    memory = ConversationMemory(path, auto_vacuum=True)
+    try:
+        expired = _old_sessions(memory, sessions=6, messages=20)
+        kept = memory.create_session("u")
+        memory.add_message(kept, "user", "ny", user_id="u")
+        size = _checkpointed_size(memory, path)
+        deleted = []
+
+        task = RetentionTask(AsyncConversationMemory(memory), days=30, batch_size=25, pause=0,
+                             on_deleted=deleted.extend)
+        totals = await task.run_once()
+
+        assert totals["messages"] == 120 and totals["sessions"] == 6
+        assert totals["batches"] > 1 and totals["freed_pages"] > 0
+        assert set(deleted) == set(expired)
+        assert memory.get_database_stats()["total_messages"] == 1
+        assert _checkpointed_size(memory, path) < size
+    finally:
+        memory.close()
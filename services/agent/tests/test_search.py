@@ -0,0 +1,38 @@
+import pytest
+
+
+def test_search_pages_follow_rank_without_gaps(memory):
+    session_id = memory.create_session("u", title="Tur")
+    memory.add_messages(session_id, [
+        {"role": "user", "content": " ".join(["regn"] * (n % 4 + 1) + ["i bergen"] * (n % 3))}
+        for n in range(25)
+    ], user_id="u")
+    memory.add_message(session_id, "user", "sol i oslo", user_id="u")
+
+    results, cursor = [], None
+    while True:
+        page = memory.search_messages("regn", limit=4, cursor=cursor)
+        results += page["results"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(results) == 25 == len({result["id"] for result in results})
+    assert [(r["rank"], r["id"]) for r in results] == sorted((r["rank"], r["id"]) for r in results)
+    assert results[0]["title"] == "Tur" and "<mark>regn</mark>" in results[0]["snippet"]
+
+
+def test_search_prefix_user_filter_and_operators(memory):
+    mine, other = memory.create_session("u1"), memory.create_session("u2")
+    memory.add_message(mine, "user", "Regnjakke til Bergen", user_id="u1")
+    memory.add_message(other, "user", "regnet i går", user_id="u2")
+
+    assert {r["user_id"] for r in memory.search_messages("regn*")["results"]} == {"u1", "u2"}
+    assert [r["user_id"] for r in memory.search_messages("regn*", user_id="u2")["results"]] == ["u2"]
+    # FTS5-syntaks i søketeksten tolkes som vanlige ord
+    assert memory.search_messages('bergen OR "går')["results"] == []
+
+
+def test_search_rejects_invalid_cursor(memory):
+    with pytest.raises(ValueError):
+        memory.search_messages("regn", cursor="ikke-en-cursor")
@@ -0,0 +1,12 @@
+def test_session_exists_until_retention_removes_it(memory):
+    session_id = memory.create_session("u")
+    memory.add_message(session_id, "user", "hei", user_id="u")
+    assert memory.session_exists(session_id)
+    assert not memory.session_exists("u_ukjent")
+
+    with memory.pool.writer() as conn:
+        conn.execute("UPDATE sessions SET last_activity = '2025-01-05 00:00:00'")
+        conn.execute("UPDATE conversations SET timestamp = '2025-01-05 00:00:00'")
+    memory.delete_old_conversations(days_old=30)
+
+    assert not memory.session_exists(session_id)
@@ -0,0 +1,102 @@
+import threading
+
+from conversation_memory import ConversationMemory
+
+
+def _drift(memory):
+    with memory.pool.reader() as conn:
+        actual, stored = memory._count_stats(conn.cursor())
+    return memory._stats_drift(actual, stored)
+
+
+def test_deleting_all_messages_of_a_role_leaves_no_drift(memory):
+    memory.add_messages("s1", [{"role": "user", "content": "hei"},
+                               {"role": "tool", "content": "{}"}])
+    memory.delete_old_conversations(days_old=-1)
+
+    assert memory.reconcile_stats() == {}
+    assert memory.reconcile_stats() == {}
+    stats = memory.get_database_stats()
+    assert stats["messages_by_role"] == {}
+    assert stats["total_messages"] == 0
+
+
+def test_zero_rows_from_older_trigger_are_removed_on_open(tmp_path):
+    path = str(tmp_path / "c.db")
+    memory = ConversationMemory(path)
+    with memory.pool.writer() as conn:
+        conn.execute("INSERT INTO stats_roles(role, messages) VALUES ('tool', 0)")
+    memory.close()
+
+    memory = ConversationMemory(path)
+    assert memory.get_database_stats()["messages_by_role"] == {}
+    assert memory.reconcile_stats() == {}
+    memory.close()
+
+
+def _corrupt(memory):
+    with memory.pool.writer() as conn:
+        conn.execute("UPDATE stats_counters SET value = value + 7 WHERE name = 'messages'")
+        conn.execute("UPDATE stats_roles SET messages = messages + 3 WHERE role = 'user'")
+        conn.execute("INSERT INTO stats_roles(role, messages) VALUES ('ghost', 5)")
+        conn.execute("DELETE FROM stats_users WHERE user_id = 'b'")
+        conn.execute("DELETE FROM stats_daily")
+
+
+def _seed(memory):
+    for user in ("a", "b", "c"):
+        session_id = memory.create_session(user_id=user)
+        memory.add_messages(session_id, [{"role": role, "content": "x"}
+                                         for role in ("user", "assistant") * 2], user_id=user)
+
+
+def test_reconcile_fixes_drift_once(memory):
+    _seed(memory)
+    _corrupt(memory)
+
+    drift = memory.reconcile_stats()
+    assert drift == {"messages": -7, "users": 1, "roles": 2, "days": 1, "user_rows": 1}
+    assert _drift(memory) == {}
+    assert memory.reconcile_stats() == {}
+
+
+def test_concurrent_reconcilers_do_not_apply_twice(tmp_path):
+    path = str(tmp_path / "c.db")
+    first, second = ConversationMemory(path), ConversationMemory(path)
+    _seed(first)
+    _corrupt(first)
+
+    threads = [threading.Thread(target=m.reconcile_stats) for m in (first, second, first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _drift(first) == {}
+    first.close()
+    second.close()
+
+
+def test_reconcile_is_correct_under_concurrent_writes(tmp_path):
+    path = str(tmp_path / "c.db")
+    memory, other = ConversationMemory(path), ConversationMemory(path)
+    _seed(memory)
+    _corrupt(memory)
+    stop = threading.Event()
+
+    def write():
+        session_id = other.create_session(user_id="w")
+        while not stop.is_set():
+            other.add_message(session_id, "user", "y", user_id="w")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        assert memory.reconcile_stats()
+    finally:
+        stop.set()
+        writer.join()
+
+    assert _drift(memory) == {}
+    memory.close()
+    other.close()
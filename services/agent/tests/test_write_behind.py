@@ -0,0 +1,78 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from write_behind import WriteBehindWriter
+
+
+def _fail_first_batch(memory):
+    """Få første add_message_batch til å feile som ved SQLITE_BUSY."""
+    calls = []
+    original = memory.add_message_batch
+
+    def add_message_batch(messages, assign_ids=None):
+        calls.append(len(messages))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return original(messages, assign_ids=assign_ids)
+
+    memory.add_message_batch = add_message_batch
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_before_newer_messages(memory):
+    calls = _fail_first_batch(memory)
+    writer = WriteBehindWriter(memory, batch_size=2, flush_interval=0.01)
+    for n in range(6):
+        writer.enqueue("s1", "user" if n % 2 == 0 else "assistant", f"m{n}")
+
+    for _ in range(200):
+        if writer.flushed_messages == 6:
+            break
+        await asyncio.sleep(0.01)
+    await writer.close()
+
+    assert writer.failed_batches == 1 and len(calls) >= 4
+    page = memory.get_messages_page("s1", limit=10)["messages"]
+    assert [m["content"] for m in page] == [f"m{n}" for n in range(6)]
+    ids = [m["id"] for m in page]
+    assert ids == sorted(ids)
+
+
+@pytest.mark.asyncio
+async def test_history_keeps_enqueue_order_while_retry_waits(memory):
+    _fail_first_batch(memory)
+    writer = WriteBehindWriter(memory, batch_size=2, flush_interval=0.2)
+    for n in range(4):
+        writer.enqueue("s1", "user", f"m{n}")
+
+    # Første batch har feilet og venter på nytt forsøk; ingenting nyere er skrevet
+    for _ in range(100):
+        if writer.failed_batches:
+            break
+        await asyncio.sleep(0.005)
+    history = writer.history("s1", lambda: memory.get_conversation_history("s1"))
+    assert [m["content"] for m in history] == ["m0", "m1", "m2", "m3"]
+    assert memory.get_conversation_history("s1") == []
+
+    await writer.close()
+    assert [m["content"] for m in memory.get_conversation_history("s1")] == ["m0", "m1", "m2", "m3"]
+
+
+@pytest.mark.asyncio
+async def test_flush_holds_back_later_messages_of_a_failed_session(memory):
+    _fail_first_batch(memory)
+    writer = WriteBehindWriter(memory, batch_size=2, flush_interval=60)
+    for n in range(4):
+        writer.enqueue("s1", "user", f"m{n}")
+    writer.enqueue("s2", "user", "other")
+
+    await writer.flush()
+
+    assert memory.get_conversation_history("s1") == []
+    assert [m["content"] for m in memory.get_conversation_history("s2")] == ["other"]
+    assert writer.pending_count() == 4
+    await writer.close()
+    assert [m["content"] for m in memory.get_conversation_history("s1")] == ["m0", "m1", "m2", "m3"]
@@ -0,0 +1,224 @@
+"""
+Latency Breakdown per Query
+
+TurnTimings måler veggklokketid for hver fase i en samtaletur og samler
+token-forbruk fra LLM-kallene:
+
+  history      Henting av samtalehistorikk
+  llm_1        Første LLM-kall (inkludert ventetid i admission control)
+  tool_<navn>  Hvert tool-kall (tool_<navn>#2 osv. ved flere kall til samme tool)
+  llm_2        Andre LLM-kall med tool-resultatene
+  persist      Lagring av meldingene
+  total        Hele turen
+
+Tidene returneres i "timings" feltet og som Server-Timing header:
+
+  Server-Timing: history;dur=1.2, llm_1;dur=812.4, tool_get_weather_forecast;dur=240.1, ...
+
+LatencyStats holder de siste turene i minnet og gir persentiler over et
+tidsvindu (GET /stats/latency).
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def usage_to_dict(usage: Any) -> Optional[Dict[str, int]]:
+    """
+    Hent token-tall fra response.usage (OpenAI CompletionUsage).
+
+    Returns:
+        {"prompt_tokens", "completion_tokens", "cached_tokens"} eller None uten usage
+    """
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0
+    }
+
+
+class TurnTimings:
+    """Fasetider og token-forbruk for én samtaletur."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.usage = {field: 0 for field in USAGE_FIELDS}
+        self.total_ms: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Mål en fase. Samme navn flere ganger får suffiks (#2, #3, ...)."""
+        if name in self.phases:
+            index = 2
+            while f"{name}#{index}" in self.phases:
+                index += 1
+            name = f"{name}#{index}"
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def add_usage(self, usage: Optional[Dict[str, int]]):
+        """Legg til token-forbruk fra et LLM-kall."""
+        for field in USAGE_FIELDS:
+            self.usage[field] += (usage or {}).get(field, 0)
+
+    def finish(self):
+        """Sett total tid for turen."""
+        self.total_ms = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            {"phases": {fase: ms}, "total_ms": ms, "usage": {...}}
+        """
+        total_ms = self.total_ms
+        if total_ms is None:
+            total_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        return {
+            "phases": dict(self.phases),
+            "total_ms": total_ms,
+            "usage": dict(self.usage)
+        }
+
+    def server_timing(self) -> str:
+        """Server-Timing header verdi (fasenavn uten tegn som ikke er tillatt i token)."""
+        entries = [f"{_token(name)};dur={ms}" for name, ms in self.phases.items()]
+        entries.append(f"total;dur={self.to_dict()['total_ms']}")
+        return ", ".join(entries)
+
+
+def _token(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "_-." else "_" for c in name)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Persentil med nearest-rank metoden (values må være sortert)."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(values)))
+    return values[rank - 1]
+
+
+class LatencyStats:
+    """Ringbuffer med de siste turene og persentiler over et tidsvindu."""
+
+    def __init__(self, max_samples: int = 5000):
+        """
+        Initialiser statistikk.
+
+        Args:
+            max_samples: Maksimalt antall turer som holdes i minnet
+        """
+        self._samples: Deque[Dict[str, Any]] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, timings: TurnTimings):
+        """Registrer en ferdig tur."""
+        sample = timings.to_dict()
+        sample["time"] = time.time()
+        with self._lock:
+            self._samples.append(sample)
+
+    def summary(self, window_seconds: float = 300,
+                percentiles: List[float] = (50, 90, 95, 99)) -> Dict[str, Any]:
+        """
+        Persentiler per fase og for token-forbruk over de siste window_seconds.
+
+        Faser med suffiks (#2, #3) slås sammen med første kall til samme tool.
+
+        Returns:
+            Dictionary med antall turer, persentiler per fase (ms) og tokens
+        """
+        since = time.time() - window_seconds
+        with self._lock:
+            samples = [s for s in self._samples if s["time"] >= since]
+
+        series: Dict[str, List[float]] = {"total": []}
+        tokens: Dict[str, List[float]] = {field: [] for field in USAGE_FIELDS}
+        for sample in samples:
+            series["total"].append(sample["total_ms"])
+            for name, ms in sample["phases"].items():
+                series.setdefault(name.split("#", 1)[0], []).append(ms)
+            for field in USAGE_FIELDS:
+                tokens[field].append(sample["usage"][field])
+
+        def describe(values: List[float]) -> Dict[str, float]:
+            values = sorted(values)
+            result = {f"p{int(p)}": percentile(values, p) for p in percentiles}
+            result["count"] = len(values)
+            result["max"] = values[-1] if values else 0.0
+            return result
+
+        prompt = sum(tokens["prompt_tokens"])
+        return {
+            "window_seconds": window_seconds,
+            "turns": len(samples),
+            "phases_ms": {name: describe(values) for name, values in series.items()},
+            "tokens": {field: describe(values) for field, values in tokens.items()},
+            "cached_token_ratio": round(sum(tokens["cached_tokens"]) / prompt, 3) if prompt else 0.0
+        }
+
+
+class PromptCacheStats:
+    """
+    Treff i leverandørens prompt cache (usage.prompt_tokens_details.cached_tokens).
+
+    Leverandøren cacher bare et byte-identisk prefiks (system prompt, tools og
+    eldste historikk), og først fra ca. 1024 tokens. prefix_changes teller hvor
+    ofte prefikset har endret seg - det bør bare skje når tools-manifestet endres.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.calls_with_hit = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prefix_hash: Optional[str] = None
+        self.prefix_changes = 0
+
+    def observe_prefix(self, prefix_hash: str):
+        """Registrer hash av prefikset (system prompt + tools) for et LLM-kall."""
+        if self.prefix_hash is not None and prefix_hash != self.prefix_hash:
+            self.prefix_changes += 1
+        self.prefix_hash = prefix_hash
+
+    def record(self, usage: Optional[Dict[str, int]]):
+        """Registrer token-forbruk fra ett LLM-kall."""
+        if not usage:
+            return
+        self.calls += 1
+        self.prompt_tokens += usage["prompt_tokens"]
+        self.cached_tokens += usage["cached_tokens"]
+        if usage["cached_tokens"]:
+            self.calls_with_hit += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for prompt caching.
+
+        Returns:
+            Dictionary med cachede tokens, treffrate og prefiks-hash
+        """
+        return {
+            "calls": self.calls,
+            "calls_with_cache_hit": self.calls_with_hit,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_token_ratio": round(self.cached_tokens / self.prompt_tokens, 3)
+            if self.prompt_tokens else 0.0,
+            "call_hit_rate": round(self.calls_with_hit / self.calls, 3) if self.calls else 0.0,
+            "prefix_hash": self.prefix_hash[:12] if self.prefix_hash else None,
+            "prefix_changes": self.prefix_changes
+        }
@@ -0,0 +1,152 @@
+"""
+Background Tool Discovery
+
+Tidligere ble tools hentet én gang i lifespan-oppstarten. Var ikke MCP serveren
+klar, kjørte agenten uten tools til noen restartet den, og nye tools ble aldri
+oppdaget.
+
+ToolDiscovery kjører load_tools_from_mcp_server i en bakgrunnsoppgave:
+
+  - Oppstart venter ikke på MCP serveren; første forsøk skjer i bakgrunnen
+  - Feilede forsøk prøves igjen med eksponentiell backoff (med jitter)
+  - Når tools er lastet, revalideres manifestet hvert refresh_interval sekund.
+    Agenten sender forrige manifest-hash i params._meta.ifNoneMatch, og MCP
+    serveren svarer med notModified uten tools hvis ingenting er endret
+  - Et spørsmål uten tools vekker løkken (kick) slik at neste forsøk skjer med en gang
+
+Readiness rapporteres via get_stats() og /ready uten å blokkere.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ToolDiscovery:
+    """Bakgrunnsoppgave som laster og revaliderer tools fra MCP serveren."""
+
+    def __init__(self, load: Callable[[], Awaitable[bool]],
+                 refresh_interval: float = 30.0,
+                 initial_backoff: float = 0.5,
+                 max_backoff: float = 30.0):
+        """
+        Initialiser discovery.
+
+        Args:
+            load: Korutinefunksjon som henter tools og returnerer True ved suksess
+            refresh_interval: Sekunder mellom revalideringer når tools er lastet
+            initial_backoff: Første ventetid i sekunder etter et feilet forsøk
+            max_backoff: Maksimal ventetid mellom forsøk
+        """
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.ready = False
+        self._ready_event = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.attempts = 0
+        self.failures = 0
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """Start bakgrunnsoppgaven (returnerer umiddelbart)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def kick(self):
+        """Be om et nytt forsøk med en gang (f.eks. når et spørsmål kommer uten tools)."""
+        self._wakeup.set()
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """
+        Vent inntil tools er lastet, maksimalt timeout sekunder.
+
+        Returns:
+            True hvis tools er lastet
+        """
+        if self.ready:
+            return True
+        self.kick()
+        waiter = asyncio.ensure_future(self._ready_event.wait())
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        finally:
+            waiter.cancel()
+        return self.ready
+
+    async def _attempt(self) -> bool:
+        self.attempts += 1
+        try:
+            ok = await self.load()
+        except Exception as e:
+            ok = False
+            self.last_error = str(e)
+        if ok:
+            self.last_success = time.time()
+            self.last_error = None
+            if not self.ready:
+                logger.info(f"Tools lastet etter {self.attempts} forsøk")
+            self.ready = True
+            self._ready_event.set()
+        else:
+            self.failures += 1
+            self.last_error = self.last_error or "load_tools_from_mcp_server feilet"
+        return ok
+
+    async def _sleep(self, seconds: float):
+        """Sov i seconds sekunder, eller til kick() kalles."""
+        waiter = asyncio.ensure_future(self._wakeup.wait())
+        try:
+            await asyncio.wait({waiter}, timeout=seconds)
+        finally:
+            waiter.cancel()
+
+    async def _run(self):
+        backoff = self.initial_backoff
+        while True:
+            # Et kick under forsøket gir et nytt forsøk med en gang
+            self._wakeup.clear()
+            if await self._attempt():
+                backoff = self.initial_backoff
+                await self._sleep(self.refresh_interval)
+            else:
+                # Jitter slik at flere agent-replikaer ikke treffer MCP serveren samtidig
+                delay = backoff * random.uniform(0.5, 1.0)
+                logger.warning(f"Tool discovery feilet ({self.last_error}), nytt forsøk om {delay:.1f}s")
+                await self._sleep(delay)
+                backoff = min(self.max_backoff, backoff * 2)
+
+    async def close(self):
+        """Stopp bakgrunnsoppgaven."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent status for tool discovery.
+
+        Returns:
+            Dictionary med readiness, forsøk og siste feil
+        """
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "failures": self.failures,
+            "last_success": self.last_success,
+            "last_error": self.last_error,
+            "refresh_interval_seconds": self.refresh_interval
+        }
@@ -0,0 +1,212 @@
+"""
+Token-Efficient Tool Result Encoding
+
+call_mcp_tool returnerer structuredContent som JSON med innrykk-fri, men
+ordrik formatering: koordinater, tidsstempler og de samme feltnavnene for hver
+prognosedag. Hele teksten sendes som tool-melding til det andre LLM-kallet og
+betales som input tokens.
+
+ToolResultEncoder bestemmer hvordan et tool-resultat presenteres for modellen.
+Resultatet fra call_mcp_tool er uendret (response cache, spekulasjon og
+metadata bruker fortsatt full JSON) - bare tool-meldingen til LLM kodes om.
+
+Encodere:
+---------
+  json     Dagens format, sendes uendret
+  compact  - fjerner felt i en deny list per tool ("current.timestamp")
+           - runder flyttall til TOOL_RESULT_DECIMALS desimaler
+           - lister med like objekter blir en tabell:
+               {"forecast": {"columns": ["date", "temp_min", ...],
+                             "rows": [["2026-10-19", 2, ...], ...]}}
+           - JSON uten mellomrom
+
+Token-besparelsen telles per kall (get_stats) og kan måles mot et eksempel:
+
+  python tool_encoding.py
+"""
+
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken er valgfri (eller mangler encoding-filen offline)
+    _ENCODING = None
+
+# Felt modellen ikke trenger for å svare på værspørsmål
+DEFAULT_DENY_LIST: Dict[str, List[str]] = {
+    "get_weather_forecast": ["location.coordinates", "current.timestamp"]
+}
+
+
+def count_tokens(text: str) -> int:
+    """
+    Tell tokens med tiktoken (o200k_base, som gpt-4o-mini) hvis tilgjengelig.
+
+    Uten tiktoken brukes samme grove estimat som admission control (ca. 4 tegn per token).
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return max(1, len(text) // 4)
+
+
+class ToolResultEncoder:
+    """Basisklasse: koder et tool-resultat (JSON-streng) til tekst for LLM."""
+
+    name = "json"
+
+    def __init__(self):
+        self.calls = 0
+        self.original_tokens = 0
+        self.encoded_tokens = 0
+
+    def transform(self, tool_name: str, data: Any) -> str:
+        """Kod parset tool-resultat. Overstyres av subklasser."""
+        return json.dumps(data, ensure_ascii=False)
+
+    def encode(self, tool_name: str, tool_result: str) -> str:
+        """
+        Kod et tool-resultat fra call_mcp_tool.
+
+        Resultater som ikke er JSON, og feilmeldinger, sendes uendret.
+
+        Args:
+            tool_name: Navn på toolet
+            tool_result: JSON-streng fra call_mcp_tool
+
+        Returns:
+            Tekst som sendes i tool-meldingen til LLM
+        """
+        try:
+            data = json.loads(tool_result)
+        except (TypeError, ValueError):
+            return tool_result
+        if isinstance(data, dict) and "error" in data:
+            return tool_result
+
+        encoded = self.transform(tool_name, data)
+
+        self.calls += 1
+        self.original_tokens += count_tokens(tool_result)
+        self.encoded_tokens += count_tokens(encoded)
+        return encoded
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for koding av tool-resultater.
+
+        Returns:
+            Dictionary med tokens før og etter koding og besparelse
+        """
+        return {
+            "encoder": self.name,
+            "tokenizer": "tiktoken/o200k_base" if _ENCODING is not None else "estimat (4 tegn/token)",
+            "calls": self.calls,
+            "original_tokens": self.original_tokens,
+            "encoded_tokens": self.encoded_tokens,
+            "reduction": round(1 - self.encoded_tokens / self.original_tokens, 3)
+            if self.original_tokens else 0.0
+        }
+
+
+class CompactEncoder(ToolResultEncoder):
+    """Deny list, avrunding og tabellformat for lister med like objekter."""
+
+    name = "compact"
+
+    def __init__(self, deny_list: Optional[Dict[str, Iterable[str]]] = None,
+                 decimals: int = 1):
+        """
+        Initialiser encoder.
+
+        Args:
+            deny_list: Felt som fjernes per tool. Punktum skiller nivåer og
+                lister hoppes over ("forecast.humidity" gjelder hvert element)
+            decimals: Antall desimaler for flyttall
+        """
+        super().__init__()
+        self.deny_list = {
+            tool: {tuple(path.split(".")) for path in paths}
+            for tool, paths in (DEFAULT_DENY_LIST if deny_list is None else deny_list).items()
+        }
+        self.decimals = decimals
+
+    def transform(self, tool_name: str, data: Any) -> str:
+        compacted = self._compact(data, (), self.deny_list.get(tool_name, set()))
+        return json.dumps(compacted, ensure_ascii=False, separators=(",", ":"))
+
+    def _compact(self, value: Any, path: tuple, deny: set) -> Any:
+        if isinstance(value, dict):
+            return {
+                key: self._compact(item, path + (key,), deny)
+                for key, item in value.items()
+                if path + (key,) not in deny
+            }
+        if isinstance(value, list):
+            items = [self._compact(item, path, deny) for item in value]
+            return self._table(items)
+        if isinstance(value, float):
+            rounded = round(value, self.decimals)
+            return int(rounded) if rounded.is_integer() else rounded
+        return value
+
+    @staticmethod
+    def _table(items: List[Any]) -> Any:
+        """Gjør en liste med objekter med samme nøkler om til kolonner og rader."""
+        if len(items) < 2 or not all(isinstance(item, dict) for item in items):
+            return items
+        columns = list(items[0])
+        if not columns or any(list(item) != columns for item in items[1:]):
+            return items
+        return {
+            "columns": columns,
+            "rows": [[item[column] for column in columns] for item in items]
+        }
+
+
+ENCODERS = {
+    "json": ToolResultEncoder,
+    "compact": CompactEncoder
+}
+
+
+def create_encoder(name: str, deny_list: Optional[Dict[str, Iterable[str]]] = None,
+                   decimals: int = 1) -> ToolResultEncoder:
+    """
+    Opprett encoder fra navn (TOOL_RESULT_ENCODING).
+
+    Ukjente navn gir json-encoderen slik at agenten alltid kan svare.
+    """
+    if name not in ENCODERS:
+        logger.warning(f"Ukjent tool-result encoder '{name}', bruker json")
+        name = "json"
+    if name == "compact":
+        return CompactEncoder(deny_list=deny_list, decimals=decimals)
+    return ENCODERS[name]()
+
+
+if __name__ == "__main__":
+    # Eksempel på get_weather_forecast resultat (samme struktur som MCP serveren)
+    sample = {
+        "location": {"name": "Bergen", "coordinates": [60.3943055, 5.3259192]},
+        "current": {
+            "temperature": 9.87, "feels_like": 7.42, "humidity": 87,
+            "description": "lett regn", "wind_speed": 5.14,
+            "timestamp": "2026-10-19T10:00:00.123456"
+        },
+        "forecast": [
+            {"date": f"2026-10-{19 + day}", "temp_min": 6.31 + day, "temp_max": 11.78 + day,
+             "description": "regn", "humidity": 84 + day, "wind_speed": 4.26 + day}
+            for day in range(5)
+        ]
+    }
+    original = json.dumps(sample, ensure_ascii=False)
+    for encoder_name in ENCODERS:
+        encoder = create_encoder(encoder_name)
+        encoded = encoder.encode("get_weather_forecast", original)
+        print(f"{encoder_name:8} {count_tokens(encoded):5} tokens  {len(encoded):5} tegn")
+    print(json.dumps(encoder.get_stats(), ensure_ascii=False, indent=2))
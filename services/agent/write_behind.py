@@ -0,0 +1,276 @@
+"""
+Write-Behind Persistence for Conversation Messages
+
+Tidligere lagret process_query hver melding med et eget add_message kall:
+ny SQLite-tilkobling, INSERT + UPDATE og synkron commit på event loop tråden.
+Fsync-tiden kom dermed rett på brukerens ventetid.
+
+WriteBehindWriter legger meldinger i en asyncio kø og returnerer umiddelbart.
+En bakgrunnsoppgave skriver dem i batcher med én transaksjon per batch:
+
+  - Batchen skrives når den når batch_size meldinger, eller
+  - når flush_interval sekunder har gått siden første melding i batchen
+  - close() tømmer køen med en siste holdbar flush ved nedstengning
+
+Meldinger som ennå ikke er skrevet er synlige via history(), slik at en sesjon
+alltid ser sine egne meldinger selv før de er lagret på disk. history() leser
+databasen uten å holde noen lås: ventende meldinger får id-en sin før commit, og
+de som lesingen allerede returnerte, fjernes fra de ventende.
+"""
+
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from conversation_memory import ConversationMemory
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindWriter:
+    """Asynkron, batchet skriving av samtalemeldinger til ConversationMemory."""
+
+    def __init__(self, memory: ConversationMemory, batch_size: int = 50,
+                 flush_interval: float = 0.2, tracer: Optional[Tracer] = None,
+                 run: Optional[Callable[..., Awaitable[Any]]] = None):
+        """
+        Initialiser writer.
+
+        Args:
+            memory: ConversationMemory som meldingene skrives til
+            batch_size: Maksimalt antall meldinger per transaksjon
+            flush_interval: Maksimal ventetid i sekunder før en batch skrives
+            tracer: Valgfri tracer for spans rundt database-skriving
+            run: Kjører blokkerende databasekall utenfor event loop
+                (standard asyncio.to_thread, agenten bruker AsyncConversationMemory.run)
+        """
+        self.memory = memory
+        self.tracer = tracer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._run_blocking = run or asyncio.to_thread
+
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # Settes når køen har nok meldinger til en full batch
+        self._batch_ready = asyncio.Event()
+        # Batch som feilet; skrives på nytt før noe nytt tas fra køen, slik at
+        # id-ene følger rekkefølgen meldingene ble lagt i køen
+        self._retry: List[Dict[str, Any]] = []
+        # Meldinger som ikke er committet ennå, per sesjon (i rekkefølge). En melding
+        # får "id" når den settes inn, før transaksjonen committes
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        # Kort lås rundt _pending og id-ene (aldri under databasekall)
+        self._lock = threading.Lock()
+        # Serialiserer commits, slik at samme melding ikke skrives av to flusher
+        self._write_lock = threading.Lock()
+
+        self.flushed_messages = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, session_id: str, role: str, content: str,
+                tool_calls: Optional[List[Dict]] = None,
+                metadata: Optional[Dict] = None,
+                user_id: str = "default"):
+        """
+        Legg en melding i køen for skriving. Returnerer uten å vente på disk.
+
+        Args:
+            session_id: Sesjon ID
+            role: Rolle (user, assistant, system, tool)
+            content: Meldingsinnhold
+            tool_calls: Eventuelle verktøykall
+            metadata: Ekstra metadata
+            user_id: Bruker ID
+        """
+        message = {
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            "tool_calls": tool_calls,
+            "metadata": metadata,
+            "user_id": user_id,
+            # Tidspunkt settes ved mottak, ikke ved flush
+            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        with self._lock:
+            self._pending.setdefault(session_id, []).append(message)
+        self._queue.put_nowait(message)
+        if self._queue.qsize() >= self.batch_size - 1:
+            self._batch_ready.set()
+        self._ensure_started()
+
+    def history(self, session_id: str,
+                load: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Hent samtalehistorikk inkludert meldinger som ikke er skrevet ennå.
+
+        Args:
+            session_id: Sesjon ID
+            load: Funksjon som leser lagret historikk fra databasen
+
+        Returns:
+            Lagrede meldinger etterfulgt av ventende meldinger, i historikkformat
+        """
+        with self._lock:
+            pending = list(self._pending.get(session_id, []))
+        messages = load()
+
+        # Meldinger som ble committet før lesingens øyeblikksbilde er med i messages.
+        # De har fått id før commit, så de kan kjennes igjen og hoppes over her
+        loaded_ids = {message.get("id") for message in messages}
+        with self._lock:
+            pending = [p for p in pending if p.get("id") is None or p["id"] not in loaded_ids]
+
+        for item in pending:
+            message = {
+                "role": item["role"],
+                "content": item["content"],
+                "timestamp": item["timestamp"]
+            }
+            if item["tool_calls"]:
+                message["tool_calls"] = item["tool_calls"]
+            if item["metadata"]:
+                message["metadata"] = item["metadata"]
+            messages.append(message)
+        return messages
+
+    def pending_count(self) -> int:
+        """Antall meldinger som venter på å bli skrevet."""
+        return sum(len(messages) for messages in self._pending.values())
+
+    def _commit(self, batch: List[Dict[str, Any]]):
+        """Skriv en batch i én transaksjon (kjøres i en arbeidstråd)."""
+        with self._write_lock:
+            with self._lock:
+                # Hopp over meldinger som allerede er skrevet av en annen flush
+                batch = [m for m in batch if any(m is p for p in self._pending.get(m["session_id"], []))]
+            if not batch:
+                return 0
+
+            def assign_ids(ids: List[int]):
+                with self._lock:
+                    for message, message_id in zip(batch, ids):
+                        message["id"] = message_id
+
+            try:
+                if self.tracer:
+                    with self.tracer.span("db.write_batch", messages=len(batch)):
+                        self.memory.add_message_batch(batch, assign_ids=assign_ids)
+                else:
+                    self.memory.add_message_batch(batch, assign_ids=assign_ids)
+            except BaseException:
+                # Transaksjonen ble rullet tilbake, id-ene finnes ikke
+                with self._lock:
+                    for message in batch:
+                        message.pop("id", None)
+                raise
+
+            written = {id(m) for m in batch}
+            with self._lock:
+                for session_id in {m["session_id"] for m in batch}:
+                    remaining = [p for p in self._pending[session_id] if id(p) not in written]
+                    if remaining:
+                        self._pending[session_id] = remaining
+                    else:
+                        del self._pending[session_id]
+        return len(batch)
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            self.flushed_messages += await self._run_blocking(self._commit, batch)
+            self.flushed_batches += 1
+        except Exception as e:
+            # Meldingene blir liggende i _pending og skrives på nytt før nyere meldinger
+            self.failed_batches += 1
+            logger.error(f"Write-behind flush feilet for {len(batch)} meldinger: {e}")
+            self._retry = batch
+            await asyncio.sleep(self.flush_interval)
+
+    async def _run(self):
+        """Bakgrunnsløkke som samler meldinger i batcher og skriver dem."""
+        while True:
+            if self._retry:
+                batch, self._retry = self._retry, []
+                await self._write(batch)
+                continue
+            batch = [await self._queue.get()]
+            self._batch_ready.clear()
+            if self._queue.qsize() < self.batch_size - 1:
+                # Ikke asyncio.wait_for(queue.get()): den kan henge ved cancel() i close()
+                ready = asyncio.ensure_future(self._batch_ready.wait())
+                try:
+                    await asyncio.wait({ready}, timeout=self.flush_interval)
+                finally:
+                    ready.cancel()
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._write(batch)
+
+    async def flush(self):
+        """
+        Skriv alle ventende meldinger nå (også de som var plukket ut til en batch).
+
+        En batch som feiler logges og blir liggende som ventende. Batchene for andre
+        sesjoner skrives likevel, men ikke senere meldinger i sesjonene som feilet
+        (de ville ellers fått lavere id enn meldingene før dem).
+        """
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._retry = []
+
+        with self._lock:
+            messages = [m for pending in self._pending.values() for m in pending]
+        failed_sessions = set()
+        while messages:
+            messages = [m for m in messages if m["session_id"] not in failed_sessions]
+            batch, messages = messages[:self.batch_size], messages[self.batch_size:]
+            if not batch:
+                break
+            try:
+                self.flushed_messages += await self._run_blocking(self._commit, batch)
+                self.flushed_batches += 1
+            except Exception as e:
+                self.failed_batches += 1
+                failed_sessions.update(m["session_id"] for m in batch)
+                logger.error(f"Write-behind flush feilet for {len(batch)} meldinger: {e}")
+
+    async def close(self):
+        """Stopp bakgrunnsløkken og gjør en siste holdbar flush."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        lost = self.pending_count()
+        if lost:
+            logger.error(f"Write-behind writer stoppet, {lost} meldinger kunne ikke skrives")
+        else:
+            logger.info("Write-behind writer stoppet, alle meldinger skrevet")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hent statistikk for write-behind pipelinen.
+
+        Returns:
+            Dictionary med ventende og skrevne meldinger
+        """
+        return {
+            "pending_messages": self.pending_count(),
+            "flushed_messages": self.flushed_messages,
+            "flushed_batches": self.flushed_batches,
+            "failed_batches": self.failed_batches,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": int(self.flush_interval * 1000)
+        }
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+LLM Stub - Lokal OpenAI-kompatibel stand-in for benchmarks
+
+Implementerer POST /chat/completions (og /v1/chat/completions), både vanlig og
+streaming (SSE), med skriptede svar slik at agenten kan benchmarkes ende-til-ende
+uten å bruke ekte tokens og uten leverandørens variasjon i ventetid.
+
+Skriptet oppførsel:
+-------------------
+  1. Siste melding er fra brukeren, forespørselen har get_weather_forecast og
+     spørsmålet nevner en by -> tool-kall get_weather_forecast {"location": by}
+  2. Siste melding er et tool-resultat -> malbasert svar fra resultatet
+  3. Ellers -> fast avvisning (agenten skal bare svare på vær)
+
+Ytelse og feil (miljøvariabler):
+--------------------------------
+  LLM_STUB_LATENCY_MS=300         Tid før første token / før svar
+  LLM_STUB_TOKENS_PER_SECOND=80   Genereringshastighet for svaret
+  LLM_STUB_ERROR_RATE=0.0         Andel forespørsler som får 500
+  LLM_STUB_RATE_LIMIT_RATE=0.0    Andel forespørsler som får 429 + retry-after
+  LLM_STUB_SEED=42                Frø for feilinjeksjon (deterministisk rekkefølge)
+  LLM_STUB_REQUESTS_PER_MINUTE    Verdier i x-ratelimit-* headerne
+  LLM_STUB_TOKENS_PER_MINUTE
+
+usage inneholder prompt_tokens (ca. 4 tegn per token), completion_tokens og
+prompt_tokens_details.cached_tokens. Prompt caching simuleres som hos
+leverandøren: prefikser på minst 1024 tokens som er sett før, i blokker på 128 tokens.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Konfigurer logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "300"))
+TOKENS_PER_SECOND = float(os.getenv("LLM_STUB_TOKENS_PER_SECOND", "80"))
+ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+RATE_LIMIT_RATE = float(os.getenv("LLM_STUB_RATE_LIMIT_RATE", "0"))
+REQUESTS_PER_MINUTE = int(os.getenv("LLM_STUB_REQUESTS_PER_MINUTE", "1000"))
+TOKENS_PER_MINUTE = int(os.getenv("LLM_STUB_TOKENS_PER_MINUTE", "1000000"))
+
+CHARS_PER_TOKEN = 4
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+WEATHER_TOOL = "get_weather_forecast"
+
+# Byer stubben kjenner igjen (i tillegg til "i <By>" / "in <City>")
+CITIES = [
+    "Oslo", "Bergen", "Trondheim", "Stavanger", "Tromsø", "Kristiansand", "Bodø",
+    "Ålesund", "Lillehammer", "Geilo", "København", "Stockholm", "Helsinki",
+    "London", "Paris", "Berlin", "Roma", "Madrid", "Barcelona", "Amsterdam",
+    "New York", "Tokyo", "Sydney"
+]
+
+app = FastAPI(
+    title="LLM Stub",
+    description="OpenAI-kompatibel stand-in for benchmarks",
+    version="1.0.0"
+)
+
+random_source = random.Random(int(os.getenv("LLM_STUB_SEED", "42")))
+
+# Hash av prefikser som er sett (for simulert prompt caching), begrenset størrelse
+seen_prefixes: "OrderedDict[str, None]" = OrderedDict()
+MAX_PREFIXES = 10000
+
+stats = {"requests": 0, "streaming": 0, "tool_calls": 0, "errors": 0, "rate_limited": 0}
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def cached_tokens(prompt: str) -> int:
+    """Antall prompt tokens som ville vært cachet (lengste kjente prefiks i hele blokker)."""
+    block = CACHE_BLOCK_TOKENS * CHARS_PER_TOKEN
+    blocks = len(prompt) // block
+    cached = 0
+    for index in range(1, blocks + 1):
+        digest = hashlib.sha256(prompt[:index * block].encode("utf-8")).hexdigest()
+        if digest in seen_prefixes:
+            seen_prefixes.move_to_end(digest)
+            cached = index * CACHE_BLOCK_TOKENS
+        else:
+            seen_prefixes[digest] = None
+            if len(seen_prefixes) > MAX_PREFIXES:
+                seen_prefixes.popitem(last=False)
+    return cached if cached >= CACHE_MIN_TOKENS else 0
+
+
+def find_city(text: str) -> Optional[str]:
+    """Finn en by i teksten (kjent by, ellers ord med stor forbokstav etter i/in/for)."""
+    for city in CITIES:
+        if re.search(r"(?<!\w)" + re.escape(city) + r"(?!\w)", text, re.IGNORECASE):
+            return city
+    match = re.search(r"\b(?:i|in|for)\s+([A-ZÆØÅ][\wæøåÆØÅ-]+)", text)
+    return match.group(1) if match else None
+
+
+def describe_weather(tool_content: str) -> str:
+    """Malbasert svar fra et get_weather_forecast resultat (json eller compact encoding)."""
+    try:
+        data = json.loads(tool_content)
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict) or "error" in data:
+        return "Beklager, jeg fikk ikke hentet værdata akkurat nå. Prøv gjerne igjen om litt!"
+
+    name = (data.get("location") or {}).get("name", "stedet")
+    current = data.get("current") or {}
+    parts = [f"Været i {name} akkurat nå"]
+    if "temperature" in current:
+        parts.append(f"er {current['temperature']}°C")
+    if current.get("description"):
+        parts.append(f"med {current['description']}")
+    answer = " ".join(parts) + "."
+    forecast = data.get("forecast")
+    if isinstance(forecast, dict) and "rows" in forecast:
+        answer += f" Jeg har prognose for {len(forecast['rows'])} dager fremover."
+    elif isinstance(forecast, list) and forecast:
+        answer += f" Jeg har prognose for {len(forecast)} dager fremover."
+    return answer + " Som bergenser synes jeg litt regn bare er koselig!"
+
+
+def script_response(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Bestem skriptet svar for en forespørsel.
+
+    Returns:
+        {"content": tekst eller None, "tool_calls": liste eller None}
+    """
+    messages = body.get("messages") or []
+    last = messages[-1] if messages else {}
+    tool_names = [t.get("function", {}).get("name") for t in body.get("tools") or []]
+    tools_allowed = body.get("tool_choice") != "none"
+
+    if last.get("role") == "tool":
+        return {"content": describe_weather(last.get("content") or ""), "tool_calls": None}
+
+    if last.get("role") == "user" and WEATHER_TOOL in tool_names and tools_allowed:
+        city = find_city(last.get("content") or "")
+        if city:
+            arguments = json.dumps({"location": city}, ensure_ascii=False)
+            call_id = "call_" + hashlib.sha1(f"{city}{len(messages)}".encode("utf-8")).hexdigest()[:16]
+            return {
+                "content": None,
+                "tool_calls": [{
+                    "id": call_id,
+                    "type": "function",
+                    "function": {"name": WEATHER_TOOL, "arguments": arguments}
+                }]
+            }
+
+    return {
+        "content": "Hei! Jeg er Ingrid fra Ingrids Reisetjenester. Jeg kan dessverre bare hjelpe "
+                   "med værmeldinger - hvilken by lurer du på?",
+        "tool_calls": None
+    }
+
+
+def rate_limit_headers(prompt_tokens: int) -> Dict[str, str]:
+    return {
+        "x-ratelimit-limit-requests": str(REQUESTS_PER_MINUTE),
+        "x-ratelimit-remaining-requests": str(REQUESTS_PER_MINUTE - 1),
+        "x-ratelimit-reset-requests": "60ms",
+        "x-ratelimit-limit-tokens": str(TOKENS_PER_MINUTE),
+        "x-ratelimit-remaining-tokens": str(max(0, TOKENS_PER_MINUTE - prompt_tokens)),
+        "x-ratelimit-reset-tokens": "60ms"
+    }
+
+
+def error_response(status: int, message: str, error_type: str,
+                   headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": message, "type": error_type, "code": None}},
+        headers=headers
+    )
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy", "service": "LLM Stub"}
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        **stats,
+        "config": {
+            "latency_ms": LATENCY_MS,
+            "tokens_per_second": TOKENS_PER_SECOND,
+            "error_rate": ERROR_RATE,
+            "rate_limit_rate": RATE_LIMIT_RATE
+        }
+    }
+
+
+@app.post("/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """OpenAI Chat Completions API (delmengde som agenten bruker)."""
+    body = await request.json()
+    stats["requests"] += 1
+
+    # Feilinjeksjon
+    roll = random_source.random()
+    if roll < RATE_LIMIT_RATE:
+        stats["rate_limited"] += 1
+        return error_response(429, "Rate limit reached (stub)", "rate_limit_exceeded",
+                              headers={"retry-after": "1", **rate_limit_headers(0)})
+    if roll < RATE_LIMIT_RATE + ERROR_RATE:
+        stats["errors"] += 1
+        return error_response(500, "Injected error (stub)", "server_error")
+
+    prompt = json.dumps([body.get("messages"), body.get("tools")], ensure_ascii=False, sort_keys=True)
+    prompt_tokens = count_tokens(prompt)
+    cached = cached_tokens(prompt)
+
+    scripted = script_response(body)
+    if scripted["tool_calls"]:
+        stats["tool_calls"] += 1
+    completion_text = scripted["content"] or json.dumps(scripted["tool_calls"])
+    completion_tokens = count_tokens(completion_text)
+
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached}
+    }
+    completion_id = f"chatcmpl-stub-{stats['requests']}"
+    model = body.get("model", "gpt-4o-mini")
+    created = int(time.time())
+    finish_reason = "tool_calls" if scripted["tool_calls"] else "stop"
+    headers = rate_limit_headers(prompt_tokens)
+
+    await asyncio.sleep(LATENCY_MS / 1000.0)
+
+    if not body.get("stream"):
+        # Hele svaret "genereres" før det returneres
+        await asyncio.sleep(completion_tokens / TOKENS_PER_SECOND)
+        message = {"role": "assistant", "content": scripted["content"]}
+        if scripted["tool_calls"]:
+            message["tool_calls"] = scripted["tool_calls"]
+        return JSONResponse(content={
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": usage
+        }, headers=headers)
+
+    stats["streaming"] += 1
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta: Dict[str, Any], finish: Optional[str] = None,
+              choices: bool = True, **extra: Any) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if choices else [],
+            **extra
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def events():
+        yield chunk({"role": "assistant", "content": ""})
+        pieces: List[Dict[str, Any]] = []
+        if scripted["content"]:
+            pieces = [{"content": word} for word in re.findall(r"\S+\s*", scripted["content"])]
+        for index, call in enumerate(scripted["tool_calls"] or []):
+            pieces.append({"tool_calls": [{
+                "index": index, "id": call["id"], "type": "function",
+                "function": {"name": call["function"]["name"], "arguments": ""}
+            }]})
+            pieces.append({"tool_calls": [{
+                "index": index, "function": {"arguments": call["function"]["arguments"]}
+            }]})
+        delay = completion_tokens / TOKENS_PER_SECOND / max(1, len(pieces))
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            yield chunk(piece)
+        yield chunk({}, finish=finish_reason)
+        if include_usage:
+            yield chunk({}, choices=False, usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+if __name__ == "__main__":
+    logger.info("Starter LLM Stub på port 8002...")
+    uvicorn.run(app, host="0.0.0.0", port=8002)
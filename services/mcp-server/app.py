@@ -24,6 +24,7 @@ For MCP specification, see: https://modelcontextprotocol.io/specification/2025-1
 """
 
 import asyncio
+import hashlib
 import json
 import logging
 import os
@@ -35,6 +36,8 @@ import uvicorn
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
+from tracing import Tracer
+
 # Konfigurer logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -59,6 +62,9 @@ if not OPENWEATHER_API_KEY:
 # HTTP klient
 http_client = httpx.AsyncClient()
 
+# Distribuert sporing - traceparent kommer fra agenten i JSON-RPC params._meta
+tracer = Tracer.from_env("mcp-server")
+
 # Request/Response modeller
 
 # JSON-RPC 2.0 modeller
@@ -110,7 +116,8 @@ async def geocode_location(location: str) -> Optional[Dict[str, float]]:
             "addressdetails": 1
         }
         
-        response = await http_client.get(f"{NOMINATIM_API_BASE}/search", params=params)
+        with tracer.span("http.nominatim.search", kind="CLIENT", location=location):
+            response = await http_client.get(f"{NOMINATIM_API_BASE}/search", params=params)
         response.raise_for_status()
         
         data = response.json()
@@ -147,12 +154,14 @@ async def get_weather_forecast(location: str) -> Dict[str, Any]:
             "lang": "no"
         }
         
-        current_response = await http_client.get(f"{WEATHER_API_BASE}/weather", params=current_params)
+        with tracer.span("http.openweather.weather", kind="CLIENT"):
+            current_response = await http_client.get(f"{WEATHER_API_BASE}/weather", params=current_params)
         current_response.raise_for_status()
         current_data = current_response.json()
         
         # Hent 5-dagers prognose
-        forecast_response = await http_client.get(f"{WEATHER_API_BASE}/forecast", params=current_params)
+        with tracer.span("http.openweather.forecast", kind="CLIENT"):
+            forecast_response = await http_client.get(f"{WEATHER_API_BASE}/forecast", params=current_params)
         forecast_response.raise_for_status()
         forecast_data = forecast_response.json()
         
@@ -362,6 +371,16 @@ async def handle_jsonrpc(request: JSONRPCRequest):
 
     ============================================================================
     """
+    # Fortsett agentens trace hvis den sendte traceparent i params._meta
+    meta = (request.params or {}).get("_meta") or {}
+    with tracer.span(f"jsonrpc.{request.method}", kind="SERVER",
+                     traceparent=meta.get("traceparent")) as span:
+        if request.params and request.params.get("name"):
+            span.set_tag("tool", request.params["name"])
+        return await _handle_jsonrpc(request)
+
+async def _handle_jsonrpc(request: JSONRPCRequest) -> JSONRPCResponse:
+    """Route JSON-RPC request til riktig method handler (se handle_jsonrpc)."""
     try:
         # Valider JSON-RPC versjon
         if request.jsonrpc != "2.0":
@@ -377,7 +396,8 @@ async def handle_jsonrpc(request: JSONRPCRequest):
         # Route til riktig method handler
         if request.method == "tools/list":
             # Hent liste over tilgjengelige tools
-            result = await handle_tools_list()
+            meta = (request.params or {}).get("_meta") or {}
+            result = await handle_tools_list(if_none_match=meta.get("ifNoneMatch"))
             return JSONRPCResponse(
                 id=request.id,
                 result=result
@@ -437,11 +457,15 @@ async def handle_jsonrpc(request: JSONRPCRequest):
             )
         )
 
-async def handle_tools_list() -> Dict[str, Any]:
+async def handle_tools_list(if_none_match: Optional[str] = None) -> Dict[str, Any]:
     """
     Handler for tools/list method.
     Returnerer liste over tilgjengelige tools i MCP format.
 
+    Resultatet har _meta.manifestHash (sha256 av manifestet). Sender klienten
+    samme hash i params._meta.ifNoneMatch, svarer vi som HTTP 304: ingen tools
+    og _meta.notModified=true. Agenten revaliderer dermed billig med jevne mellomrom.
+
     ============================================================================
     WORKSHOP MERKNAD: MCP Tools Manifest - Dynamisk Tool Discovery
     ============================================================================
@@ -453,8 +477,8 @@ async def handle_tools_list() -> Dict[str, Any]:
     --------------------------------
     1. Legg til tool definition i tools arrayen nedenfor
     2. Legg til routing logikk i handle_tools_call() funksjonen
-    3. Restart tjenester: docker compose restart mcp-server travel-agent
-    4. Agenten laster automatisk og bruker det nye toolet!
+    3. Restart MCP server: docker compose restart mcp-server
+    4. Agenten oppdager endret manifest-hash og laster det nye toolet automatisk!
 
     MCP SPESIFIKASJON FELTER:
     -------------------------
@@ -532,7 +556,11 @@ async def handle_tools_list() -> Dict[str, Any]:
         # Bare kopier strukturen over og tilpass for ditt brukstilfelle
     ]
 
-    return {"tools": tools}
+    manifest_hash = hashlib.sha256(json.dumps(tools, sort_keys=True).encode("utf-8")).hexdigest()
+    if if_none_match == manifest_hash:
+        return {"tools": [], "_meta": {"manifestHash": manifest_hash, "notModified": True}}
+
+    return {"tools": tools, "_meta": {"manifestHash": manifest_hash}}
 
 async def handle_tools_call(tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
     """
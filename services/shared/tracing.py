@@ -0,0 +1,307 @@
+"""
+Lightweight Distributed Tracing
+
+Enkel sporing på tvers av web, agent og MCP server uten eksterne avhengigheter.
+Filen ligger bare her i services/shared. Hver tjeneste har sin egen Docker build
+context, så den kopieres inn ved bygging (additional_contexts "shared" i
+docker-compose.yml og COPY --from=shared i Dockerfile). Utenfor Docker:
+PYTHONPATH=services/shared.
+
+Propagering:
+------------
+  web -> agent:      HTTP header "traceparent" (W3C Trace Context)
+  agent -> MCP:      JSON-RPC params._meta.traceparent
+
+  traceparent = "00-<trace_id 32 hex>-<span_id 16 hex>-<flags 01|00>"
+
+Eksport:
+--------
+Spans eksporteres i Zipkin v2 JSON format, som leses av Zipkin, Jaeger og
+OpenTelemetry Collector (zipkin receiver):
+
+  TRACE_EXPORT_FILE=/app/logs/traces.jsonl   -> én span per linje
+  TRACE_COLLECTOR_URL=http://zipkin:9411/api/v2/spans -> batchet HTTP POST
+
+Begge bufres i minnet og skrives av en bakgrunnstråd hvert flush_interval
+sekund (og ved avslutning), aldri fra event loop.
+
+HTTP-spans (start_span + finish_after_body) avsluttes først når hele
+responsen er sendt, så strømmede svar (SSE, NDJSON) får riktig varighet.
+
+Sampling:
+---------
+  TRACE_SAMPLE_RATE=0.1 -> 10 % av nye traces eksporteres (0 = av, 1 = alle)
+
+Beslutningen tas der tracen starter (web) og følger med i traceparent, slik at
+en trace enten eksporteres komplett eller ikke i det hele tatt.
+"""
+
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """En tidsmålt operasjon i en trace."""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str],
+                 sampled: bool, kind: Optional[str] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.tags: Dict[str, str] = {}
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        # Gjeldende span da denne ble startet (settes tilbake av Tracer.detach)
+        self.previous: Optional["Span"] = None
+
+    def set_tag(self, key: str, value: Any):
+        """Legg til en tag (verdier lagres som strenger)."""
+        self.tags[key] = str(value)
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent for videre propagering."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_zipkin(self, service_name: str) -> Dict[str, Any]:
+        """Konverter til Zipkin v2 JSON."""
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.start * 1_000_000),
+            "duration": max(1, int((self.duration or 0) * 1_000_000)),
+            "localEndpoint": {"serviceName": service_name},
+            "tags": self.tags
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        if self.kind:
+            span["kind"] = self.kind
+        return span
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Parse W3C traceparent header.
+
+    Returns:
+        {"trace_id", "parent_id", "sampled"} eller None ved ugyldig verdi
+    """
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return {"trace_id": parts[1], "parent_id": parts[2], "sampled": bool(flags & 1)}
+
+
+class Tracer:
+    """Oppretter spans og eksporterer samplede spans til fil eller collector."""
+
+    def __init__(self, service_name: str, sample_rate: float = 0.0,
+                 export_file: Optional[str] = None,
+                 collector_url: Optional[str] = None,
+                 flush_interval: float = 2.0):
+        """
+        Initialiser tracer.
+
+        Args:
+            service_name: Navn på tjenesten i eksporterte spans
+            sample_rate: Andel nye traces som eksporteres (0.0 - 1.0)
+            export_file: JSONL fil for spans
+            collector_url: Zipkin-kompatibelt endepunkt for spans
+            flush_interval: Sekunder mellom batchede POST til collector
+        """
+        self.service_name = service_name
+        self.sample_rate = sample_rate
+        self.export_file = export_file
+        self.collector_url = collector_url
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        # Spans som venter på collector og på export_file
+        self._buffer: List[Dict[str, Any]] = []
+        self._file_buffer: List[str] = []
+        self._flusher: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, service_name: str) -> "Tracer":
+        """Opprett tracer fra TRACE_* miljøvariabler."""
+        return cls(
+            service_name=os.getenv("TRACE_SERVICE_NAME", service_name),
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0")),
+            export_file=os.getenv("TRACE_EXPORT_FILE") or None,
+            collector_url=os.getenv("TRACE_COLLECTOR_URL") or None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and bool(self.export_file or self.collector_url)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def traceparent(self) -> Optional[str]:
+        """traceparent for gjeldende span, eller None utenfor en trace."""
+        span = _current_span.get()
+        return span.traceparent if span else None
+
+    def headers(self) -> Dict[str, str]:
+        """HTTP headere for propagering til neste tjeneste."""
+        value = self.traceparent()
+        return {"traceparent": value} if value else {}
+
+    @contextmanager
+    def span(self, name: str, kind: Optional[str] = None,
+             traceparent: Optional[str] = None, **tags: Any) -> Iterator[Span]:
+        """
+        Mål en operasjon som en span.
+
+        Args:
+            name: Navn på operasjonen (f.eks. "llm.chat_completion")
+            kind: Zipkin kind ("SERVER", "CLIENT" eller None)
+            traceparent: Innkommende traceparent (kun for rot-span i en tjeneste)
+            tags: Ekstra tags på spanen
+        """
+        span = self.start_span(name, kind, traceparent, **tags)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_tag("error", type(e).__name__)
+            raise
+        finally:
+            self.detach(span)
+            self.finish_span(span)
+
+    def start_span(self, name: str, kind: Optional[str] = None,
+                   traceparent: Optional[str] = None, **tags: Any) -> Span:
+        """
+        Start en span og gjør den til gjeldende span (som span(), men uten blokk).
+
+        Kallet må følges av detach() og finish_span().
+        """
+        parent = _current_span.get()
+        remote = parse_traceparent(traceparent) if parent is None else None
+
+        if parent is not None:
+            span = Span(name, parent.trace_id, parent.span_id, parent.sampled, kind)
+        elif remote is not None:
+            span = Span(name, remote["trace_id"], remote["parent_id"], remote["sampled"], kind)
+        else:
+            sampled = self.enabled and random.random() < self.sample_rate
+            span = Span(name, "%032x" % random.getrandbits(128), None, sampled, kind)
+
+        for key, value in tags.items():
+            span.set_tag(key, value)
+
+        span.previous = parent
+        _current_span.set(span)
+        return span
+
+    def detach(self, span: Span):
+        """Gjør spanen som var gjeldende før start_span() gjeldende igjen."""
+        # Sett forrige span direkte (ikke reset(token)) slik at spans i
+        # async generatorer ikke feiler hvis de avsluttes i en annen Context
+        _current_span.set(span.previous)
+
+    def finish_span(self, span: Span):
+        """Avslutt en span og eksporter den hvis tracen er samplet."""
+        if span.duration is not None:
+            return
+        span.duration = time.time() - span.start
+        if span.sampled and self.enabled:
+            self._export(span)
+
+    def finish_after_body(self, span: Span, response: Any) -> Any:
+        """
+        Avslutt spanen når hele responsen er sendt, ikke når handleren returnerer.
+
+        Args:
+            span: Span fra start_span()
+            response: Starlette response (fra call_next i en HTTP middleware)
+
+        Returns:
+            Samme response, med body_iterator som avslutter spanen til slutt
+        """
+        body = getattr(response, "body_iterator", None)
+        if body is None:
+            self.finish_span(span)
+            return response
+
+        async def traced_body():
+            try:
+                async for chunk in body:
+                    yield chunk
+            except BaseException as e:
+                span.set_tag("error", type(e).__name__)
+                raise
+            finally:
+                self.finish_span(span)
+
+        response.body_iterator = traced_body()
+        return response
+
+    def _export(self, span: Span):
+        record = span.to_zipkin(self.service_name)
+        with self._lock:
+            if self.export_file:
+                self._file_buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+            if self.collector_url:
+                self._buffer.append(record)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_loop(self):
+        """Skriv bufrede spans til fil og collector i batcher (bakgrunnstråd)."""
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Skriv alle bufrede spans til fil og collector nå."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            lines, self._file_buffer = self._file_buffer, []
+        if lines:
+            try:
+                with open(self.export_file, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+            except OSError as e:
+                logger.warning(f"Kunne ikke skrive {len(lines)} spans til {self.export_file}: {e}")
+        if not batch or not self.collector_url:
+            return
+        request = urllib.request.Request(
+            self.collector_url,
+            data=json.dumps(batch).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            logger.warning(f"Kunne ikke sende {len(batch)} spans til {self.collector_url}: {e}")
@@ -9,17 +9,21 @@ import asyncio
 import json
 import logging
 import os
+import uuid
 from datetime import datetime
-from typing import Dict, Any
+from typing import Callable, Dict, Any, Optional, Tuple
 
 import httpx
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
+from session_router import SessionRouter, parse_agent_urls
+from tracing import Tracer
+
 # Konfigurer logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,6 +41,9 @@ templates = Jinja2Templates(directory="templates")
 # HTTP klient for agent kall
 http_client = httpx.AsyncClient()
 
+# Distribuert sporing - traces starter her og følger med til agent og MCP server
+tracer = Tracer.from_env("travel-web")
+
 # Request/Response modeller
 class QueryRequest(BaseModel):
     query: str
@@ -46,20 +53,31 @@ class QueryResponse(BaseModel):
     response: str
     timestamp: str
     agent_connected: bool
+    timings: Optional[Dict[str, Any]] = None
 
 class HealthResponse(BaseModel):
     status: str
     timestamp: str
     agent_connected: bool
+    agents: Optional[Dict[str, bool]] = None
+    routing: Optional[Dict[str, Any]] = None
 
-# Agent service URL
+# Agent service URL - én URL, eller kommaseparert liste med replikaer
 AGENT_SERVICE_URL = os.getenv("AGENT_SERVICE_URL", "http://travel-agent:8001")
+AGENT_SERVICE_URLS = parse_agent_urls(AGENT_SERVICE_URL)
+
+# Session affinity: samme sesjon går alltid til samme replika (varme cacher)
+router = SessionRouter(AGENT_SERVICE_URLS, virtual_nodes=int(os.getenv("AGENT_VIRTUAL_NODES", "100")))
+
+# Cookie med nettleserens sesjon hos agenten
+SESSION_COOKIE = "ingrid_session"
+SESSION_COOKIE_MAX_AGE = int(os.getenv("SESSION_COOKIE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
 
 @app.on_event("startup")
 async def startup_event():
     """Initialiser ved oppstart."""
     logger.info("Starter Ingrids Reisetjenester Web Interface...")
-    logger.info(f"Agent service URL: {AGENT_SERVICE_URL}")
+    logger.info(f"Agent service replikaer: {', '.join(AGENT_SERVICE_URLS)}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -67,6 +85,107 @@ async def shutdown_event():
     await http_client.aclose()
     logger.info("Web interface avsluttet")
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Start en ny trace (eller fortsett en innkommende) for hver forespørsel."""
+    if request.url.path == "/health":
+        return await call_next(request)
+    span = tracer.start_span(f"{request.method} {request.url.path}", kind="SERVER",
+                             traceparent=request.headers.get("traceparent"))
+    try:
+        response = await call_next(request)
+    except BaseException as e:
+        span.set_tag("error", type(e).__name__)
+        tracer.finish_span(span)
+        raise
+    finally:
+        tracer.detach(span)
+    span.set_tag("http.status_code", response.status_code)
+    response.headers["traceparent"] = span.traceparent
+    # SSE-videresendingen er ikke ferdig før hele body er sendt
+    return tracer.finish_after_body(span, response)
+
+async def send_to_agent(key: str, build: Callable[[str], httpx.Request],
+                        stream: bool = False) -> httpx.Response:
+    """
+    Send en forespørsel til replikaen som eier key (session ID).
+
+    Args:
+        key: Nøkkel for konsistent hashing
+        build: Lager forespørselen for en gitt agent-URL
+        stream: Ikke les responsen (for SSE videresending)
+
+    Raises:
+        httpx.ConnectError: Hvis ingen replika svarer
+    """
+    nodes = router.nodes_for(key)
+    for attempt, node in enumerate(nodes):
+        try:
+            response = await http_client.send(build(node), stream=stream)
+        except httpx.ConnectError:
+            if attempt == len(nodes) - 1:
+                raise
+            logger.warning(f"Agent replika {node} svarer ikke, prøver neste")
+            continue
+        router.record(node, failover=attempt > 0)
+        return response
+
+async def create_session() -> str:
+    """Opprett en ny sesjon hos agenten."""
+    # Sesjonen lagres i den delte databasen, så hvilken som helst replika kan opprette den
+    response = await send_to_agent(uuid.uuid4().hex, lambda node: http_client.build_request(
+        "POST",
+        f"{node}/sessions",
+        json={"title": f"Web {datetime.now().strftime('%Y-%m-%d %H:%M')}"},
+        headers=tracer.headers(),
+        timeout=10.0
+    ))
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+async def get_session(request: Request) -> Tuple[str, bool]:
+    """
+    Hent nettleserens sesjon fra cookie, eller opprett en ny hos agenten.
+
+    Returns:
+        (session_id, True hvis sesjonen er ny og cookien må settes)
+    """
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if session_id:
+        return session_id, False
+    return await create_session(), True
+
+async def send_query(request: Request, path: str, payload: Dict[str, Any], timeout: Any,
+                     stream: bool = False) -> Tuple[httpx.Response, str, bool]:
+    """
+    Send et spørsmål til agenten i nettleserens sesjon.
+
+    Svarer agenten 404 for sesjonen i cookien (f.eks. slettet av retention),
+    opprettes en ny sesjon og spørsmålet sendes på nytt.
+
+    Returns:
+        (respons, session_id, True hvis sesjonen er ny og cookien må settes)
+    """
+    session_id, new_session = await get_session(request)
+    while True:
+        response = await send_to_agent(session_id, lambda node: http_client.build_request(
+            "POST",
+            f"{node}{path}",
+            json={**payload, "session_id": session_id},
+            headers=tracer.headers(),
+            timeout=timeout
+        ), stream=stream)
+        if response.status_code != 404 or new_session:
+            return response, session_id, new_session
+        if stream:
+            await response.aclose()
+        logger.info(f"Sesjon {session_id} fra cookie finnes ikke hos agenten, oppretter ny")
+        session_id, new_session = await create_session(), True
+
+def set_session_cookie(response: Response, session_id: str):
+    response.set_cookie(SESSION_COOKIE, session_id, max_age=SESSION_COOKIE_MAX_AGE,
+                        httponly=True, samesite="lax")
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Hjem side med web interface."""
@@ -75,41 +194,50 @@ async def home(request: Request):
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Helse sjekk."""
-    # Sjekk om agent service er tilgjengelig
-    agent_connected = False
-    try:
-        response = await http_client.get(f"{AGENT_SERVICE_URL}/health", timeout=5.0)
-        agent_connected = response.status_code == 200
-    except:
-        pass
+    # Sjekk om agent-replikaene er tilgjengelige
+    async def check(url: str) -> bool:
+        try:
+            response = await http_client.get(f"{url}/health", timeout=5.0)
+            return response.status_code == 200
+        except:
+            return False
+
+    results = await asyncio.gather(*(check(url) for url in AGENT_SERVICE_URLS))
+    agents = dict(zip(AGENT_SERVICE_URLS, results))
     
     return HealthResponse(
         status="healthy",
         timestamp=datetime.now().isoformat(),
-        agent_connected=agent_connected
+        agent_connected=any(results),
+        agents=agents,
+        routing=router.get_stats()
     )
 
 @app.post("/query", response_model=QueryResponse)
-async def process_query(query_request: QueryRequest):
+async def process_query(query_request: QueryRequest, request: Request, http_response: Response):
     """Prosesser brukerforespørsel via agent service."""
     try:
         logger.info(f"Sender query til agent service: {query_request.query}")
-        
-        # Kall agent service
-        response = await http_client.post(
-            f"{AGENT_SERVICE_URL}/query",
-            json={"query": query_request.query},
-            timeout=30.0
+        # Kall agent-replikaen som eier sesjonen
+        response, session_id, new_session = await send_query(
+            request, "/query", {"query": query_request.query}, timeout=30.0
         )
         response.raise_for_status()
         
         result = response.json()
-        
+        if new_session:
+            set_session_cookie(http_response, session_id)
+
+        # Send agentens fasetider videre til nettleseren (vises i DevTools)
+        if "Server-Timing" in response.headers:
+            http_response.headers["Server-Timing"] = response.headers["Server-Timing"]
+
         return QueryResponse(
             success=True,
             response=result.get("response", "Ingen svar mottatt"),
             timestamp=datetime.now().isoformat(),
-            agent_connected=True
+            agent_connected=True,
+            timings=result.get("timings")
         )
         
     except httpx.TimeoutException:
@@ -118,10 +246,66 @@ async def process_query(query_request: QueryRequest):
     except httpx.ConnectError:
         logger.error("Kan ikke koble til agent service")
         raise HTTPException(status_code=503, detail="Agent service ikke tilgjengelig")
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 503:
+            # Agenten er overbelastet - send Retry-After videre til nettleseren
+            logger.warning("Agent service avviste forespørselen (503)")
+            raise HTTPException(
+                status_code=503,
+                detail="Agent service er overbelastet, prøv igjen snart",
+                headers={"Retry-After": e.response.headers.get("Retry-After", "5")}
+            )
+        logger.error(f"Feil ved prosessering: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         logger.error(f"Feil ved prosessering: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def process_query_stream(query_request: QueryRequest, request: Request):
+    """Videresend Server-Sent Events fra agent service uten buffering."""
+    logger.info(f"Sender stream query til agent service: {query_request.query}")
+
+    try:
+        response, session_id, new_session = await send_query(
+            request, "/query/stream", {"query": query_request.query},
+            timeout=httpx.Timeout(30.0, read=None), stream=True
+        )
+    except httpx.TimeoutException:
+        logger.error("Timeout ved kall til agent service")
+        raise HTTPException(status_code=504, detail="Agent service timeout")
+    except httpx.ConnectError:
+        logger.error("Kan ikke koble til agent service")
+        raise HTTPException(status_code=503, detail="Agent service ikke tilgjengelig")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Kunne ikke opprette sesjon: {e}")
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+
+    if response.status_code != 200:
+        await response.aread()
+        await response.aclose()
+        headers = {}
+        if "Retry-After" in response.headers:
+            headers["Retry-After"] = response.headers["Retry-After"]
+        raise HTTPException(status_code=response.status_code, detail=response.text, headers=headers or None)
+
+    async def relay():
+        try:
+            # aiter_raw gir bytes videre så snart de kommer fra agenten
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    streaming_response = StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    if new_session:
+        set_session_cookie(streaming_response, session_id)
+    return streaming_response
+
 @app.get("/examples")
 async def examples():
     """Eksempel forespørsler."""
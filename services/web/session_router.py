@@ -0,0 +1,114 @@
+"""
+Session Affinity Routing til Agent-replikaer
+
+Agenten holder ingen sesjonstilstand som ikke også finnes i ConversationMemory,
+så hvilken som helst replika kan svare for hvilken som helst sesjon. Men
+per-sesjon cachene (hot tier, prompt cache hos leverandøren) er bare varme på
+replikaen som sist håndterte sesjonen.
+
+SessionRouter sender derfor alle forespørsler for en sesjon til samme replika
+med konsistent hashing:
+
+  - AGENT_SERVICE_URL kan være én URL eller en kommaseparert liste
+  - Hver replika får virtual_nodes punkter på en hash-ring (SHA-1)
+  - En sesjon går til første punkt med hash >= hash(session_id)
+  - Legges en replika til eller fjernes, flyttes bare ca. 1/N av sesjonene
+
+Svarer ikke replikaen (ConnectError), prøves neste replika på ringen. Det skjer
+ved enhver tilkoblingsfeil, også kortvarige der eieren fortsatt kjører med varme
+cacher, så sesjonen kan veksle mellom replikaer. Det er trygt fordi hot tier
+sjekkes mot databasen (message_count og siste id) før bruk, og response cache
+har historikken i nøkkelen: en replika som får sesjonen tilbake, laster på nytt
+det andre har skrevet i mellomtiden. Meldinger som ennå ligger i den andre
+replikaens write-behind kø (høyst MEMORY_FLUSH_INTERVAL_MS) er ikke synlige før
+de er skrevet.
+"""
+
+import bisect
+import hashlib
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def parse_agent_urls(value: str) -> List[str]:
+    """Kommaseparert liste med agent-URLer (uten avsluttende /), uten duplikater."""
+    urls = []
+    for url in value.split(","):
+        url = url.strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+class SessionRouter:
+    """Konsistent hash-ring som velger agent-replika per sesjon."""
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = 100):
+        """
+        Initialiser ring.
+
+        Args:
+            nodes: Agent-URLer
+            virtual_nodes: Punkter per replika på ringen (jevnere fordeling)
+        """
+        if not nodes:
+            raise ValueError("Minst én agent-URL kreves")
+        self.nodes = list(nodes)
+        ring = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in ring]
+        self._ring_nodes = [node for _, node in ring]
+
+        self.routed: Dict[str, int] = {node: 0 for node in self.nodes}
+        self.failovers = 0
+
+    def nodes_for(self, key: str) -> List[str]:
+        """
+        Replikaer for en nøkkel i prioritert rekkefølge.
+
+        Første element er eieren av nøkkelen, resten er reserver for failover.
+        """
+        if len(self.nodes) == 1:
+            return list(self.nodes)
+        start = bisect.bisect_left(self._hashes, _hash(key))
+        ordered: List[str] = []
+        for i in range(len(self._ring_nodes)):
+            node = self._ring_nodes[(start + i) % len(self._ring_nodes)]
+            if node not in ordered:
+                ordered.append(node)
+                if len(ordered) == len(self.nodes):
+                    break
+        return ordered
+
+    def node_for(self, key: str) -> str:
+        """Replikaen som eier nøkkelen."""
+        return self.nodes_for(key)[0]
+
+    def record(self, node: str, failover: bool = False):
+        """Tell en forespørsel sendt til node (failover=True hvis eieren ikke svarte)."""
+        self.routed[node] = self.routed.get(node, 0) + 1
+        if failover:
+            self.failovers += 1
+            logger.warning(f"Failover: sesjon sendt til {node}")
+
+    def get_stats(self) -> Dict[str, object]:
+        """
+        Hent statistikk for rutingen.
+
+        Returns:
+            Dictionary med replikaer, forespørsler per replika og antall failovers
+        """
+        return {
+            "nodes": self.nodes,
+            "routed": dict(self.routed),
+            "failovers": self.failovers
+        }